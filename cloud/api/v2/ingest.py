@@ -6,11 +6,9 @@ from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
 from pydantic import BaseModel, Field, validator
 from datetime import datetime
 from typing import Optional
-import os
 from ...auth.dependencies import get_current_user
 from ...streaming.processor import process_telemetry
-from ...audit.logger import AuditLogger
-from ...db.database import SessionLocal
+from ...audit.writer import get_audit_writer
 from ...observability.metrics import telemetry_counter
 import logging
 
@@ -53,19 +51,20 @@ async def ingest_telemetry(
         if current_user.get("role") != "admin":
             raise HTTPException(status_code=403, detail="User ID mismatch")
 
+    telemetry = event.dict()
+    # The tenant comes from the token, never the payload; it scopes tenant
+    # policy rules and geo restrictions downstream
+    if current_user.get("tenant_id") is not None:
+        telemetry["tenant_id"] = str(current_user["tenant_id"])
+
     # Add processing task
-    background_tasks.add_task(process_telemetry, event.dict())
+    background_tasks.add_task(process_telemetry, telemetry)
 
     # Increment metric
     telemetry_counter.labels(endpoint="v2").inc()
 
-    # Audit log (async – we can fire and forget, but background_tasks ensures it runs)
-    audit = AuditLogger(
-        secret_key=os.getenv("AUDIT_SECRET", "default-audit-secret-change-me"),
-        db_session_factory=SessionLocal
-    )
-    background_tasks.add_task(
-        audit.log,
+    # Audit log: queued for the batched writer, no DB round trip here
+    get_audit_writer().log(
         event_type="telemetry_ingested",
         user_id=event.user_id,
         details={"session_id": event.session_id},
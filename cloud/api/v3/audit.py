@@ -0,0 +1,208 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import csv
+import io
+import json
+import os
+from ...auth.dependencies import get_current_user
+from ...audit.chain import AuditChain
+from ...db.database import SessionLocal
+
+router = APIRouter(prefix="/audit", tags=["audit"])
+
+# Platform accounts only: audit_logs is not partitioned by tenant, so tenant
+# admins and auditors (api/v3/auth.py) must not read it; require_auditor
+# turns away any account with a tenant, whatever its role
+AUDIT_ROLES = set(os.getenv("AUDIT_ROLES", "admin").split(","))
+EXPORT_PAGE_SIZE = int(os.getenv("AUDIT_EXPORT_PAGE_SIZE", "5000"))
+# Rows fetched from the server-side cursor at a time
+FETCH_SIZE = 1000
+
+# Where a time-bounded read can start: chained entries from ``start`` on all
+# have a seq of at least the first one's, unless pre-chain entries are in range
+_START_SEQ = text("""
+    SELECT MIN(seq), COUNT(*) FILTER (WHERE seq IS NULL) FROM audit_logs
+    WHERE timestamp >= :start
+""")
+
+COLUMNS = ["id", "timestamp", "event_type", "user_id", "session_id", "details",
+           "signature", "seq", "prev_hash", "entry_hash"]
+
+
+def require_auditor(current_user: dict = Depends(get_current_user)) -> dict:
+    if current_user.get("tenant_id") is not None or current_user["role"] not in AUDIT_ROLES:
+        raise HTTPException(status_code=403, detail="Platform admin or auditor access required")
+    return current_user
+
+
+def parse_cursor(cursor: Optional[str]) -> Optional[Tuple[int, int]]:
+    """``<seq>_<id>`` of the last row seen (seq 0 for entries from before the hash chain)."""
+    if not cursor:
+        return None
+    try:
+        seq, _, entry_id = cursor.partition("_")
+        return int(seq), int(entry_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def make_cursor(row) -> str:
+    return f"{row.seq or 0}_{row.id}"
+
+
+def _page_query(event_type: Optional[str], user_id: Optional[str], start: Optional[datetime],
+                end: Optional[datetime], after: Optional[Tuple[int, int]], limit: int):
+    conditions, params = [], {"limit": limit}
+    if event_type is not None:
+        conditions.append("event_type = :event_type")
+        params["event_type"] = event_type
+    if user_id is not None:
+        conditions.append("user_id = :user_id")
+        params["user_id"] = user_id
+    if start is not None:
+        conditions.append("timestamp >= :start")
+        params["start"] = start
+    if end is not None:
+        conditions.append("timestamp < :end")
+        params["end"] = end
+    if after is not None:
+        # Row comparison: served from the (COALESCE(seq, 0), id) index, no OFFSET
+        conditions.append("(COALESCE(seq, 0), id) > (:after_seq, :after_id)")
+        params["after_seq"], params["after_id"] = after
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    query = f"SELECT {', '.join(COLUMNS)} FROM audit_logs {where} ORDER BY COALESCE(seq, 0), id LIMIT :limit"
+    return text(query), params
+
+
+def iter_entries(event_type: Optional[str] = None, user_id: Optional[str] = None, start: Optional[datetime] = None,
+                 end: Optional[datetime] = None, after: Optional[Tuple[int, int]] = None,
+                 page_size: int = EXPORT_PAGE_SIZE) -> Iterator[Any]:
+    """
+    Audit rows matching the filters in chain order, one keyset page per short
+    transaction, each read through a server-side cursor; memory is bounded by
+    ``FETCH_SIZE`` rows whatever the export size.
+
+    Entries from before the hash chain (no seq) come first, by id; no more of
+    them are ever written. Chained entries follow by seq, which the chain's
+    row lock hands out in commit order, so a page never skips an entry that
+    commits later. Timestamps are set when an entry is queued, not when it
+    is written, so they can't serve as the key; with ``start`` and no
+    ``after``, the first page seeks to the range's lowest seq instead of
+    walking the chain from its beginning.
+    """
+    if after is None and start is not None:
+        db: Session = SessionLocal()
+        try:
+            first_seq, unchained = db.execute(_START_SEQ, {"start": start}).one()
+        finally:
+            db.close()
+        if not unchained:
+            if first_seq is None:
+                return
+            # Ids start at 1, so (first_seq, 0) sorts just before the range's first entry
+            after = (first_seq, 0)
+    while True:
+        query, params = _page_query(event_type, user_id, start, end, after, page_size)
+        db: Session = SessionLocal()
+        try:
+            result = db.execute(query, params, execution_options={"stream_results": True, "yield_per": FETCH_SIZE})
+            count = 0
+            for row in result:
+                count += 1
+                after = (row.seq or 0, row.id)
+                yield row
+        finally:
+            db.close()
+        if count < page_size:
+            return
+
+
+def _record(row, chain: Optional[AuditChain]) -> Dict[str, Any]:
+    record = {column: getattr(row, column) for column in COLUMNS}
+    record["timestamp"] = row.timestamp.isoformat()
+    if chain is not None:
+        problems = chain.check_entry(row)
+        record["verified"] = not problems
+        if problems:
+            record["problems"] = problems
+    return record
+
+
+def _ndjson(rows: Iterator[Any], chain: Optional[AuditChain]) -> Iterator[str]:
+    for row in rows:
+        yield json.dumps(_record(row, chain), default=str) + "\n"
+
+
+def _csv(rows: Iterator[Any], chain: Optional[AuditChain]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    header = COLUMNS + (["verified", "problems"] if chain is not None else [])
+    writer.writerow(header)
+    for i, row in enumerate(rows, start=1):
+        record = _record(row, chain)
+        record["details"] = json.dumps(record["details"], sort_keys=True, default=str)
+        if chain is not None:
+            record["problems"] = "; ".join(record.get("problems", []))
+        writer.writerow([record[column] for column in header])
+        # Hand the buffer over every few hundred rows
+        if i % 500 == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _chain() -> AuditChain:
+    return AuditChain(os.getenv("AUDIT_SECRET", "default-audit-secret-change-me"))
+
+
+@router.get("/logs")
+def list_audit_logs(
+    event_type: Optional[str] = None,
+    user_id: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    limit: int = Query(100, ge=1, le=1000),
+    verify: bool = False,
+    current_user: dict = Depends(require_auditor)
+):
+    """One page of audit entries in chain order."""
+    chain = _chain() if verify else None
+    items: List[Dict[str, Any]] = []
+    last = None
+    rows = iter_entries(event_type, user_id, start, end, parse_cursor(cursor), page_size=limit)
+    try:
+        for row in rows:
+            items.append(_record(row, chain))
+            last = row
+            if len(items) == limit:
+                break
+    finally:
+        rows.close()
+    next_cursor = make_cursor(last) if last is not None and len(items) == limit else None
+    return {"items": items, "next_cursor": next_cursor}
+
+
+@router.get("/export")
+def export_audit_logs(
+    format: str = Query("ndjson", regex="^(ndjson|csv)$"),
+    event_type: Optional[str] = None,
+    user_id: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    cursor: Optional[str] = Query(None, description="Resume after this entry (<seq>_<id>)"),
+    verify: bool = Query(False, description="Check each entry's signature and chain hash"),
+    current_user: dict = Depends(require_auditor)
+):
+    """Stream every matching audit entry as NDJSON or CSV."""
+    rows = iter_entries(event_type, user_id, start, end, parse_cursor(cursor))
+    chain = _chain() if verify else None
+    if format == "csv":
+        return StreamingResponse(_csv(rows, chain), media_type="text/csv",
+                                 headers={"Content-Disposition": "attachment; filename=audit_logs.csv"})
+    return StreamingResponse(_ndjson(rows, chain), media_type="application/x-ndjson")
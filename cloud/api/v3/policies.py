@@ -0,0 +1,183 @@
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel, Field
+from sqlalchemy.orm import Session
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+import asyncio
+from ...auth.dependencies import get_current_user
+from ...db.database import get_db
+from ...db import models
+from ...engine.backtest import run_backtest
+from ...engine.policy import PolicyCompileError, compile_condition
+from ...streaming.processor import get_policy_engine
+
+router = APIRouter(prefix="/policies", tags=["policies"])
+
+
+class CandidateRule(BaseModel):
+    name: str
+    condition: Dict[str, Any] = {}
+    action: str
+    priority: int = 0
+    tenant_id: Optional[str] = None
+
+
+class BacktestRequest(BaseModel):
+    rules: List[CandidateRule] = Field(..., min_items=1)
+    start: Optional[datetime] = None  # default: 30 days before end
+    end: Optional[datetime] = None  # default: now
+    tenant_id: Optional[str] = None
+    workers: Optional[int] = Field(None, ge=1)  # capped at BACKTEST_WORKERS (default the CPU count)
+
+
+@router.post("/backtest")
+async def backtest_policies(req: BacktestRequest, current_user: dict = Depends(get_current_user)):
+    """
+    Replay scored telemetry against candidate rules and report how they would
+    have triggered. Tenant admins only replay their own tenant's telemetry.
+    """
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    tenant_id = req.tenant_id
+    own_tenant = _tenant(current_user)
+    if own_tenant is not None:
+        if tenant_id is not None and tenant_id != own_tenant:
+            raise HTTPException(status_code=403, detail="Cannot backtest another tenant's telemetry")
+        if any(rule.tenant_id not in (None, own_tenant) for rule in req.rules):
+            raise HTTPException(status_code=403, detail="Candidate rules must belong to your tenant")
+        tenant_id = own_tenant
+    end = req.end or datetime.utcnow()
+    start = req.start or end - timedelta(days=30)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    names = [rule.name for rule in req.rules]
+    if len(set(names)) != len(names):
+        raise HTTPException(status_code=400, detail="Rule names must be unique")
+    try:
+        return await asyncio.to_thread(
+            run_backtest, [rule.dict() for rule in req.rules], start, end,
+            tenant_id=tenant_id, workers=req.workers
+        )
+    except PolicyCompileError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid rule condition: {e}")
+
+
+class PolicyRuleIn(BaseModel):
+    name: str = Field(..., max_length=100)
+    description: Optional[str] = Field(None, max_length=255)
+    condition: Dict[str, Any] = {}
+    action: str = Field(..., max_length=50)
+    priority: int = 100
+    enabled: bool = True
+
+
+class PolicyRuleOut(PolicyRuleIn):
+    id: int
+    tenant_id: Optional[str]
+    triggered_count: Optional[int]
+    created_at: datetime
+    updated_at: Optional[datetime]
+
+    class Config:
+        orm_mode = True
+
+
+def require_admin(current_user: dict = Depends(get_current_user)) -> dict:
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
+
+
+def _tenant(current_user: dict) -> Optional[str]:
+    """Rules are stored with string tenant ids; platform admins (no tenant) manage the global rules."""
+    tenant_id = current_user.get("tenant_id")
+    return str(tenant_id) if tenant_id is not None else None
+
+
+def _validate(rule: PolicyRuleIn):
+    try:
+        compile_condition(rule.condition)
+    except PolicyCompileError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid rule condition: {e}")
+
+
+def _get_rule(db: Session, rule_id: int, current_user: dict) -> models.PolicyRule:
+    rule = db.query(models.PolicyRule).filter(
+        models.PolicyRule.id == rule_id,
+        models.PolicyRule.tenant_id == _tenant(current_user)
+    ).first()
+    if not rule:
+        raise HTTPException(status_code=404, detail="Policy rule not found")
+    return rule
+
+
+async def _invalidate():
+    # Every worker recompiles its rules from the bumped version key
+    await (await get_policy_engine()).invalidate()
+
+
+@router.get("/", response_model=List[PolicyRuleOut])
+def list_policy_rules(db: Session = Depends(get_db), current_user: dict = Depends(require_admin)):
+    return db.query(models.PolicyRule).filter(
+        models.PolicyRule.tenant_id == _tenant(current_user)
+    ).order_by(models.PolicyRule.priority).all()
+
+
+@router.post("/", response_model=PolicyRuleOut)
+async def create_policy_rule(req: PolicyRuleIn, db: Session = Depends(get_db),
+                             current_user: dict = Depends(require_admin)):
+    _validate(req)
+    if db.query(models.PolicyRule).filter(models.PolicyRule.name == req.name).first():
+        raise HTTPException(status_code=400, detail="Rule name already taken")
+    rule = models.PolicyRule(**req.dict(), tenant_id=_tenant(current_user))
+    db.add(rule)
+    db.commit()
+    db.refresh(rule)
+    await _invalidate()
+    return rule
+
+
+@router.put("/{rule_id}", response_model=PolicyRuleOut)
+async def update_policy_rule(rule_id: int, req: PolicyRuleIn, db: Session = Depends(get_db),
+                             current_user: dict = Depends(require_admin)):
+    _validate(req)
+    rule = _get_rule(db, rule_id, current_user)
+    if db.query(models.PolicyRule).filter(models.PolicyRule.name == req.name,
+                                          models.PolicyRule.id != rule_id).first():
+        raise HTTPException(status_code=400, detail="Rule name already taken")
+    for field, value in req.dict().items():
+        setattr(rule, field, value)
+    db.commit()
+    db.refresh(rule)
+    await _invalidate()
+    return rule
+
+
+@router.delete("/{rule_id}")
+async def delete_policy_rule(rule_id: int, db: Session = Depends(get_db),
+                             current_user: dict = Depends(require_admin)):
+    rule = _get_rule(db, rule_id, current_user)
+    db.delete(rule)
+    db.commit()
+    await _invalidate()
+    return {"message": "Policy rule deleted"}
+
+
+@router.get("/triggers")
+async def policy_trigger_series(start: Optional[datetime] = None, end: Optional[datetime] = None,
+                                rule_id: Optional[int] = None, tenant_id: Optional[str] = None,
+                                current_user: dict = Depends(require_admin)):
+    """Rule trigger counts per time bucket (default: the last 24 hours), from the Redis counters."""
+    own_tenant = _tenant(current_user)
+    if own_tenant is not None:
+        if tenant_id is not None and tenant_id != own_tenant:
+            raise HTTPException(status_code=403, detail="Cannot read another tenant's triggers")
+        tenant_id = own_tenant
+    end = end or datetime.utcnow()
+    start = start or end - timedelta(days=1)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    engine = await get_policy_engine()
+    if engine.counters is None:
+        raise HTTPException(status_code=503, detail="Trigger counters are not enabled")
+    return await engine.counters.series(start, end, rule_id=rule_id, tenant_id=tenant_id)
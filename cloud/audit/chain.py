@@ -0,0 +1,303 @@
+"""
+Hash chain and Merkle checkpoints over the audit log.
+"""
+from sqlalchemy import insert, text
+from sqlalchemy.orm import Session
+from datetime import datetime
+import hashlib
+import hmac
+import json
+import os
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+from ..db import models
+
+logger = logging.getLogger(__name__)
+
+GENESIS = "0" * 64
+# job_checkpoints row holding the last seq; its row lock serializes appends
+CHAIN_HEAD = "audit_chain"
+
+# (sibling hash, sibling is on the left)
+ProofStep = Tuple[str, bool]
+
+_INIT_HEAD = text("""
+    INSERT INTO job_checkpoints (name, value, updated_at) VALUES (:name, 0, now())
+    ON CONFLICT (name) DO NOTHING
+""")
+_LOCK_HEAD = text("SELECT value FROM job_checkpoints WHERE name = :name FOR UPDATE")
+_SAVE_HEAD = text("UPDATE job_checkpoints SET value = :value, updated_at = now() WHERE name = :name")
+
+_ENTRY_HASH = text("SELECT entry_hash FROM audit_logs WHERE seq = :seq")
+_BLOCK_HASHES = text("""
+    SELECT seq, entry_hash, timestamp FROM audit_logs
+    WHERE seq BETWEEN :first AND :last ORDER BY seq
+""")
+_BLOCK_ENTRIES = text("""
+    SELECT id, seq, prev_hash, entry_hash, signature, timestamp, event_type, user_id, session_id, details
+    FROM audit_logs WHERE seq BETWEEN :first AND :last ORDER BY seq
+""")
+_CHECKPOINTS = text("SELECT * FROM audit_checkpoints WHERE block BETWEEN :first AND :last ORDER BY block")
+_CHECKPOINT_ROOT = text("SELECT merkle_root FROM audit_checkpoints WHERE block = :block")
+_SEQ_RANGE = text("""
+    SELECT MIN(seq), MAX(seq) FROM audit_logs
+    WHERE timestamp >= :start AND timestamp < :end AND seq IS NOT NULL
+""")
+
+
+def sign_entry(secret_key: bytes, entry: dict) -> str:
+    """HMAC-SHA256 of an audit entry (timestamp, event_type, user_id, session_id, details)."""
+    message = json.dumps(entry, sort_keys=True, default=str).encode()
+    return hmac.new(secret_key, message, hashlib.sha256).hexdigest()
+
+
+def chain_hash(seq: int, prev_hash: str, signature: str) -> str:
+    """Hash of an entry: its position, the previous entry's hash and its own HMAC signature."""
+    return hashlib.sha256(f"{seq}:{prev_hash}:{signature}".encode()).hexdigest()
+
+
+def _leaf(entry_hash: str) -> bytes:
+    return hashlib.sha256(b"\x00" + bytes.fromhex(entry_hash)).digest()
+
+
+def _node(left: bytes, right: bytes) -> bytes:
+    return hashlib.sha256(b"\x01" + left + right).digest()
+
+
+def _next_level(level: List[bytes]) -> List[bytes]:
+    # An odd node out is carried up as is, not paired with itself
+    paired = [_node(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+    return paired + level[-1:] if len(level) % 2 else paired
+
+
+def merkle_root(entry_hashes: List[str]) -> str:
+    level = [_leaf(h) for h in entry_hashes]
+    if not level:
+        return GENESIS
+    while len(level) > 1:
+        level = _next_level(level)
+    return level[0].hex()
+
+
+def merkle_path(entry_hashes: List[str], index: int) -> List[ProofStep]:
+    """Sibling hashes from leaf ``index`` up to the root."""
+    level = [_leaf(h) for h in entry_hashes]
+    path = []
+    while len(level) > 1:
+        sibling = index ^ 1
+        if sibling < len(level):
+            path.append((level[sibling].hex(), sibling < index))
+        level = _next_level(level)
+        index //= 2
+    return path
+
+
+def root_from_path(entry_hash: str, path: List[ProofStep]) -> str:
+    node = _leaf(entry_hash)
+    for sibling, on_left in path:
+        sibling = bytes.fromhex(sibling)
+        node = _node(sibling, node) if on_left else _node(node, sibling)
+    return node.hex()
+
+
+class AuditChain:
+    """
+    Links audit entries into a hash chain and seals it in fixed-size blocks.
+
+    Every entry gets a gap-free ``seq`` and ``entry_hash = sha256(seq,
+    prev_hash, signature)``, so editing, reordering or deleting an entry
+    breaks every hash after it. Each full block of ``block_size`` entries
+    gets an ``audit_checkpoints`` row holding the block's Merkle root. The
+    checkpoint also holds the previous block's root and an HMAC over both,
+    so the checkpoints form a signed chain of their own.
+
+    Checking that an entry is in a sealed block takes a path of
+    log2(block_size) hashes to the root (``inclusion_proof``). Checking a
+    range walks its checkpoints and rescans only the two edge blocks and
+    the unsealed tail (``verify_range``). Rescanning every block is
+    optional (``deep``).
+    """
+    def __init__(self, secret_key: str, db_session_factory=None, block_size: Optional[int] = None):
+        self.secret_key = secret_key.encode()
+        self.db_session_factory = db_session_factory
+        # Fixed for the life of the log: changing it invalidates existing checkpoints
+        self.block_size = block_size or int(os.getenv("AUDIT_BLOCK_SIZE", "1024"))
+
+    def _block_bounds(self, block: int) -> Tuple[int, int]:
+        return block * self.block_size + 1, (block + 1) * self.block_size
+
+    def block_of(self, seq: int) -> int:
+        return (seq - 1) // self.block_size
+
+    def _sign_checkpoint(self, block: int, first_seq: int, last_seq: int, root: str, prev_root: str) -> str:
+        message = f"{block}:{first_seq}:{last_seq}:{root}:{prev_root}".encode()
+        return hmac.new(self.secret_key, message, hashlib.sha256).hexdigest()
+
+    def append(self, db: Session, rows: List[Dict[str, Any]]) -> int:
+        """
+        Insert signed audit rows at the head of the chain within ``db``'s
+        transaction (the caller commits), sealing any block they complete.
+        Returns the last seq.
+        """
+        db.execute(_INIT_HEAD, {"name": CHAIN_HEAD})
+        head = db.execute(_LOCK_HEAD, {"name": CHAIN_HEAD}).scalar() or 0
+        prev = db.execute(_ENTRY_HASH, {"seq": head}).scalar() if head else GENESIS
+        seq = head
+        for row in rows:
+            seq += 1
+            row["seq"] = seq
+            row["prev_hash"] = prev
+            row["entry_hash"] = prev = chain_hash(seq, prev, row["signature"])
+        db.execute(insert(models.AuditLog), rows)
+        db.execute(_SAVE_HEAD, {"name": CHAIN_HEAD, "value": seq})
+        for block in range(head // self.block_size, seq // self.block_size):
+            self._seal(db, block)
+        return seq
+
+    def _seal(self, db: Session, block: int):
+        first, last = self._block_bounds(block)
+        entries = db.execute(_BLOCK_HASHES, {"first": first, "last": last}).all()
+        root = merkle_root([entry.entry_hash for entry in entries])
+        prev_root = (db.execute(_CHECKPOINT_ROOT, {"block": block - 1}).scalar() if block else None) or GENESIS
+        db.execute(insert(models.AuditCheckpoint).values(
+            block=block, first_seq=first, last_seq=last,
+            first_timestamp=min(entry.timestamp for entry in entries),
+            last_timestamp=max(entry.timestamp for entry in entries),
+            merkle_root=root, last_entry_hash=entries[-1].entry_hash, prev_root=prev_root,
+            signature=self._sign_checkpoint(block, first, last, root, prev_root),
+        ))
+        logger.info(f"Sealed audit block {block} (seq {first}-{last})")
+
+    def check_entry(self, entry) -> List[str]:
+        """What is wrong with one stored entry on its own: its signature, and its entry_hash if chained."""
+        problems = []
+        signed = {
+            "timestamp": entry.timestamp.isoformat(), "event_type": entry.event_type,
+            "user_id": entry.user_id, "session_id": entry.session_id, "details": entry.details,
+        }
+        if not hmac.compare_digest(sign_entry(self.secret_key, signed), entry.signature or ""):
+            problems.append("signature does not match its content")
+        if entry.seq is not None and entry.entry_hash != chain_hash(entry.seq, entry.prev_hash, entry.signature):
+            problems.append("entry_hash does not match")
+        return problems
+
+    def _check_entries(self, entries, prev: str, first: int) -> List[str]:
+        problems = []
+        for expected, entry in enumerate(entries, start=first):
+            if entry.seq != expected:
+                problems.append(f"seq {expected}: missing (next is {entry.seq})")
+                return problems
+            if entry.prev_hash != prev:
+                problems.append(f"seq {entry.seq}: prev_hash does not match the previous entry")
+            problems.extend(f"seq {entry.seq}: {problem}" for problem in self.check_entry(entry))
+            prev = entry.entry_hash
+        return problems
+
+    def _verify_block(self, db: Session, block: int, checkpoint=None, head: Optional[int] = None) -> List[str]:
+        first, last = self._block_bounds(block)
+        if head is not None:
+            last = min(last, head)
+        entries = db.execute(_BLOCK_ENTRIES, {"first": first, "last": last}).all()
+        prev = db.execute(_ENTRY_HASH, {"seq": first - 1}).scalar() if first > 1 else GENESIS
+        problems = self._check_entries(entries, prev, first)
+        if len(entries) != last - first + 1 and not problems:
+            problems.append(f"block {block}: {last - first + 1 - len(entries)} entries missing at the end")
+        if checkpoint is not None and merkle_root([entry.entry_hash for entry in entries]) != checkpoint.merkle_root:
+            problems.append(f"block {block}: entries do not match the checkpoint's Merkle root")
+        return problems
+
+    def _check_checkpoints(self, db: Session, first_block: int, last_block: int) -> Tuple[dict, List[str]]:
+        checkpoints = {cp.block: cp for cp in db.execute(_CHECKPOINTS, {"first": first_block, "last": last_block})}
+        problems = []
+        prev_root = db.execute(_CHECKPOINT_ROOT, {"block": first_block - 1}).scalar() if first_block else GENESIS
+        for block in range(first_block, last_block + 1):
+            cp = checkpoints.get(block)
+            if cp is None:
+                if block != last_block:
+                    problems.append(f"block {block}: full but never sealed")
+                prev_root = None
+                continue
+            expected = self._sign_checkpoint(cp.block, cp.first_seq, cp.last_seq, cp.merkle_root, cp.prev_root)
+            if not hmac.compare_digest(expected, cp.signature):
+                problems.append(f"block {block}: checkpoint signature does not match")
+            if prev_root is not None and cp.prev_root != prev_root:
+                problems.append(f"block {block}: checkpoint does not link to the previous block's root")
+            prev_root = cp.merkle_root
+        return checkpoints, problems
+
+    def verify_range(self, start: datetime, end: datetime, deep: bool = False) -> Dict[str, Any]:
+        """
+        Verify the chain across all entries with ``start <= timestamp < end``
+        (blocking). Checkpoint signatures and links are checked for every
+        block in the range. Entries are rehashed only in the first and last
+        blocks and in blocks not yet sealed, or in every block with ``deep``.
+        """
+        db: Session = self.db_session_factory()
+        try:
+            low, high = db.execute(_SEQ_RANGE, {"start": start, "end": end}).one()
+            if low is None:
+                return {"ok": True, "entries": 0, "blocks": 0, "blocks_scanned": 0, "problems": []}
+            first_block, last_block = self.block_of(low), self.block_of(high)
+            checkpoints, problems = self._check_checkpoints(db, first_block, last_block)
+            blocks = range(first_block, last_block + 1)
+            scan = blocks if deep else sorted({first_block, last_block} | (set(blocks) - set(checkpoints)))
+            for block in scan:
+                checkpoint = checkpoints.get(block)
+                # An unsealed block is only checked up to the range's last entry
+                head = high if checkpoint is None and block == last_block else None
+                problems.extend(self._verify_block(db, block, checkpoint, head))
+        finally:
+            db.close()
+        return {
+            "ok": not problems,
+            "entries": high - low + 1,
+            "first_seq": low,
+            "last_seq": high,
+            "blocks": len(blocks),
+            "blocks_scanned": len(scan),
+            "problems": problems,
+        }
+
+    def inclusion_proof(self, entry_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Merkle path from an entry to its block's checkpoint (blocking), or None
+        if the entry isn't chained or its block isn't sealed yet.
+        """
+        db: Session = self.db_session_factory()
+        try:
+            entry = db.query(models.AuditLog).filter_by(id=entry_id).first()
+            if entry is None or entry.seq is None:
+                return None
+            block = self.block_of(entry.seq)
+            checkpoint = db.query(models.AuditCheckpoint).filter_by(block=block).first()
+            if checkpoint is None:
+                return None
+            first, last = self._block_bounds(block)
+            hashes = [row.entry_hash for row in db.execute(_BLOCK_HASHES, {"first": first, "last": last})]
+        finally:
+            db.close()
+        return {
+            "id": entry_id,
+            "seq": entry.seq,
+            "prev_hash": entry.prev_hash,
+            "signature": entry.signature,
+            "entry_hash": entry.entry_hash,
+            "block": block,
+            "path": merkle_path(hashes, entry.seq - first),
+            "checkpoint": {
+                "first_seq": checkpoint.first_seq, "last_seq": checkpoint.last_seq,
+                "merkle_root": checkpoint.merkle_root, "prev_root": checkpoint.prev_root,
+                "signature": checkpoint.signature,
+            },
+        }
+
+    def verify_inclusion(self, proof: Dict[str, Any]) -> bool:
+        """Check an ``inclusion_proof``: log2(block_size) hashes plus the checkpoint's HMAC (no I/O)."""
+        if proof["entry_hash"] != chain_hash(proof["seq"], proof["prev_hash"], proof["signature"]):
+            return False
+        checkpoint = proof["checkpoint"]
+        expected = self._sign_checkpoint(proof["block"], checkpoint["first_seq"], checkpoint["last_seq"],
+                                         checkpoint["merkle_root"], checkpoint["prev_root"])
+        if not hmac.compare_digest(expected, checkpoint["signature"]):
+            return False
+        return root_from_path(proof["entry_hash"], proof["path"]) == checkpoint["merkle_root"]
@@ -2,11 +2,9 @@
 Tamper‑evident audit logger with HMAC signatures.
 """
 import hmac
-import hashlib
-import json
 from datetime import datetime
 from sqlalchemy.orm import Session
-from ..db import models
+from .chain import AuditChain, sign_entry
 import logging
 
 logger = logging.getLogger(__name__)
@@ -15,33 +13,24 @@ class AuditLogger:
     def __init__(self, secret_key: str, db_session_factory):
         self.secret_key = secret_key.encode()
         self.db_session_factory = db_session_factory
+        self.chain = AuditChain(secret_key)
 
     def _hash(self, data: dict) -> str:
-        message = json.dumps(data, sort_keys=True).encode()
-        return hmac.new(self.secret_key, message, hashlib.sha256).hexdigest()
+        return sign_entry(self.secret_key, data)
 
     def log(self, event_type: str, user_id: str, details: dict, session_id: str = None):
         entry = {
-            "timestamp": datetime.utcnow().isoformat(),
+            "timestamp": datetime.utcnow(),
             "event_type": event_type,
             "user_id": user_id,
             "session_id": session_id,
             "details": details,
         }
-        signature = self._hash(entry)
-        entry["signature"] = signature
+        signature = self._hash({**entry, "timestamp": entry["timestamp"].isoformat()})
 
         db = self.db_session_factory()
         try:
-            audit = models.AuditLog(
-                timestamp=datetime.utcnow(),
-                event_type=event_type,
-                user_id=user_id,
-                session_id=session_id,
-                details=details,
-                signature=signature
-            )
-            db.add(audit)
+            self.chain.append(db, [{**entry, "signature": signature}])
             db.commit()
         except Exception as e:
             logger.error(f"Failed to write audit log: {e}")
@@ -0,0 +1,280 @@
+"""
+Process-wide audit pipeline: entries are queued in memory and written in signed batches.
+"""
+from sqlalchemy.exc import DataError, DBAPIError, IntegrityError, StatementError
+from sqlalchemy.orm import Session
+from collections import deque
+from datetime import datetime
+import asyncio
+import glob
+import json
+import os
+import threading
+import time
+import logging
+from typing import Callable, List, Optional
+from ..db.database import SessionLocal
+from ..observability.metrics import audit_queue_depth, audit_entries, audit_flush_duration
+from .chain import AuditChain, sign_entry
+
+logger = logging.getLogger(__name__)
+
+SPILL_PATTERN = "audit-spill-*.jsonl"
+
+
+def _is_permanent(error: Exception) -> bool:
+    """Errors retrying can't fix: the database rejected the data, or it couldn't even be sent."""
+    if isinstance(error, (DataError, IntegrityError)):
+        return True
+    # e.g. a details value that can't be serialized or bound
+    return isinstance(error, (StatementError, TypeError, ValueError)) and not isinstance(error, DBAPIError)
+
+
+class AuditWriter:
+    """
+    Drop-in replacement for ``AuditLogger.log`` that doesn't touch the database
+    on the caller's path.
+
+    ``log`` only appends to a bounded in-memory queue (``max_queue`` entries;
+    when full, new entries are dropped and counted). ``run_forever`` writes
+    the queue in batches of up to ``batch_size`` rows, one multi-row INSERT and
+    one commit per batch, as soon as a batch is full or every
+    ``flush_interval`` seconds. Entries are HMAC-signed at write time, over
+    the same timestamp that is stored, and appended to the hash chain. A
+    batch the database rejects outright is retried row by row, and entries
+    that still fail are quarantined to a dead-letter file in ``spill_dir``
+    instead of blocking the queue. On shutdown ``close`` writes whatever
+    is queued; if the database stays unavailable the remaining entries are
+    spilled to ``spill_dir`` and written by the next process that starts.
+    """
+    def __init__(self, secret_key: str, db_session_factory, max_queue: Optional[int] = None,
+                 batch_size: Optional[int] = None, flush_interval: Optional[float] = None,
+                 spill_dir: Optional[str] = None):
+        self.secret_key = secret_key.encode()
+        self.db_session_factory = db_session_factory
+        self.chain = AuditChain(secret_key)
+        self.max_queue = max_queue or int(os.getenv("AUDIT_QUEUE_SIZE", "10000"))
+        self.batch_size = batch_size or int(os.getenv("AUDIT_BATCH_SIZE", "500"))
+        self.flush_interval = flush_interval or float(os.getenv("AUDIT_FLUSH_INTERVAL", "1"))
+        self.spill_dir = spill_dir or os.getenv("AUDIT_SPILL_DIR", "/var/lib/citp/audit")
+        self._queue: deque = deque()
+        self._lock = threading.Lock()
+        # Set by run_forever, so log() can wake it from any thread once a batch is full
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+
+    def log(self, event_type: str, user_id: str, details: dict, session_id: str = None) -> bool:
+        """Queue an audit entry (no I/O). Returns False if the queue was full and it was dropped."""
+        entry = {
+            "timestamp": datetime.utcnow(),
+            "event_type": event_type,
+            "user_id": user_id,
+            "session_id": session_id,
+            "details": details,
+        }
+        with self._lock:
+            if len(self._queue) >= self.max_queue:
+                depth = None
+            else:
+                self._queue.append(entry)
+                depth = len(self._queue)
+        if depth is None:
+            audit_entries.labels(result="dropped").inc()
+            logger.warning(f"Audit queue full, dropped {event_type} entry for {user_id}")
+            return False
+        audit_queue_depth.set(depth)
+        if depth == self.batch_size and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+        return True
+
+    def _take(self, n: int) -> List[dict]:
+        with self._lock:
+            batch = [self._queue.popleft() for _ in range(min(n, len(self._queue)))]
+            audit_queue_depth.set(len(self._queue))
+        return batch
+
+    def _requeue(self, batch: List[dict]):
+        """Put a batch that failed to write back at the head of the queue (even past ``max_queue``)."""
+        with self._lock:
+            self._queue.extendleft(reversed(batch))
+            audit_queue_depth.set(len(self._queue))
+
+    def _rows(self, batch: List[dict]) -> List[dict]:
+        rows = []
+        for entry in batch:
+            signature = sign_entry(self.secret_key, {**entry, "timestamp": entry["timestamp"].isoformat()})
+            rows.append({**entry, "signature": signature})
+        return rows
+
+    def _insert(self, batch: List[dict]):
+        db: Session = self.db_session_factory()
+        try:
+            self.chain.append(db, self._rows(batch))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    async def _write(self, batch: List[dict], keep: Callable[[List[dict]], None]) -> int:
+        """
+        Write one batch, returns entries written. If the database is
+        unavailable the entries not yet written are handed to ``keep`` and the
+        error is raised; if it rejects the batch, the batch is retried row by
+        row and rows rejected again are quarantined.
+        """
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(self._insert, batch)
+        except Exception as e:
+            if not _is_permanent(e):
+                keep(batch)
+                raise
+            logger.warning(f"Audit batch of {len(batch)} entries rejected, writing it row by row: {e}")
+            return await self._write_rows(batch, keep)
+        audit_flush_duration.observe(time.perf_counter() - started)
+        audit_entries.labels(result="written").inc(len(batch))
+        return len(batch)
+
+    async def _write_rows(self, batch: List[dict], keep: Callable[[List[dict]], None]) -> int:
+        written = 0
+        for i, entry in enumerate(batch):
+            try:
+                await asyncio.to_thread(self._insert, [entry])
+            except Exception as e:
+                if not _is_permanent(e):
+                    keep(batch[i:])
+                    raise
+                try:
+                    await asyncio.to_thread(self._quarantine, entry, e)
+                except Exception:
+                    keep(batch[i:])
+                    raise
+                continue
+            audit_entries.labels(result="written").inc()
+            written += 1
+        return written
+
+    async def flush(self) -> int:
+        """Write everything queued, one batch at a time. Returns the number of entries written."""
+        written = 0
+        while True:
+            batch = self._take(self.batch_size)
+            if not batch:
+                return written
+            written += await self._write(batch, keep=self._requeue)
+
+    def _dump(self, path: str, entries: List[dict], replace: bool = False):
+        """Append entries to a JSON-lines file, or atomically replace its contents."""
+        os.makedirs(self.spill_dir, exist_ok=True)
+        target = f"{path}.tmp" if replace else path
+        with open(target, "w" if replace else "a") as f:
+            for entry in entries:
+                f.write(json.dumps({**entry, "timestamp": entry["timestamp"].isoformat()}, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        if replace:
+            os.replace(target, path)
+
+    def _quarantine(self, entry: dict, error: Exception):
+        """Set aside an entry the database won't accept, for manual review."""
+        path = os.path.join(self.spill_dir, f"audit-dead-letter-{os.getpid()}.jsonl")
+        self._dump(path, [entry])
+        audit_entries.labels(result="quarantined").inc()
+        logger.error(f"Quarantined {entry['event_type']} audit entry for {entry['user_id']} to {path}: {error}")
+
+    def _spill(self) -> int:
+        """Write the queue to a spill file (last resort at shutdown)."""
+        batch = self._take(len(self._queue))
+        if not batch:
+            return 0
+        self._dump(os.path.join(self.spill_dir, f"audit-spill-{os.getpid()}-{int(time.time())}.jsonl"), batch)
+        audit_entries.labels(result="spilled").inc(len(batch))
+        return len(batch)
+
+    @staticmethod
+    def _load(path: str) -> List[dict]:
+        with open(path) as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+        for entry in entries:
+            entry["timestamp"] = datetime.fromisoformat(entry["timestamp"])
+        return entries
+
+    async def _recover_spilled(self) -> int:
+        """
+        Write entries spilled by earlier processes. Each file is claimed by
+        renaming it first and removed only once all its entries are written;
+        if the database fails midway, the file keeps just the unwritten ones.
+        """
+        recovered = 0
+        for path in glob.glob(os.path.join(self.spill_dir, SPILL_PATTERN)):
+            claimed = f"{path}.{os.getpid()}.recovering"
+            try:
+                os.rename(path, claimed)
+            except OSError:
+                continue  # claimed by another worker
+            entries = await asyncio.to_thread(self._load, claimed)
+            for start in range(0, len(entries), self.batch_size):
+                rest = entries[start + self.batch_size:]
+                try:
+                    recovered += await self._write(
+                        entries[start:start + self.batch_size],
+                        keep=lambda unwritten: self._dump(claimed, unwritten + rest, replace=True)
+                    )
+                except Exception:
+                    os.rename(claimed, path)  # release it for the next attempt
+                    raise
+            os.remove(claimed)
+        if recovered:
+            logger.info(f"Recovered {recovered} spilled audit entries")
+        return recovered
+
+    async def close(self, retries: int = 3):
+        """Write everything still queued (called at shutdown); spill to disk if the database won't take it."""
+        for attempt in range(retries):
+            try:
+                await self.flush()
+                return
+            except Exception as e:
+                logger.error(f"Audit flush at shutdown failed (attempt {attempt + 1}/{retries}): {e}")
+                await asyncio.sleep(2 ** attempt)
+        spilled = await asyncio.to_thread(self._spill)
+        logger.error(f"Spilled {spilled} audit entries to {self.spill_dir}")
+
+    async def run_forever(self):
+        """Background task: write a batch as soon as one is full, and everything queued every ``flush_interval`` seconds."""
+        self._wake = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        # Until the spill files of earlier processes are written
+        spilled = True
+        while True:
+            if spilled:
+                try:
+                    await self._recover_spilled()
+                    spilled = False
+                except Exception as e:
+                    logger.error(f"Failed to recover spilled audit entries: {e}")
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Audit flush failed: {e}")
+
+
+_writer: Optional[AuditWriter] = None
+
+
+def get_audit_writer() -> AuditWriter:
+    """The process-wide ``AuditWriter``."""
+    global _writer
+    if _writer is None:
+        _writer = AuditWriter(
+            secret_key=os.getenv("AUDIT_SECRET", "default-audit-secret-change-me"),
+            db_session_factory=SessionLocal
+        )
+    return _writer
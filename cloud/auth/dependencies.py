@@ -24,4 +24,5 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> dict:
     db.close()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    return {"sub": user.username, "role": user.role, "user_id": user.id}
+    # Tenant tokens carry their tenant; platform accounts have none
+    return {"sub": user.username, "role": user.role, "user_id": user.id, "tenant_id": payload.get("tenant_id")}
@@ -19,7 +19,7 @@ from ..auth.utils import (
     get_password_hash,
     decode_token
 )
-from ..audit.logger import AuditLogger
+from ..audit.writer import get_audit_writer
 from ..observability.logging import StructuredLogger
 from ..observability.metrics import login_attempts_counter
 
@@ -29,12 +29,9 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 # Structured logger for this module
 logger = StructuredLogger(__name__)
 
-# Audit logger (initialised lazily)
+# Audit entries go through the process-wide batched writer
 def get_audit_logger():
-    return AuditLogger(
-        secret_key=os.getenv("AUDIT_SECRET", "default-audit-secret-change-me"),
-        db_session_factory=SessionLocal
-    )
+    return get_audit_writer()
 
 # -------------------- Pydantic models --------------------
 class RegisterRequest(BaseModel):
@@ -1,35 +1,171 @@
 """
-GeoIP enforcement using MaxMind database.
+GeoIP enrichment and enforcement using MaxMind databases.
 """
+import asyncio
 import geoip2.database
+from maxminddb import MODE_MMAP
 import os
 import logging
+from typing import Dict, Iterable, Optional, Tuple
+from ..core.lru import LRUCache
+from ..db import models
 
 logger = logging.getLogger(__name__)
 
+GeoInfo = Tuple[Optional[str], Optional[int]]
+
+
+def compile_countries(countries) -> Optional[frozenset]:
+    """``"US, ca"`` or ``["US", "CA"]`` -> frozenset({"US", "CA"}); empty means unrestricted (None)."""
+    if not countries:
+        return None
+    if isinstance(countries, str):
+        countries = countries.split(",")
+    compiled = frozenset(c.strip().upper() for c in countries if c and c.strip())
+    return compiled or None
+
+
 class GeoIPEnforcer:
-    def __init__(self, db_path: str = None):
+    """
+    IP -> (country, ASN) lookups for the scoring pipeline.
+
+    The MMDB files are memory-mapped, so every worker process on a host shares
+    one copy through the page cache, and a bounded LRU in front of them skips
+    the tree walk for repeat IPs. ``reload_if_changed`` swaps in new readers
+    when a database file is replaced. Per-tenant allowed-country lists are
+    compiled into frozensets, so ``is_allowed`` is a set lookup.
+    """
+    def __init__(self, db_path: str = None, asn_db_path: str = None, cache_size: int = None,
+                 reload_interval: int = None, db_session_factory=None):
         if db_path is None:
             db_path = os.getenv("GEOIP_DB_PATH", "GeoLite2-Country.mmdb")
+        if asn_db_path is None:
+            asn_db_path = os.getenv("GEOIP_ASN_DB_PATH") or None
+        self.db_path = db_path
+        self.asn_db_path = asn_db_path
+        self.reload_interval = reload_interval or int(os.getenv("GEOIP_RELOAD_INTERVAL", "300"))
+        self.db_session_factory = db_session_factory
+        self.reader = None
+        self.asn_reader = None
+        self._mtimes: Dict[str, float] = {}
+        self._cache = LRUCache(maxsize=cache_size or int(os.getenv("GEOIP_CACHE_SIZE", "100000")))
+        # tenant id (as in telemetry) -> allowed countries; tenants not listed are unrestricted
+        self._allowed: Dict[str, frozenset] = {}
+        self.reload_if_changed()
+
+    def _open(self, path: str):
         try:
-            self.reader = geoip2.database.Reader(db_path)
-            logger.info(f"GeoIP database loaded from {db_path}")
+            reader = geoip2.database.Reader(path, mode=MODE_MMAP)
+            logger.info(f"GeoIP database loaded from {path}")
+            return reader
         except Exception as e:
             logger.error(f"Failed to load GeoIP database: {e}")
-            self.reader = None
-
-    def get_country(self, ip: str) -> str:
-        if not self.reader:
             return None
+
+    def _stat(self) -> Dict[str, float]:
+        mtimes = {}
+        for path in filter(None, (self.db_path, self.asn_db_path)):
+            try:
+                mtimes[path] = os.stat(path).st_mtime
+            except OSError:
+                pass
+        return mtimes
+
+    def reload_if_changed(self) -> bool:
+        """Reopen the databases if a file changed since it was loaded. Returns True if reloaded."""
+        mtimes = self._stat()
+        if mtimes == self._mtimes:
+            return False
+        # The old readers aren't closed: a lookup may still be using them, and
+        # their maps are released once the last reference goes away
+        self.reader = self._open(self.db_path) if self.db_path in mtimes else None
+        self.asn_reader = self._open(self.asn_db_path) if self.asn_db_path in mtimes else None
+        self._mtimes = mtimes
+        self._cache.clear()
+        return True
+
+    def load_tenant_policies(self):
+        """Recompile per-tenant allowed countries from ``tenants.allowed_countries`` (blocking)."""
+        if self.db_session_factory is None:
+            return
+        db = self.db_session_factory()
         try:
-            response = self.reader.country(ip)
-            return response.country.iso_code
-        except:
-            return None
+            rows = db.query(models.Tenant.id, models.Tenant.allowed_countries).all()
+        finally:
+            db.close()
+        allowed = {}
+        for tenant_id, countries in rows:
+            compiled = compile_countries(countries)
+            if compiled is not None:
+                allowed[str(tenant_id)] = compiled
+        self._allowed = allowed
+
+    def set_allowed_countries(self, tenant_id, countries: Optional[Iterable[str]]):
+        compiled = compile_countries(countries)
+        if compiled is None:
+            self._allowed.pop(str(tenant_id), None)
+        else:
+            self._allowed[str(tenant_id)] = compiled
+
+    def allowed_countries(self, tenant_id) -> Optional[frozenset]:
+        """The tenant's compiled allowed-country set, or None if it is unrestricted."""
+        return self._allowed.get(str(tenant_id)) if tenant_id is not None else None
 
-    def is_allowed(self, ip: str, allowed_countries: list) -> bool:
+    def lookup(self, ip: str) -> GeoInfo:
+        """(ISO country code, ASN) for an IP; either is None when unknown."""
+        cached = self._cache.get(ip)
+        if cached is not None:
+            return cached
+        country = asn = None
+        if self.reader:
+            try:
+                country = self.reader.country(ip).country.iso_code
+            except Exception:
+                pass
+        if self.asn_reader:
+            try:
+                asn = self.asn_reader.asn(ip).autonomous_system_number
+            except Exception:
+                pass
+        self._cache.set(ip, (country, asn))
+        return country, asn
+
+    def get_country(self, ip: str) -> str:
+        return self.lookup(ip)[0]
+
+    def enrich(self, telemetry: dict) -> dict:
+        """Set ``country`` and ``asn`` on a telemetry event, keeping values the client already sent."""
+        if telemetry.get("country") and telemetry.get("asn"):
+            return telemetry
+        country, asn = self.lookup(telemetry["ip"])
+        if not telemetry.get("country"):
+            telemetry["country"] = country
+        if not telemetry.get("asn"):
+            telemetry["asn"] = asn
+        return telemetry
+
+    def is_allowed(self, ip: str, allowed_countries=None, tenant_id=None) -> bool:
+        """
+        Whether the IP's country is allowed, given either a precompiled set
+        (see ``compile_countries``) or a tenant whose set was loaded.
+        A tenant without a restriction allows every country.
+        """
+        if allowed_countries is None:
+            allowed_countries = self.allowed_countries(tenant_id)
+            if allowed_countries is None:
+                return True
         country = self.get_country(ip)
         if not country:
             # Unknown location – deny by default (can be configured)
             return False
         return country in allowed_countries
+
+    async def run_reload_loop(self):
+        """Background task: pick up database file and tenant policy changes every ``reload_interval`` seconds."""
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            try:
+                await asyncio.to_thread(self.reload_if_changed)
+                await asyncio.to_thread(self.load_tenant_policies)
+            except Exception as e:
+                logger.error(f"GeoIP reload failed: {e}")
@@ -0,0 +1,262 @@
+"""
+Archival of raw telemetry to the data lake, and reads spanning the hot and cold tiers.
+"""
+import asyncio
+import os
+import logging
+from datetime import datetime, timedelta
+from typing import List, Optional, Sequence
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from sqlalchemy import text
+from .connector import DataLakeConnector
+from ..db.partitioning import PartitionManager
+
+logger = logging.getLogger(__name__)
+
+DATASET = "telemetry"
+CHECKPOINT_NAME = "telemetry_archive"
+DEFAULT_TENANT = "default"
+
+# Fixed so every file in the dataset has the same column types
+SCHEMA = pa.schema([
+    ("id", pa.int64()),
+    ("session_id", pa.string()),
+    ("user_id", pa.string()),
+    ("ip", pa.string()),
+    ("device", pa.string()),
+    ("keystroke_speed", pa.float64()),
+    ("mouse_speed", pa.float64()),
+    ("timestamp", pa.timestamp("us")),
+    ("risk_score", pa.float64()),
+])
+COLUMNS = SCHEMA.names
+
+# Archive up to the first row still being scored; rows left unscored past the
+# grace period are archived as they are.
+_ARCHIVE_HIGH = text("""
+    SELECT COALESCE(
+        (SELECT MIN(id) - 1 FROM telemetry
+         WHERE id > :cursor AND risk_score IS NULL AND timestamp >= :scoring_since),
+        (SELECT MAX(id) FROM telemetry)
+    )
+""")
+
+_ARCHIVE_BATCH = text(f"""
+    SELECT {", ".join(COLUMNS)}, tenant_id
+    FROM telemetry
+    WHERE id > :cursor AND id <= :high
+    ORDER BY id
+    LIMIT :limit
+""")
+
+_LOCK_CHECKPOINT = text("SELECT value FROM job_checkpoints WHERE name = :name FOR UPDATE")
+
+_SAVE_CHECKPOINT = text("""
+    INSERT INTO job_checkpoints (name, value, updated_at)
+    VALUES (:name, :value, now())
+    ON CONFLICT (name) DO UPDATE SET value = EXCLUDED.value, updated_at = now()
+""")
+
+_PURGE_BATCH = text("DELETE FROM telemetry WHERE id = ANY(:ids)")
+
+
+class TelemetryArchiver:
+    """
+    Moves raw telemetry from Postgres into an append-only Parquet cold tier.
+
+    Scored rows are copied in id order, in batches of ``batch_size``, to
+    ``telemetry/tenant_id=<t>/date=<YYYY-MM-DD>/`` through the data lake
+    connector. An id checkpoint in ``job_checkpoints`` advances only after a
+    batch's files are written, and file names derive from the batch's ids,
+    so a retried batch overwrites its own files instead of duplicating rows.
+    Rows older than ``hot_days`` are then removed from Postgres, but only
+    after checking them against the cold tier: a row whose transaction
+    committed after the cursor had passed its id is archived at that point.
+
+    ``read_range`` returns raw telemetry for any time range, from whichever
+    tier holds it.
+    """
+    def __init__(self, db_engine, connector: DataLakeConnector, hot_days: Optional[int] = None,
+                 batch_size: Optional[int] = None, interval: Optional[int] = None):
+        self.db_engine = db_engine
+        self.connector = connector
+        self.hot_days = hot_days or int(os.getenv("TELEMETRY_HOT_DAYS", "30"))
+        self.batch_size = batch_size or int(os.getenv("TELEMETRY_ARCHIVE_BATCH_SIZE", "100000"))
+        self.interval = interval or int(os.getenv("TELEMETRY_ARCHIVE_INTERVAL", "3600"))
+        self.scoring_grace = timedelta(minutes=int(os.getenv("TELEMETRY_ARCHIVE_GRACE_MINUTES", "60")))
+        self.partitions = PartitionManager(db_engine)
+
+    def cutoff(self, now: Optional[datetime] = None) -> datetime:
+        """Start of the hot window: rows before it may live only in the cold tier."""
+        today = (now or datetime.utcnow()).replace(hour=0, minute=0, second=0, microsecond=0)
+        return today - timedelta(days=self.hot_days)
+
+    def _write_batch(self, rows: pd.DataFrame) -> List[str]:
+        rows = rows.assign(
+            tenant_id=rows["tenant_id"].fillna(DEFAULT_TENANT).astype(str),
+            date=rows["timestamp"].dt.date,
+        )
+        paths = []
+        for (tenant_id, day), group in rows.groupby(["tenant_id", "date"], sort=False):
+            path = self.connector.write_batches(
+                DATASET, tenant_id, day, [group[COLUMNS]], schema=SCHEMA,
+                name=f"part-{int(group['id'].iloc[0]):020d}"
+            )
+            paths.append(path)
+        return paths
+
+    def archive_once(self) -> int:
+        """Copy newly scored rows to the cold tier (blocking). Returns rows archived."""
+        archived = 0
+        high = None
+        with self.db_engine.connect() as conn:
+            while True:
+                # The row lock keeps concurrent archivers from interleaving batches
+                cursor = conn.execute(_LOCK_CHECKPOINT, {"name": CHECKPOINT_NAME}).scalar() or 0
+                if high is None:
+                    high = conn.execute(_ARCHIVE_HIGH, {
+                        "cursor": cursor, "scoring_since": datetime.utcnow() - self.scoring_grace
+                    }).scalar() or 0
+                rows = pd.read_sql(_ARCHIVE_BATCH, conn, params={
+                    "cursor": cursor, "high": high, "limit": self.batch_size
+                }) if cursor < high else None
+                if rows is None or rows.empty:
+                    conn.rollback()
+                    break
+                rows["timestamp"] = pd.to_datetime(rows["timestamp"])
+                self._write_batch(rows)
+                cursor = int(rows["id"].iloc[-1])
+                conn.execute(_SAVE_CHECKPOINT, {"name": CHECKPOINT_NAME, "value": cursor})
+                # Commit per batch so progress survives a failure in a later batch
+                conn.commit()
+                archived += len(rows)
+        if archived:
+            logger.info(f"Archived {archived} telemetry rows (through id {cursor})")
+        return archived
+
+    def _archive_missing(self, conn, table: str, cursor: int, start: Optional[datetime] = None,
+                         end: Optional[datetime] = None) -> List[int]:
+        """
+        Ids of ``table``'s rows up to ``cursor`` (within [start, end) if given),
+        after copying any of them missing from the cold tier there.
+        """
+        query = f"SELECT id, timestamp FROM {table} WHERE id <= :cursor"
+        params = {"cursor": cursor}
+        if start is not None:
+            query += " AND timestamp >= :start AND timestamp < :end"
+            params.update(start=start, end=end)
+        rows = pd.read_sql(text(query), conn, params=params)
+        if rows.empty:
+            return []
+        days = pd.to_datetime(rows["timestamp"]).dt.date
+        archived = self.connector.read(DATASET, columns=["id"], start_date=days.min(),
+                                       end_date=days.max() + timedelta(days=1))
+        ids = rows["id"].to_numpy()
+        missing = ids[~np.isin(ids, archived["id"].to_numpy())] if not archived.empty else ids
+        if len(missing):
+            late = pd.read_sql(
+                text(f"SELECT {', '.join(COLUMNS)}, tenant_id FROM {table} WHERE id = ANY(:ids) ORDER BY id"),
+                conn, params={"ids": missing.tolist()}
+            )
+            late["timestamp"] = pd.to_datetime(late["timestamp"])
+            self._write_batch(late)
+            logger.warning(f"Archived {len(missing)} telemetry rows committed behind the archive cursor")
+        return ids.tolist()
+
+    def purge_once(self) -> int:
+        """
+        Remove archived rows older than the hot window (blocking). On a
+        partitioned table whole partitions are dropped, once every row in them
+        is in the cold tier; otherwise rows are deleted a day at a time, each
+        day's rows checked against the cold tier first. Returns rows deleted
+        (0 for partition drops).
+        """
+        deleted = 0
+        cutoff = self.cutoff()
+        with self.db_engine.connect() as conn:
+            cursor = conn.execute(
+                text("SELECT value FROM job_checkpoints WHERE name = :name"),
+                {"name": CHECKPOINT_NAME}
+            ).scalar() or 0
+        if self.partitions.is_partitioned("telemetry"):
+            def prepare(conn, partition: str) -> bool:
+                highest = conn.execute(text(f"SELECT MAX(id) FROM {partition}")).scalar()
+                if highest is not None and highest > cursor:
+                    return False  # not reached by the archiver yet
+                self._archive_missing(conn, partition, cursor)
+                return True
+            self.partitions.drop_before("telemetry", cutoff, prepare=prepare)
+            return 0
+        with self.db_engine.connect() as conn:
+            oldest = conn.execute(
+                text("SELECT MIN(timestamp) FROM telemetry WHERE id <= :cursor AND timestamp < :cutoff"),
+                {"cursor": cursor, "cutoff": cutoff}
+            ).scalar()
+            day = oldest.replace(hour=0, minute=0, second=0, microsecond=0) if oldest else cutoff
+            while day < cutoff:
+                ids = self._archive_missing(conn, "telemetry", cursor, day, min(day + timedelta(days=1), cutoff))
+                conn.rollback()
+                # Only the ids checked above, in small transactions to keep locks and WAL bursts short
+                for i in range(0, len(ids), self.batch_size):
+                    deleted += conn.execute(_PURGE_BATCH, {"ids": ids[i:i + self.batch_size]}).rowcount
+                    conn.commit()
+                day += timedelta(days=1)
+        if deleted:
+            logger.info(f"Purged {deleted} archived telemetry rows before {cutoff}")
+        return deleted
+
+    async def run_forever(self):
+        """Background task: archive and purge every ``interval`` seconds."""
+        while True:
+            try:
+                await asyncio.to_thread(self.archive_once)
+                await asyncio.to_thread(self.purge_once)
+            except Exception as e:
+                logger.error(f"Telemetry archival run failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def read_range(self, start: datetime, end: datetime, user_ids: Optional[Sequence[str]] = None,
+                   columns: Optional[Sequence[str]] = None, tenant_id: Optional[str] = None) -> pd.DataFrame:
+        """
+        Raw telemetry with ``start <= timestamp < end``, sorted by timestamp,
+        optionally for one tenant (pruned to its partitions in the cold tier).
+
+        Postgres holds everything not yet purged, and only rows before the hot
+        window's cutoff are ever purged, so the cold tier is read only for that
+        part of the range. Rows present in both tiers are returned once.
+        """
+        columns = list(columns or COLUMNS)
+        selected = list(dict.fromkeys(columns + ["id", "timestamp"]))
+        frames = []
+
+        cold_end = min(end, self.cutoff())
+        if start < cold_end:
+            filters = [("timestamp", ">=", start), ("timestamp", "<", cold_end)]
+            if user_ids is not None:
+                filters.append(("user_id", "in", list(user_ids)))
+            frames.append(self.connector.read(
+                DATASET, columns=selected, tenant_id=tenant_id, start_date=start.date(),
+                end_date=(cold_end - timedelta(microseconds=1)).date() + timedelta(days=1),
+                filters=filters
+            ))
+
+        hot_query = f"SELECT {', '.join(selected)} FROM telemetry WHERE timestamp >= :start AND timestamp < :end"
+        params = {"start": start, "end": end}
+        if user_ids is not None:
+            hot_query += " AND user_id = ANY(:user_ids)"
+            params["user_ids"] = list(user_ids)
+        if tenant_id is not None:
+            hot_query += " AND tenant_id = :tenant_id"
+            params["tenant_id"] = tenant_id
+        with self.db_engine.connect() as conn:
+            frames.append(pd.read_sql(text(hot_query), conn, params=params))
+
+        frames = [frame for frame in frames if not frame.empty]
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        df = pd.concat(frames, ignore_index=True)
+        df["timestamp"] = pd.to_datetime(df["timestamp"])
+        df = df.drop_duplicates("id").sort_values(["timestamp", "id"], kind="stable")
+        return df[columns].reset_index(drop=True)
@@ -0,0 +1,174 @@
+"""
+Parquet data lake connector: Hive-style tenant/date partitions on any pyarrow filesystem.
+"""
+import logging
+import uuid
+from datetime import date as date_type
+from typing import Iterable, List, Optional, Sequence, Tuple, Union
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+# Partition keys are part of the path, not the file: <dataset>/tenant_id=<t>/date=<YYYY-MM-DD>/
+PARTITIONING = ds.partitioning(
+    pa.schema([("tenant_id", pa.string()), ("date", pa.date32())]),
+    flavor="hive",
+)
+
+DEFAULT_ROW_GROUP_SIZE = 128_000
+
+# Same tuple form as pandas/pyarrow ``filters``: [("col", "op", value), ...]
+Filters = Optional[Union[List[Tuple], List[List[Tuple]], ds.Expression]]
+
+
+def _as_date(value: Union[str, date_type]) -> date_type:
+    return date_type.fromisoformat(value) if isinstance(value, str) else value
+
+
+def connector_from_uri(uri: str) -> "DataLakeConnector":
+    """``s3://bucket/prefix`` for S3, anything else is a local directory."""
+    if uri.startswith("s3://"):
+        from .s3_connector import S3Connector
+        bucket, _, prefix = uri[len("s3://"):].partition("/")
+        return S3Connector(bucket, prefix)
+    from .local_connector import LocalConnector
+    return LocalConnector(uri[len("file://"):] if uri.startswith("file://") else uri)
+
+
+class DataLakeConnector:
+    """
+    Reads and writes Parquet datasets partitioned by tenant and date.
+
+    Writes stream record batches into a ``ParquetWriter`` on the filesystem's
+    output stream, one row group at a time, so a large frame is never encoded
+    as a whole in memory (on S3 the stream is a multipart upload). Reads go
+    through ``pyarrow.dataset``: partitions outside the tenant/date range are
+    never listed, and column projection and row filters are pushed down to
+    the Parquet row groups.
+    """
+    def __init__(self, filesystem: pafs.FileSystem, root: str, compression: str = "zstd"):
+        self.fs = filesystem
+        self.root = root.rstrip("/")
+        self.compression = compression
+
+    def _dataset_path(self, dataset: str) -> str:
+        return f"{self.root}/{dataset}"
+
+    def partition_path(self, dataset: str, tenant_id: str, date: Union[str, date_type]) -> str:
+        return f"{self._dataset_path(dataset)}/tenant_id={tenant_id}/date={_as_date(date).isoformat()}"
+
+    def write_batches(self, dataset: str, tenant_id: str, date: Union[str, date_type],
+                      batches: Iterable[Union[pd.DataFrame, pa.RecordBatch, pa.Table]],
+                      schema: Optional[pa.Schema] = None, name: Optional[str] = None) -> Optional[str]:
+        """
+        Stream batches into a new file in one partition. Files get unique names
+        unless ``name`` is given (writing the same name again replaces the file,
+        which makes retried jobs idempotent). The file is written under a
+        temporary name that dataset reads skip and moved into place only once
+        every batch is written, so a failed write never replaces or adds a
+        truncated file. Returns the file path, or None if there was nothing to
+        write.
+        """
+        partition = self.partition_path(dataset, tenant_id, date)
+        path = f"{partition}/{name or 'part-' + uuid.uuid4().hex}.parquet"
+        # Leading underscore: ignored by pyarrow datasets
+        staging = f"{partition}/_inprogress-{uuid.uuid4().hex}.parquet"
+        writer = None
+        rows = 0
+        try:
+            for batch in batches:
+                if isinstance(batch, pd.DataFrame):
+                    batch = pa.Table.from_pandas(batch, schema=schema, preserve_index=False)
+                elif isinstance(batch, pa.RecordBatch):
+                    batch = pa.Table.from_batches([batch])
+                if batch.num_rows == 0:
+                    continue
+                if writer is None:
+                    schema = schema or batch.schema
+                    self.fs.create_dir(partition, recursive=True)
+                    writer = pq.ParquetWriter(self.fs.open_output_stream(staging), schema,
+                                              compression=self.compression)
+                writer.write_table(batch.cast(schema), row_group_size=DEFAULT_ROW_GROUP_SIZE)
+                rows += batch.num_rows
+        except BaseException:
+            if writer is not None:
+                writer.close()
+                self.fs.delete_file(staging)
+            raise
+        if writer is None:
+            return None
+        writer.close()
+        self.fs.move(staging, path)
+        logger.info(f"Wrote {rows} rows to {path}")
+        return path
+
+    def write_dataframe(self, dataset: str, tenant_id: str, date: Union[str, date_type],
+                        df: pd.DataFrame, row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+                        name: Optional[str] = None) -> Optional[str]:
+        """Write a DataFrame to one partition, converting a row group at a time."""
+        schema = pa.Schema.from_pandas(df.iloc[:0], preserve_index=False)
+        slices = (df.iloc[i:i + row_group_size] for i in range(0, len(df), row_group_size))
+        return self.write_batches(dataset, tenant_id, date, slices, schema=schema, name=name)
+
+    def dataset(self, dataset: str) -> Optional[ds.Dataset]:
+        path = self._dataset_path(dataset)
+        if self.fs.get_file_info(path).type == pafs.FileType.NotFound:
+            return None
+        return ds.dataset(path, filesystem=self.fs, format="parquet", partitioning=PARTITIONING)
+
+    def _filter(self, tenant_id: Optional[str], start_date, end_date, filters: Filters) -> Optional[ds.Expression]:
+        expressions = []
+        if tenant_id is not None:
+            expressions.append(ds.field("tenant_id") == tenant_id)
+        if start_date is not None:
+            expressions.append(ds.field("date") >= _as_date(start_date))
+        if end_date is not None:
+            expressions.append(ds.field("date") < _as_date(end_date))
+        if filters is not None:
+            expressions.append(filters if isinstance(filters, ds.Expression) else pq.filters_to_expression(filters))
+        if not expressions:
+            return None
+        combined = expressions[0]
+        for expression in expressions[1:]:
+            combined = combined & expression
+        return combined
+
+    def scanner(self, dataset: str, columns: Optional[Sequence[str]] = None, tenant_id: Optional[str] = None,
+                start_date=None, end_date=None, filters: Filters = None,
+                batch_size: int = DEFAULT_ROW_GROUP_SIZE) -> Optional[ds.Scanner]:
+        """Scanner over [start_date, end_date) for streaming reads via ``to_batches()``."""
+        data = self.dataset(dataset)
+        if data is None:
+            return None
+        return data.scanner(
+            columns=list(columns) if columns is not None else None,
+            filter=self._filter(tenant_id, start_date, end_date, filters),
+            batch_size=batch_size,
+        )
+
+    def read(self, dataset: str, columns: Optional[Sequence[str]] = None, tenant_id: Optional[str] = None,
+             start_date=None, end_date=None, filters: Filters = None) -> pd.DataFrame:
+        """Read [start_date, end_date) of a dataset into a DataFrame."""
+        scanner = self.scanner(dataset, columns, tenant_id, start_date, end_date, filters)
+        if scanner is None:
+            return pd.DataFrame(columns=list(columns or []))
+        return scanner.to_table().to_pandas()
+
+    # Feature snapshots, one partition per tenant and day
+
+    def upload_features(self, org_id: str, date: Union[str, date_type], features_df: pd.DataFrame) -> Optional[str]:
+        """The day's snapshot; uploading the same tenant and day again replaces it."""
+        return self.write_dataframe("features", org_id, date, features_df, name="features")
+
+    def download_features(self, org_id: str, date: Union[str, date_type], columns: Optional[Sequence[str]] = None,
+                          filters: Filters = None) -> pd.DataFrame:
+        day = _as_date(date)
+        df = self.read("features", columns=columns, tenant_id=org_id, start_date=day,
+                       end_date=date_type.fromordinal(day.toordinal() + 1), filters=filters)
+        # Partition keys are implied by the arguments unless asked for
+        implied = [c for c in ("tenant_id", "date") if c in df.columns and (columns is None or c not in columns)]
+        return df.drop(columns=implied)
@@ -0,0 +1,10 @@
+import pyarrow.fs as pafs
+import os
+from .connector import DataLakeConnector
+
+class LocalConnector(DataLakeConnector):
+    """Data lake on the local filesystem, for tests and offline use. Same layout as S3."""
+    def __init__(self, root: str):
+        root = os.path.abspath(root)
+        os.makedirs(root, exist_ok=True)
+        super().__init__(pafs.LocalFileSystem(), root)
@@ -1,24 +1,15 @@
-import boto3
-import pandas as pd
-from io import StringIO
+import pyarrow.fs as pafs
 import os
+from .connector import DataLakeConnector
 
-class S3Connector:
-    def __init__(self, bucket: str):
-        self.s3 = boto3.client('s3',
-            aws_access_key_id=os.getenv('AWS_ACCESS_KEY'),
-            aws_secret_access_key=os.getenv('AWS_SECRET_KEY')
+class S3Connector(DataLakeConnector):
+    """Data lake on S3. pyarrow's S3 output streams upload in parts as row groups are written."""
+    def __init__(self, bucket: str, prefix: str = "", region: str = None):
+        filesystem = pafs.S3FileSystem(
+            access_key=os.getenv('AWS_ACCESS_KEY'),
+            secret_key=os.getenv('AWS_SECRET_KEY'),
+            region=region or os.getenv('AWS_REGION'),
+            endpoint_override=os.getenv('S3_ENDPOINT_URL'),
         )
+        super().__init__(filesystem, f"{bucket}/{prefix}".rstrip("/"))
         self.bucket = bucket
-
-    def upload_features(self, org_id: str, date: str, features_df: pd.DataFrame):
-        csv_buffer = StringIO()
-        features_df.to_csv(csv_buffer, index=False)
-        key = f"features/{org_id}/{date}/features.csv"
-        self.s3.put_object(Bucket=self.bucket, Key=key, Body=csv_buffer.getvalue())
-        return key
-
-    def download_features(self, org_id: str, date: str) -> pd.DataFrame:
-        key = f"features/{org_id}/{date}/features.csv"
-        obj = self.s3.get_object(Bucket=self.bucket, Key=key)
-        return pd.read_csv(obj['Body'])
@@ -1,6 +1,6 @@
 # Additions to existing models.py
 
-from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, JSON, ForeignKey, BigInteger
+from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, JSON, ForeignKey, BigInteger, UniqueConstraint, LargeBinary, Index, text
 from sqlalchemy.orm import relationship
 from datetime import datetime
 
@@ -32,15 +32,24 @@ class Session(Base):
     terminated_at = Column(DateTime, nullable=True)
 
 class Telemetry(Base):
+    """Raw events, range-partitioned by day on timestamp (see db/partitioning.py)."""
     __tablename__ = "telemetry"
     id = Column(BigInteger, primary_key=True, autoincrement=True)
     session_id = Column(String(255), index=True)
     user_id = Column(String(50), index=True)
+    tenant_id = Column(String(50), nullable=True)  # cold-tier partition key
     ip = Column(String(45))
+    device = Column(String(255), nullable=True)
     keystroke_speed = Column(Float)
     mouse_speed = Column(Float)
-    timestamp = Column(DateTime, index=True)
+    timestamp = Column(DateTime, primary_key=True)  # partition key, so part of the primary key
+    risk_score = Column(Float, nullable=True)  # set after scoring
     # Additional fields can be added without breaking
+    __table_args__ = (
+        # Rows arrive in time order, so a BRIN index is tiny and prunes just as well
+        Index("ix_telemetry_timestamp_brin", "timestamp", postgresql_using="brin"),
+        {"postgresql_partition_by": "RANGE (timestamp)"},
+    )
 
 class AuditLog(Base):
     __tablename__ = "audit_logs"
@@ -51,6 +60,28 @@ class AuditLog(Base):
     session_id = Column(String(255), nullable=True)
     details = Column(JSON)
     signature = Column(String(128))
+    # Hash chain (see audit/chain.py); NULL for entries written before it existed
+    seq = Column(BigInteger, unique=True, nullable=True)
+    prev_hash = Column(String(64), nullable=True)
+    entry_hash = Column(String(64), nullable=True)
+    __table_args__ = (
+        # Keyset pagination for exports, in chain order (api/v3/audit.py)
+        Index("ix_audit_logs_seq_id", text("COALESCE(seq, 0)"), "id"),
+    )
+
+class AuditCheckpoint(Base):
+    """Merkle root over each full block of chained audit entries, linked to the previous block's root."""
+    __tablename__ = "audit_checkpoints"
+    block = Column(BigInteger, primary_key=True)
+    first_seq = Column(BigInteger, nullable=False)
+    last_seq = Column(BigInteger, nullable=False)
+    first_timestamp = Column(DateTime, index=True)
+    last_timestamp = Column(DateTime, index=True)
+    merkle_root = Column(String(64), nullable=False)
+    last_entry_hash = Column(String(64), nullable=False)
+    prev_root = Column(String(64), nullable=False)
+    signature = Column(String(128), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
 
 class FeatureCache(Base):
     __tablename__ = "feature_cache"
@@ -80,6 +111,7 @@ class PolicyRule(Base):
     action = Column(String(50)) # "block", "mfa", "log", "allow"
     priority = Column(Integer, default=100)
     enabled = Column(Boolean, default=True)
+    tenant_id = Column(String(50), nullable=True, index=True)  # None applies to all tenants
     triggered_count = Column(BigInteger, default=0)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -94,16 +126,60 @@ class BillingUsage(Base):
     date = Column(DateTime, default=datetime.utcnow, index=True)
 
 class TelemetryHourlyAgg(Base):
-    """Precomputed aggregates for feature store."""
+    """Precomputed aggregates for feature store, range-partitioned by week on hour."""
     __tablename__ = "telemetry_hourly_agg"
     id = Column(BigInteger, primary_key=True, autoincrement=True)
     user_id = Column(String(50), index=True)
-    hour = Column(DateTime, index=True)
+    hour = Column(DateTime, primary_key=True)  # partition key
     avg_keystroke_speed = Column(Float)
     avg_mouse_speed = Column(Float)
     unique_ips = Column(Integer)
     max_risk_score = Column(Float)
     event_count = Column(Integer)
+    ip_sketch = Column(LargeBinary, nullable=True)      # HyperLogLog of IPs seen in the hour
+    device_sketch = Column(LargeBinary, nullable=True)  # HyperLogLog of devices seen in the hour
+    __table_args__ = (
+        UniqueConstraint("user_id", "hour", name="uq_telemetry_hourly_agg_user_hour"),
+        Index("ix_telemetry_hourly_agg_hour_brin", "hour", postgresql_using="brin"),
+        {"postgresql_partition_by": "RANGE (hour)"},
+    )
+
+class RollupWatermark(Base):
+    """Per-hour rollup state: an hour is dirty until its telemetry has been aggregated."""
+    __tablename__ = "rollup_watermarks"
+    hour = Column(DateTime, primary_key=True)
+    max_telemetry_id = Column(BigInteger, default=0)  # highest telemetry id seen for the hour
+    dirty = Column(Boolean, default=True, index=True)
+    rolled_up_at = Column(DateTime, nullable=True)
+
+class JobCheckpoint(Base):
+    """Named high-water marks for incremental batch jobs."""
+    __tablename__ = "job_checkpoints"
+    name = Column(String(50), primary_key=True)
+    value = Column(BigInteger, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class AdaptiveThreshold(Base):
+    """ML-derived risk thresholds per context bucket. NULL dimensions act as wildcards."""
+    __tablename__ = "adaptive_thresholds"
+    id = Column(Integer, primary_key=True)
+    tenant_id = Column(String(50), nullable=True, index=True)
+    user_role = Column(String(20), nullable=True)
+    hour_band = Column(String(20), nullable=True)        # "day", "night"
+    reputation_band = Column(String(20), nullable=True)  # "good", "neutral", "poor"
+    country_group = Column(String(50), nullable=True)
+    low = Column(Integer, nullable=False)
+    medium = Column(Integer, nullable=False)
+    high = Column(Integer, nullable=False)
+    source = Column(String(20), default="manual")  # manual, learned
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    __table_args__ = (
+        # One row per bucket; NULLs are distinct in a plain unique constraint,
+        # so the wildcards are coalesced (the ON CONFLICT target in adaptive_thresholds.py)
+        Index("uq_adaptive_thresholds_bucket", text("COALESCE(tenant_id, '*')"), text("COALESCE(user_role, '*')"),
+              text("COALESCE(hour_band, '*')"), text("COALESCE(reputation_band, '*')"),
+              text("COALESCE(country_group, '*')"), unique=True),
+    )
 
 # ===== NEW COMMERCIAL MODELS =====
 # Add these after your existing models (AuditLog, FeatureCache, etc.)
@@ -117,6 +193,8 @@ class Tenant(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     is_active = Column(Boolean, default=True)
+    # Comma-separated ISO country codes sessions may come from; empty allows all
+    allowed_countries = Column(String, nullable=True)
 
     # Stripe fields
     stripe_customer_id = Column(String, unique=True, nullable=True)
@@ -0,0 +1,180 @@
+"""
+Native Postgres range partitioning for the time-series tables: creation ahead of time and retention.
+"""
+import asyncio
+import os
+import re
+import logging
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Any, List, Optional
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# Partition key and width per table. Retention of 0 keeps everything; telemetry
+# retention is normally left to the archiver, which only drops archived partitions.
+PARTITIONED_TABLES: Dict[str, Dict[str, Any]] = {
+    "telemetry": {
+        "column": "timestamp",
+        "interval": os.getenv("TELEMETRY_PARTITION_INTERVAL", "day"),
+        "retention_days": int(os.getenv("TELEMETRY_RETENTION_DAYS", "0")),
+    },
+    "telemetry_hourly_agg": {
+        "column": "hour",
+        "interval": os.getenv("HOURLY_AGG_PARTITION_INTERVAL", "week"),
+        "retention_days": int(os.getenv("HOURLY_AGG_RETENTION_DAYS", "0")),
+    },
+}
+
+_UPPER_BOUND = re.compile(r"TO \('([^']+)'\)")
+
+_LIST_PARTITIONS = text("""
+    SELECT child.relname AS name, pg_get_expr(child.relpartbound, child.oid) AS bound
+    FROM pg_inherits
+    JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+    JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+    WHERE parent.relname = :table
+""")
+
+
+def period_start(timestamp: datetime, interval: str) -> datetime:
+    """Start of the day (or ISO week) containing ``timestamp``."""
+    start = timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    if interval == "week":
+        start -= timedelta(days=start.weekday())
+    return start
+
+
+def period_end(start: datetime, interval: str) -> datetime:
+    return start + timedelta(days=7 if interval == "week" else 1)
+
+
+def partition_name(table: str, start: datetime) -> str:
+    return f"{table}_p{start:%Y%m%d}"
+
+
+class PartitionManager:
+    """
+    Keeps ``PARTITIONED_TABLES`` partitioned by day or week.
+
+    Partitions are created ``ahead`` periods in advance so inserts never wait
+    on DDL; a default partition catches stray timestamps outside every range,
+    and its rows are moved out when a range covering them is created.
+    Retention detaches and drops whole partitions, which is instant and leaves
+    no dead tuples behind, unlike row deletes. Tables that are not (yet)
+    partitioned, see scripts/partition_tables.py, are skipped.
+    """
+    def __init__(self, db_engine, ahead: Optional[int] = None, interval: Optional[int] = None):
+        self.db_engine = db_engine
+        self.ahead = ahead or int(os.getenv("PARTITION_PREMAKE", "7"))
+        self.interval = interval or int(os.getenv("PARTITION_MAINTENANCE_INTERVAL", "3600"))
+
+    def is_partitioned(self, table: str) -> bool:
+        with self.db_engine.connect() as conn:
+            return conn.execute(
+                text("SELECT relkind = 'p' FROM pg_class WHERE relname = :table"), {"table": table}
+            ).scalar() or False
+
+    def partitions(self, table: str) -> List[Dict[str, Any]]:
+        """Range partitions of ``table`` with their exclusive upper bound, oldest first."""
+        with self.db_engine.connect() as conn:
+            rows = conn.execute(_LIST_PARTITIONS, {"table": table}).fetchall()
+        result = []
+        for row in rows:
+            match = _UPPER_BOUND.search(row.bound)
+            if match:  # skips the default partition
+                result.append({"name": row.name, "end": datetime.fromisoformat(match.group(1))})
+        return sorted(result, key=lambda p: p["end"])
+
+    def ensure_partitions(self, table: str, start: Optional[datetime] = None,
+                          now: Optional[datetime] = None, conn=None) -> List[str]:
+        """
+        Create missing partitions from ``start`` (default: now) through ``ahead``
+        periods ahead, in ``conn``'s transaction if given.
+        """
+        if conn is None:
+            with self.db_engine.begin() as conn:
+                return self.ensure_partitions(table, start, now, conn)
+        spec = PARTITIONED_TABLES[table]
+        now = now or datetime.utcnow()
+        period = period_start(start or now, spec["interval"])
+        last = period_start(now, spec["interval"])
+        for _ in range(self.ahead):
+            last = period_end(last, spec["interval"])
+        # Continue after the newest range (which may be a migrated legacy partition)
+        for row in conn.execute(_LIST_PARTITIONS, {"table": table}):
+            match = _UPPER_BOUND.search(row.bound)
+            while match and period < datetime.fromisoformat(match.group(1)):
+                period = period_end(period, spec["interval"])
+        created = []
+        conn.execute(text(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT"))
+        while period <= last:
+            end = period_end(period, spec["interval"])
+            name = partition_name(table, period)
+            bounds = f"FOR VALUES FROM ('{period.isoformat()}') TO ('{end.isoformat()}')"
+            strays = conn.execute(
+                text(f"SELECT EXISTS (SELECT 1 FROM {table}_default WHERE {spec['column']} >= :start "
+                     f"AND {spec['column']} < :end)"),
+                {"start": period, "end": end}
+            ).scalar()
+            if strays:
+                # Postgres refuses a range the default partition already holds rows
+                # for (e.g. future timestamps), so move them into the new table first
+                conn.execute(text(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+                moved = conn.execute(text(
+                    f"WITH moved AS (DELETE FROM {table}_default WHERE {spec['column']} >= :start "
+                    f"AND {spec['column']} < :end RETURNING *) INSERT INTO {name} SELECT * FROM moved"
+                ), {"start": period, "end": end}).rowcount
+                conn.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {name} {bounds}"))
+                logger.info(f"Moved {moved} rows of {table} from the default partition into {name}")
+            else:
+                conn.execute(text(f"CREATE TABLE {name} PARTITION OF {table} {bounds}"))
+            created.append(name)
+            period = end
+        if created:
+            logger.info(f"Created partitions {created[0]}..{created[-1]} of {table}")
+        return created
+
+    def drop_before(self, table: str, cutoff: datetime,
+                    prepare: Optional[Callable[[Any, str], bool]] = None) -> List[str]:
+        """
+        Drop partitions holding only rows before ``cutoff``. With ``prepare``,
+        each partition is first locked against writes and ``prepare(conn, name)``
+        runs in the same transaction; returning False keeps that partition and
+        every newer one (e.g. rows the archiver has not copied yet).
+        """
+        dropped = []
+        for partition in self.partitions(table):
+            if partition["end"] > cutoff:
+                break
+            with self.db_engine.begin() as conn:
+                if prepare is not None:
+                    conn.execute(text(f"LOCK TABLE {partition['name']} IN SHARE MODE"))
+                    if not prepare(conn, partition["name"]):
+                        logger.info(f"Keeping partition {partition['name']}")
+                        break
+                conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {partition['name']}"))
+                conn.execute(text(f"DROP TABLE {partition['name']}"))
+            dropped.append(partition["name"])
+        if dropped:
+            logger.info(f"Dropped {len(dropped)} partitions of {table} before {cutoff}")
+        return dropped
+
+    def run_once(self):
+        """Create upcoming partitions and apply retention for every partitioned table (blocking)."""
+        now = datetime.utcnow()
+        for table, spec in PARTITIONED_TABLES.items():
+            if not self.is_partitioned(table):
+                continue
+            self.ensure_partitions(table, now=now)
+            if spec["retention_days"]:
+                self.drop_before(table, period_start(now, "day") - timedelta(days=spec["retention_days"]))
+
+    async def run_forever(self):
+        """Background task: partition maintenance every ``interval`` seconds."""
+        while True:
+            try:
+                await asyncio.to_thread(self.run_once)
+            except Exception as e:
+                logger.error(f"Partition maintenance failed: {e}")
+            await asyncio.sleep(self.interval)
@@ -1,60 +1,209 @@
 """
-Adaptive thresholds based on user context, with caching.
+Adaptive thresholds based on user context, compiled into an in-process lookup table.
 """
+from sqlalchemy import text
 from sqlalchemy.orm import Session
 from datetime import datetime
 import redis.asyncio as aioredis
-import json
+import asyncio
+import os
 import logging
-from typing import Dict, Any
+from typing import Dict, Any, List, Tuple
+from ..db import models
 
 logger = logging.getLogger(__name__)
 
+WILDCARD = "*"
+
+# Bucket dimensions in order of precedence: a match on an earlier dimension
+# outranks any combination of matches on later ones (e.g. role beats hour band).
+DIMENSIONS = ("tenant_id", "user_role", "hour_band", "reputation_band", "country_group")
+
+BucketKey = Tuple[str, str, str, str, str]
+
+# Atomic per bucket, so workers publishing the same buckets at once can't
+# insert duplicates; manually curated rows are never overwritten with learned values
+_UPSERT = text(f"""
+    INSERT INTO adaptive_thresholds ({", ".join(DIMENSIONS)}, low, medium, high, source, updated_at)
+    VALUES ({", ".join(":" + dim for dim in DIMENSIONS)}, :low, :medium, :high, :source, now())
+    ON CONFLICT ({", ".join(f"(COALESCE({dim}, '{WILDCARD}'))" for dim in DIMENSIONS)}) DO UPDATE SET
+        low = EXCLUDED.low, medium = EXCLUDED.medium, high = EXCLUDED.high, updated_at = now()
+    WHERE adaptive_thresholds.source = EXCLUDED.source
+""")
+
+
+def hour_band(hour: int) -> str:
+    # Night time (0-6, 23) – lower trust expected
+    return "night" if hour < 6 or hour > 22 else "day"
+
+
+def reputation_band(ip_reputation) -> str:
+    if ip_reputation is None:
+        return WILDCARD
+    if ip_reputation < 40:
+        return "poor"
+    if ip_reputation < 70:
+        return "neutral"
+    return "good"
+
+
+def _parse_country_groups(spec: str) -> Dict[str, str]:
+    """Parse "domestic=US,CA;eu=DE,FR" into a country -> group mapping."""
+    groups = {}
+    for part in filter(None, (p.strip() for p in spec.split(";"))):
+        name, _, countries = part.partition("=")
+        for country in filter(None, (c.strip().upper() for c in countries.split(","))):
+            groups[country] = name.strip()
+    return groups
+
+
+def _env_thresholds(suffix: str, low: str, medium: str, high: str) -> Dict[str, int]:
+    return {
+        "low": int(os.getenv(f"THRESHOLD_LOW_{suffix}", low)),
+        "medium": int(os.getenv(f"THRESHOLD_MEDIUM_{suffix}", medium)),
+        "high": int(os.getenv(f"THRESHOLD_HIGH_{suffix}", high)),
+    }
+
+
 class AdaptiveThresholds:
     """
     Context‑aware thresholds that can be overridden by ML models.
+
+    Rows of the ``adaptive_thresholds`` table (plus the env defaults) are compiled
+    into a dict keyed by bucketed context. Resolving a context is a dict lookup;
+    the table is reloaded in the background when the Redis version key changes.
     """
     def __init__(self, db_session_factory, redis_client: aioredis.Redis, cache_ttl: int = 300):
         self.db_session_factory = db_session_factory
         self.redis = redis_client
-        self.cache_ttl = cache_ttl
+        self.cache_ttl = cache_ttl  # how often the version key is polled
+        self.version_key = "thresholds:version"
+        self.country_groups = _parse_country_groups(os.getenv("THRESHOLD_COUNTRY_GROUPS", ""))
+        self._version = None
+        self._install(self._compile([]))
 
-    async def get_thresholds(self, context: dict) -> Dict[str, int]:
-        """
-        Return low/medium/high thresholds for given context.
-        """
-        cache_key = f"thresholds:{json.dumps(context, sort_keys=True)}"
-        cached = await self.redis.get(cache_key)
-        if cached:
-            return json.loads(cached)
-
-        # Default thresholds (configurable via env)
-        defaults = {
-            "low": int(os.getenv("THRESHOLD_LOW_DEFAULT", "70")),
-            "medium": int(os.getenv("THRESHOLD_MEDIUM_DEFAULT", "50")),
-            "high": int(os.getenv("THRESHOLD_HIGH_DEFAULT", "30"))
+    def _default_entries(self) -> Dict[BucketKey, Dict[str, int]]:
+        """Env-configured thresholds, used when no table row is more specific."""
+        return {
+            (WILDCARD, WILDCARD, WILDCARD, WILDCARD, WILDCARD): _env_thresholds("DEFAULT", "70", "50", "30"),
+            (WILDCARD, "admin", WILDCARD, WILDCARD, WILDCARD): _env_thresholds("ADMIN", "80", "60", "40"),
+            (WILDCARD, WILDCARD, "night", WILDCARD, WILDCARD): _env_thresholds("NIGHT", "60", "40", "20"),
         }
 
-        # In a real system, you might query a thresholds table with ML-derived values
-        # For now, we use a simple rule: if user is admin, thresholds are stricter
-        if context.get("user_role") == "admin":
-            thresholds = {
-                "low": int(os.getenv("THRESHOLD_LOW_ADMIN", "80")),
-                "medium": int(os.getenv("THRESHOLD_MEDIUM_ADMIN", "60")),
-                "high": int(os.getenv("THRESHOLD_HIGH_ADMIN", "40"))
-            }
-        else:
-            # Night time (0-6) – lower trust expected
-            hour = context.get("hour", 12)
-            if hour < 6 or hour > 22:
-                thresholds = {
-                    "low": int(os.getenv("THRESHOLD_LOW_NIGHT", "60")),
-                    "medium": int(os.getenv("THRESHOLD_MEDIUM_NIGHT", "40")),
-                    "high": int(os.getenv("THRESHOLD_HIGH_NIGHT", "20"))
-                }
-            else:
-                thresholds = defaults
-
-        # Store in cache
-        await self.redis.setex(cache_key, self.cache_ttl, json.dumps(thresholds))
+    def _compile(self, rows) -> Dict[BucketKey, Dict[str, int]]:
+        table = self._default_entries()
+        for row in rows:
+            key = tuple(
+                str(getattr(row, dim)) if getattr(row, dim) is not None else WILDCARD
+                for dim in DIMENSIONS
+            )
+            table[key] = {"low": row.low, "medium": row.medium, "high": row.high}
+        return table
+
+    def _install(self, table: Dict[BucketKey, Dict[str, int]]):
+        # Values no entry mentions behave exactly like the wildcard, so they are
+        # folded into it; this keeps the memo below bounded by the table contents.
+        known = [set() for _ in DIMENSIONS]
+        for key in table:
+            for i, value in enumerate(key):
+                if value != WILDCARD:
+                    known[i].add(value)
+        # Single assignment so concurrent readers never see a half-built state.
+        self._state = (table, known, {})
+
+    def bucket(self, context: dict) -> BucketKey:
+        """Map a raw scoring context onto its threshold bucket."""
+        tenant_id = context.get("tenant_id")
+        country = context.get("country")
+        return (
+            str(tenant_id) if tenant_id is not None else WILDCARD,
+            context.get("user_role") or WILDCARD,
+            hour_band(context.get("hour", 12)),
+            reputation_band(context.get("ip_reputation")),
+            self.country_groups.get(country.upper(), "other") if country else WILDCARD,
+        )
+
+    def get_thresholds(self, context: dict) -> Dict[str, int]:
+        """
+        Return low/medium/high thresholds for given context. No I/O.
+        """
+        table, known, resolved = self._state
+        key = tuple(
+            value if value in known[i] else WILDCARD
+            for i, value in enumerate(self.bucket(context))
+        )
+        thresholds = resolved.get(key)
+        if thresholds is None:
+            thresholds = resolved[key] = self._resolve(table, key)
         return thresholds
+
+    @staticmethod
+    def _resolve(table: Dict[BucketKey, Dict[str, int]], key: BucketKey) -> Dict[str, int]:
+        # Walk wildcard combinations from most to least specific; bit i of the
+        # mask keeps dimension i, with earlier dimensions in the higher bits.
+        n = len(DIMENSIONS)
+        for mask in range((1 << n) - 1, -1, -1):
+            candidate = tuple(
+                key[i] if mask & (1 << (n - 1 - i)) else WILDCARD for i in range(n)
+            )
+            if candidate in table:
+                return table[candidate]
+        return table[(WILDCARD,) * n]
+
+    def _load_rows(self):
+        db: Session = self.db_session_factory()
+        try:
+            return db.query(models.AdaptiveThreshold).all()
+        finally:
+            db.close()
+
+    async def refresh(self):
+        """Reload the thresholds table from the DB and recompile it."""
+        version = await self.redis.get(self.version_key)
+        try:
+            rows = await asyncio.to_thread(self._load_rows)
+        except Exception as e:
+            logger.error(f"Failed to load adaptive thresholds, keeping previous table: {e}")
+            return
+        self._install(self._compile(rows))
+        self._version = version
+        logger.info(f"Compiled {len(rows)} adaptive threshold rows (version {version})")
+
+    def _upsert(self, entries: List[Tuple[BucketKey, Dict[str, int]]], source: str):
+        params = [
+            {**{dim: (None if value == WILDCARD else value) for dim, value in zip(DIMENSIONS, key)},
+             **thresholds, "source": source}
+            for key, thresholds in entries
+        ]
+        db: Session = self.db_session_factory()
+        try:
+            db.execute(_UPSERT, params)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    async def publish(self, entries: List[Tuple[BucketKey, Dict[str, int]]], source: str = "learned"):
+        """Write thresholds for the given bucket keys and notify all workers."""
+        if not entries:
+            return
+        await asyncio.to_thread(self._upsert, entries, source)
+        await self.invalidate()
+
+    async def invalidate(self):
+        """Signal all workers that the thresholds table changed, and reload locally."""
+        await self.redis.incr(self.version_key)
+        await self.refresh()
+
+    async def run_refresh_loop(self):
+        """Background task: reload the table whenever the version key changes."""
+        while True:
+            try:
+                version = await self.redis.get(self.version_key)
+                if version != self._version:
+                    await self.refresh()
+            except Exception as e:
+                logger.error(f"Adaptive thresholds refresh failed: {e}")
+            await asyncio.sleep(self.cache_ttl)
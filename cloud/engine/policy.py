@@ -1,73 +1,296 @@
 """
-Policy engine for evaluating rules based on context.
+Policy engine for evaluating rules based on context, compiled into in-process callables.
 """
 from sqlalchemy.orm import Session
-from ..db import models
+from collections import Counter
+import redis.asyncio as aioredis
+import asyncio
+import numpy as np
+import operator
+import os
 import logging
-from typing import List, Dict, Any
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from ..db import models
+from .policy_counters import PolicyTriggerCounters
+from .policy_index import RuleIndex, index_term
+from .policy_batch import Columns, compile_mask
 
 logger = logging.getLogger(__name__)
 
+Predicate = Callable[[dict], bool]
+
+_MISSING = object()
+
+_COMPARISONS = {
+    "lt": operator.lt,
+    "lte": operator.le,
+    "gt": operator.gt,
+    "gte": operator.ge,
+}
+_OPERATORS = {
+    **_COMPARISONS,
+    "eq": operator.eq,
+    "neq": operator.ne,
+    "in": lambda value, target: value in target,
+}
+
+
+class PolicyCompileError(ValueError):
+    """A rule condition that can't be compiled (unknown operator, wrong operand type, bad nesting)."""
+
+
+def _always(context: dict) -> bool:
+    return True
+
+
+def _compile_check(field: str, op: str, target: Any) -> Predicate:
+    if op not in _OPERATORS:
+        raise PolicyCompileError(f"unknown operator {op!r} for field {field!r}")
+    if op in _COMPARISONS:
+        if isinstance(target, bool) or not isinstance(target, (int, float)):
+            raise PolicyCompileError(f"{field!r} {op} needs a number, got {target!r}")
+    elif op == "in":
+        if not isinstance(target, (list, tuple)):
+            raise PolicyCompileError(f"{field!r} in needs a list, got {target!r}")
+        try:
+            target = frozenset(target)
+        except TypeError:
+            target = tuple(target)
+    elif isinstance(target, (dict, list)):
+        raise PolicyCompileError(f"{field!r} {op} needs a scalar, got {target!r}")
+    compare = _OPERATORS[op]
+
+    def check(context: dict) -> bool:
+        value = context.get(field, _MISSING)
+        return value is not _MISSING and compare(value, target)
+    return check
+
+
+def compile_condition(condition: Any) -> Predicate:
+    """
+    Compile a rule condition into a predicate over a context dict.
+
+    Format: ``{"field": {"operator": value, ...}, ...}`` (all must hold),
+    ``{"and": [conditions]}`` or ``{"or": [conditions]}``; ``{}`` always
+    matches. A field missing from the context never matches. Raises
+    ``PolicyCompileError`` for anything else.
+    """
+    if not isinstance(condition, dict):
+        raise PolicyCompileError(f"condition must be an object, got {condition!r}")
+    if not condition:
+        return _always
+    if "and" in condition or "or" in condition:
+        if len(condition) != 1:
+            raise PolicyCompileError(f"'and'/'or' can't be combined with other keys: {sorted(condition)}")
+        combinator, subconditions = next(iter(condition.items()))
+        if not isinstance(subconditions, list) or not subconditions:
+            raise PolicyCompileError(f"{combinator!r} needs a non-empty list of conditions")
+        predicates = tuple(compile_condition(sub) for sub in subconditions)
+        if len(predicates) == 1:
+            return predicates[0]
+        if combinator == "and":
+            return lambda context: all(predicate(context) for predicate in predicates)
+        return lambda context: any(predicate(context) for predicate in predicates)
+
+    checks = []
+    for field, ops in condition.items():
+        if not isinstance(ops, dict) or not ops:
+            raise PolicyCompileError(f"field {field!r} needs an object of operators, got {ops!r}")
+        checks.extend(_compile_check(field, op, target) for op, target in ops.items())
+    if len(checks) == 1:
+        return checks[0]
+    checks = tuple(checks)
+    return lambda context: all(check(context) for check in checks)
+
+
+class CompiledRule:
+    __slots__ = ("id", "name", "action", "priority", "tenant_id", "condition", "predicate", "term", "mask")
+
+    def __init__(self, rule: models.PolicyRule):
+        self.id = rule.id
+        self.name = rule.name
+        self.action = rule.action
+        self.priority = rule.priority
+        # None applies to every tenant
+        self.tenant_id = str(rule.tenant_id) if rule.tenant_id is not None else None
+        self.condition = rule.condition
+        self.predicate = compile_condition(rule.condition)
+        self.term = index_term(rule.condition)
+        self.mask = compile_mask(rule.condition)
+
+
+def build_indexes(rules: List[CompiledRule]) -> Dict[Optional[str], RuleIndex]:
+    """One ``RuleIndex`` per tenant (``None`` for global rules) over positions in ``rules``."""
+    entries: Dict[Optional[str], list] = {}
+    for position, rule in enumerate(rules):
+        entries.setdefault(rule.tenant_id, []).append((position, rule.term))
+    return {tenant_id: RuleIndex(items) for tenant_id, items in entries.items()}
+
+
+def compile_rules(rules: List[models.PolicyRule]) -> Tuple[List[CompiledRule], Dict[str, str]]:
+    """Compiled rules, in the given order, and the names of rules that failed to compile with the reason."""
+    compiled, rejected = [], {}
+    for rule in rules:
+        try:
+            compiled.append(CompiledRule(rule))
+        except PolicyCompileError as e:
+            rejected[rule.name] = str(e)
+    return compiled, rejected
+
+
+def match_rules(rules: List[CompiledRule], columns: Columns,
+                tenants: np.ndarray) -> Iterator[Tuple[CompiledRule, np.ndarray]]:
+    """
+    Each rule, in order, with the mask of contexts in ``columns`` it matches.
+    ``tenants`` holds each context's tenant id as a string (or None) for
+    tenant-scoped rules.
+    """
+    tenant_masks: Dict[str, np.ndarray] = {}
+    for rule in rules:
+        matched, _ = rule.mask(columns)
+        if rule.tenant_id is not None:
+            if rule.tenant_id not in tenant_masks:
+                tenant_masks[rule.tenant_id] = tenants == rule.tenant_id
+            matched &= tenant_masks[rule.tenant_id]
+        yield rule, matched
+
+
 class PolicyEngine:
-    def __init__(self, db_session_factory):
+    """
+    Evaluates enabled ``policy_rules`` against a context with no I/O.
+
+    Rules are compiled once per version into predicates with their operators
+    and constants bound, and kept in process. A rule applies to its tenant
+    (the context's ``tenant_id``) or, without one, to all tenants; per-tenant
+    rule indexes narrow each evaluation to the rules that can match. Every worker reloads them when
+    the Redis version key changes (see ``invalidate``). Rules whose condition
+    doesn't compile are left out, with one error per load. Triggers are
+    counted through ``counters`` (see ``PolicyTriggerCounters``).
+    """
+    def __init__(self, db_session_factory, redis_client: Optional[aioredis.Redis] = None,
+                 refresh_interval: Optional[int] = None, counters: Optional[PolicyTriggerCounters] = None):
         self.db_session_factory = db_session_factory
+        self.redis = redis_client
+        self.refresh_interval = refresh_interval or int(os.getenv("POLICY_REFRESH_INTERVAL", "30"))
+        self.version_key = "policies:version"
+        self._version = None
+        # (rules in priority order, per-tenant indexes), swapped as one
+        self._compiled: Optional[Tuple[List[CompiledRule], Dict[Optional[str], RuleIndex]]] = None
+        # Trigger counts, aggregated off the hot path
+        self.counters = counters
+
+    def _load_rows(self) -> List[models.PolicyRule]:
+        db: Session = self.db_session_factory()
+        try:
+            return db.query(models.PolicyRule).filter_by(enabled=True).order_by(models.PolicyRule.priority).all()
+        finally:
+            db.close()
+
+    def _install(self, rows: List[models.PolicyRule], version=None):
+        rules, rejected = compile_rules(rows)
+        for name, reason in rejected.items():
+            logger.error(f"Policy rule '{name}' disabled: {reason}")
+        # Single assignment: evaluations in flight keep the previous set
+        self._compiled = (rules, build_indexes(rules))
+        self._version = version
+        logger.info(f"Compiled {len(rules)} policy rules (version {version})")
+
+    def load(self):
+        """Load and compile the enabled rules (blocking)."""
+        self._install(self._load_rows(), self._version)
+
+    async def refresh(self):
+        """Reload and recompile the rules, keeping the current set if the DB is unavailable."""
+        version = await self.redis.get(self.version_key) if self.redis is not None else None
+        try:
+            rows = await asyncio.to_thread(self._load_rows)
+        except Exception as e:
+            logger.error(f"Failed to load policy rules, keeping previous set: {e}")
+            return
+        self._install(rows, version)
+
+    async def invalidate(self):
+        """Signal all workers that policy rules changed, and reload locally."""
+        if self.redis is not None:
+            await self.redis.incr(self.version_key)
+        await self.refresh()
 
     def evaluate(self, context: dict) -> List[Dict[str, Any]]:
         """
         Evaluate all enabled rules against context.
-        Returns list of actions with rule names.
+        Returns list of actions with rule names, in priority order.
         """
-        db = self.db_session_factory()
-        try:
-            rules = db.query(models.PolicyRule).filter_by(enabled=True).order_by(models.PolicyRule.priority).all()
-            actions = []
-            for rule in rules:
-                if self._matches(rule.condition, context):
-                    actions.append({"action": rule.action, "rule": rule.name})
-                    rule.triggered_count += 1
-                    db.commit()
-                    logger.info(f"Policy rule '{rule.name}' triggered with action {rule.action}")
-            return actions
-        finally:
-            db.close()
+        if self._compiled is None:
+            self.load()
+        rules, indexes = self._compiled
+        actions = []
+        for position in sorted(self._candidates(indexes, context)):
+            rule = rules[position]
+            try:
+                matched = rule.predicate(context)
+            except TypeError:
+                # e.g. a None value compared with a number
+                matched = False
+            if matched:
+                actions.append({"action": rule.action, "rule": rule.name})
+                if self.counters is not None:
+                    self.counters.record(rule.id, context.get("tenant_id"))
+                logger.info(f"Policy rule '{rule.name}' triggered with action {rule.action}")
+        return actions
 
-    def _matches(self, condition: dict, context: dict) -> bool:
+    def evaluate_batch(self, contexts: List[dict]) -> List[List[Dict[str, Any]]]:
         """
-        Recursively evaluate condition against context.
-        Condition format: {"field": {"operator": value}} or {"and": [conditions]} or {"or": [conditions]}
+        ``evaluate`` for many contexts at once, with identical results: each
+        rule's condition is evaluated as boolean masks over numpy columns of
+        the batch's fields instead of once per context.
         """
-        if "and" in condition:
-            return all(self._matches(sub, context) for sub in condition["and"])
-        if "or" in condition:
-            return any(self._matches(sub, context) for sub in condition["or"])
-        # Simple field comparison
-        for field, ops in condition.items():
-            if field not in context:
-                return False
-            val = context[field]
-            for op, target in ops.items():
-                if op == "lt":
-                    if not (val < target):
-                        return False
-                elif op == "lte":
-                    if not (val <= target):
-                        return False
-                elif op == "gt":
-                    if not (val > target):
-                        return False
-                elif op == "gte":
-                    if not (val >= target):
-                        return False
-                elif op == "eq":
-                    if not (val == target):
-                        return False
-                elif op == "neq":
-                    if not (val != target):
-                        return False
-                elif op == "in":
-                    if val not in target:
-                        return False
-                else:
-                    logger.warning(f"Unknown operator {op} in policy condition")
-                    return False
-        return True
+        rules = self.rules
+        actions: List[List[Dict[str, Any]]] = [[] for _ in contexts]
+        if not contexts:
+            return actions
+        columns = Columns(contexts)
+        tenants = np.array([
+            str(context["tenant_id"]) if context.get("tenant_id") is not None else None for context in contexts
+        ], dtype=object)
+        for rule, matched in match_rules(rules, columns, tenants):
+            hits = np.flatnonzero(matched)
+            if not len(hits):
+                continue
+            action = {"action": rule.action, "rule": rule.name}
+            for i in hits:
+                actions[i].append(dict(action))
+            if self.counters is not None:
+                for tenant_id, count in Counter(tenants[hits]).items():
+                    self.counters.record(rule.id, tenant_id, count=count)
+            logger.info(f"Policy rule '{rule.name}' triggered {len(hits)} times with action {rule.action}")
+        return actions
+
+    @staticmethod
+    def _candidates(indexes: Dict[Optional[str], RuleIndex], context: dict) -> List[int]:
+        candidates = []
+        scopes = [None]
+        if context.get("tenant_id") is not None:
+            scopes.append(str(context["tenant_id"]))
+        for scope in scopes:
+            index = indexes.get(scope)
+            if index is not None:
+                candidates.extend(index.candidates(context))
+        return candidates
+
+    @property
+    def rules(self) -> List[CompiledRule]:
+        """Compiled enabled rules in priority order."""
+        if self._compiled is None:
+            self.load()
+        return self._compiled[0]
+
+    async def run_refresh_loop(self):
+        """Background task: reload the rules whenever the version key changes."""
+        while True:
+            try:
+                version = await self.redis.get(self.version_key) if self.redis is not None else None
+                if version != self._version or self._compiled is None:
+                    await self.refresh()
+            except Exception as e:
+                logger.error(f"Policy engine refresh failed: {e}")
+            await asyncio.sleep(self.refresh_interval)
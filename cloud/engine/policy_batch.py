@@ -0,0 +1,216 @@
+"""
+Vectorized policy condition evaluation over batches of contexts.
+"""
+import operator
+import numpy as np
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+_MISSING = object()
+
+# Integers beyond this lose precision as float64, so they take the exact (Python) path
+_EXACT_FLOAT_INT = 2 ** 53
+
+_COMPARISONS = {
+    "lt": operator.lt,
+    "lte": operator.le,
+    "gt": operator.gt,
+    "gte": operator.ge,
+}
+_OPERATORS = {
+    **_COMPARISONS,
+    "eq": operator.eq,
+    "neq": operator.ne,
+    "in": lambda value, target: value in target,
+}
+
+# (matched, raised TypeError) per context; a context is never in both
+Masks = Tuple[np.ndarray, np.ndarray]
+MaskFn = Callable[["Columns"], Masks]
+
+
+def _is_plain_number(value: Any) -> bool:
+    kind = type(value)
+    return kind is float or kind is bool or (kind is int and -_EXACT_FLOAT_INT <= value <= _EXACT_FLOAT_INT)
+
+
+class Column:
+    """
+    One context field across a batch. Plain numbers (bool, float, ints that
+    are exact as float64) go into a float64 array; any other value is
+    factorized into ``codes`` over ``uniques``, so Python only sees each
+    distinct one once.
+    """
+    __slots__ = ("values", "present", "plain", "numbers", "codes", "uniques")
+
+    def __init__(self, values: List[Any]):
+        n = len(values)
+        self.values = values
+        self.present = np.ones(n, dtype=bool)
+        self.plain = np.zeros(n, dtype=bool)
+        self.numbers = np.full(n, np.nan)
+        self.codes = np.full(n, -1, dtype=np.int64)
+        self.uniques: List[Any] = []
+        lookup: Dict[Any, int] = {}
+        for i, value in enumerate(values):
+            if value is _MISSING:
+                self.present[i] = False
+            elif _is_plain_number(value):
+                self.plain[i] = True
+                self.numbers[i] = value
+            else:
+                try:
+                    code = lookup.get(value)
+                    hashable = True
+                except TypeError:
+                    code, hashable = None, False
+                if code is None:
+                    code = len(self.uniques)
+                    self.uniques.append(value)
+                    if hashable:
+                        lookup[value] = code
+                self.codes[i] = code
+
+
+class Columns:
+    """Lazily built ``Column`` per field of a batch of contexts."""
+    def __init__(self, contexts: List[dict]):
+        self.contexts = contexts
+        self.size = len(contexts)
+        self._fields: Optional[Dict[str, List[Any]]] = None
+        self._columns: Dict[str, Column] = {}
+
+    @classmethod
+    def from_fields(cls, fields: Dict[str, List[Any]], size: int) -> "Columns":
+        """A batch given as one list of values per field (e.g. DataFrame columns) instead of dicts."""
+        columns = cls([])
+        columns.size = size
+        columns._fields = fields
+        return columns
+
+    def _values(self, field: str) -> List[Any]:
+        if self._fields is not None:
+            return self._fields.get(field, [_MISSING] * self.size)
+        return [context.get(field, _MISSING) for context in self.contexts]
+
+    def __getitem__(self, field: str) -> Column:
+        column = self._columns.get(field)
+        if column is None:
+            column = Column(self._values(field))
+            self._columns[field] = column
+        return column
+
+
+def _plain_masks(op: str, target: Any, numbers: np.ndarray):
+    """Vectorized result for plain-number values, or None when it can't be computed exactly."""
+    if op in _COMPARISONS:
+        if not _is_plain_number(target):
+            return None
+        return _COMPARISONS[op](numbers, target)
+    if op in ("eq", "neq"):
+        if _is_plain_number(target):
+            equal = numbers == target
+        elif isinstance(target, (str, type(None))):
+            # Numbers never equal strings or None
+            equal = np.zeros(len(numbers), dtype=bool)
+        else:
+            return None
+        return equal if op == "eq" else ~equal
+    # "in"
+    if any(isinstance(item, (int, float)) and not _is_plain_number(item) for item in target):
+        return None
+    return np.isin(numbers, [item for item in target if _is_plain_number(item)])
+
+
+def _check_mask(field: str, op: str, target: Any) -> MaskFn:
+    compare = _OPERATORS[op]
+
+    def python_result(value) -> Tuple[bool, bool]:
+        try:
+            return bool(compare(value, target)), False
+        except TypeError:
+            return False, True
+
+    def masks(columns: Columns) -> Masks:
+        column = columns[field]
+        matched = np.zeros(columns.size, dtype=bool)
+        raised = np.zeros(columns.size, dtype=bool)
+        if column.plain.any():
+            plain = _plain_masks(op, target, column.numbers)
+            if plain is not None:
+                matched |= column.plain & plain
+            else:
+                for i in np.flatnonzero(column.plain):
+                    # Exact comparison with the original value
+                    matched[i], raised[i] = python_result(column.values[i])
+        if column.uniques:
+            results = [python_result(value) for value in column.uniques]
+            unique_matched = np.array([m for m, _ in results], dtype=bool)
+            unique_raised = np.array([r for _, r in results], dtype=bool)
+            coded = column.codes >= 0
+            matched[coded] = unique_matched[column.codes[coded]]
+            raised[coded] = unique_raised[column.codes[coded]]
+        return matched, raised
+    return masks
+
+
+def _all_masks(parts: Tuple[MaskFn, ...]) -> MaskFn:
+    def masks(columns: Columns) -> Masks:
+        # Like all(): stops at the first part that is false or raises
+        alive = np.ones(columns.size, dtype=bool)
+        raised = np.zeros(columns.size, dtype=bool)
+        for part in parts:
+            part_matched, part_raised = part(columns)
+            raised |= alive & part_raised
+            alive &= part_matched
+        return alive, raised
+    return masks
+
+
+def _any_masks(parts: Tuple[MaskFn, ...]) -> MaskFn:
+    def masks(columns: Columns) -> Masks:
+        # Like any(): stops at the first part that is true or raises
+        undecided = np.ones(columns.size, dtype=bool)
+        matched = np.zeros(columns.size, dtype=bool)
+        raised = np.zeros(columns.size, dtype=bool)
+        for part in parts:
+            part_matched, part_raised = part(columns)
+            matched |= undecided & part_matched
+            raised |= undecided & part_raised
+            undecided &= ~(part_matched | part_raised)
+        return matched, raised
+    return masks
+
+
+def _always_masks(columns: Columns) -> Masks:
+    return np.ones(columns.size, dtype=bool), np.zeros(columns.size, dtype=bool)
+
+
+def compile_mask(condition: dict) -> MaskFn:
+    """
+    Batch counterpart of ``compile_condition`` for a condition it accepted:
+    a function from ``Columns`` to (matched, raised) boolean masks. Checks
+    run in the same order with the same short-circuiting, so ``raised``
+    marks exactly the contexts where the per-context predicate raises
+    TypeError.
+    """
+    if not condition:
+        return _always_masks
+    if "and" in condition or "or" in condition:
+        combinator, subconditions = next(iter(condition.items()))
+        parts = tuple(compile_mask(sub) for sub in subconditions)
+        if len(parts) == 1:
+            return parts[0]
+        return _all_masks(parts) if combinator == "and" else _any_masks(parts)
+
+    checks = []
+    for field, ops in condition.items():
+        for op, target in ops.items():
+            if op == "in":
+                try:
+                    target = frozenset(target)
+                except TypeError:
+                    target = tuple(target)
+            checks.append(_check_mask(field, op, target))
+    if len(checks) == 1:
+        return checks[0]
+    return _all_masks(tuple(checks))
@@ -0,0 +1,127 @@
+"""
+Rule index: prunes policy rules that can't match a context before full evaluation.
+"""
+from bisect import bisect_left, bisect_right
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# One check a rule requires, used to file it in the index: (field, operator, operand)
+Term = Tuple[str, str, Any]
+
+_MISSING = object()
+
+# Preferred index terms: an equality bucket prunes best, a threshold least
+_TERM_RANK = {"eq": 0, "in": 1, "lt": 2, "lte": 2, "gt": 2, "gte": 2}
+
+
+def _required_checks(condition: dict) -> Iterable[Term]:
+    """Checks every match must satisfy: top-level fields and nested "and"s, but nothing under an "or"."""
+    if "or" in condition:
+        return
+    if "and" in condition:
+        for sub in condition["and"]:
+            yield from _required_checks(sub)
+        return
+    for field, ops in condition.items():
+        for op, target in ops.items():
+            yield field, op, target
+
+
+def index_term(condition: dict) -> Optional[Term]:
+    """
+    The most selective indexable check of a compiled condition, or None if the
+    rule has to be evaluated for every context (e.g. ``{}`` or an ``or``).
+    """
+    best = None
+    for field, op, target in _required_checks(condition):
+        if op not in _TERM_RANK:
+            continue
+        if op == "eq":
+            try:
+                hash(target)
+            except TypeError:
+                continue
+        elif op == "in":
+            try:
+                target = frozenset(target)
+            except TypeError:
+                continue
+        if best is None or _TERM_RANK[op] < _TERM_RANK[best[1]]:
+            best = (field, op, target)
+    return best
+
+
+class _Thresholds:
+    """Rules requiring ``value < t`` (upper bounds) or ``value > t`` (lower bounds), sorted by t."""
+    __slots__ = ("thresholds", "positions")
+
+    def __init__(self, entries: List[Tuple[float, int]]):
+        entries.sort()
+        self.thresholds = [threshold for threshold, _ in entries]
+        self.positions = [position for _, position in entries]
+
+
+class RuleIndex:
+    """
+    Candidate rules for a context, by position in a shared priority-ordered rule list.
+
+    Each rule is filed under one check it requires (see ``index_term``):
+    ``eq``/``in`` operands in per-field hash buckets, ``lt``/``lte`` and
+    ``gt``/``gte`` operands in per-field sorted threshold lists. Looking up a
+    context costs one dict lookup and one bisect per indexed field, plus the
+    candidates returned; rules without an indexable check are always returned.
+    Candidates are a superset of the matching rules and still need full
+    evaluation.
+    """
+    def __init__(self, entries: Iterable[Tuple[int, Optional[Term]]]):
+        self.always: List[int] = []
+        self.equals: Dict[str, Dict[Any, List[int]]] = {}
+        upper: Dict[str, List[Tuple[float, int]]] = {}
+        lower: Dict[str, List[Tuple[float, int]]] = {}
+        for position, term in entries:
+            if term is None:
+                self.always.append(position)
+                continue
+            field, op, target = term
+            if op == "eq":
+                self.equals.setdefault(field, {}).setdefault(target, []).append(position)
+            elif op == "in":
+                buckets = self.equals.setdefault(field, {})
+                for value in target:
+                    buckets.setdefault(value, []).append(position)
+            elif op in ("lt", "lte"):
+                upper.setdefault(field, []).append((target, position))
+            else:
+                lower.setdefault(field, []).append((target, position))
+        self.upper = {field: _Thresholds(items) for field, items in upper.items()}
+        self.lower = {field: _Thresholds(items) for field, items in lower.items()}
+
+    def candidates(self, context: dict) -> List[int]:
+        """Positions of the rules that may match ``context`` (unordered)."""
+        found = list(self.always)
+        for field, buckets in self.equals.items():
+            value = context.get(field, _MISSING)
+            if value is _MISSING:
+                continue
+            try:
+                found.extend(buckets.get(value, ()))
+            except TypeError:  # unhashable value can't equal any operand
+                pass
+        for field, index in self.upper.items():
+            value = context.get(field, _MISSING)
+            if value is _MISSING:
+                continue
+            try:
+                # value < t (or <=) needs t >= value
+                found.extend(index.positions[bisect_left(index.thresholds, value):])
+            except TypeError:  # not comparable with numbers, so no threshold check can hold
+                pass
+        for field, index in self.lower.items():
+            value = context.get(field, _MISSING)
+            if value is _MISSING:
+                continue
+            try:
+                # value > t (or >=) needs t <= value
+                found.extend(index.positions[:bisect_right(index.thresholds, value)])
+            except TypeError:
+                pass
+        return found
@@ -4,7 +4,7 @@ Risk computation engine integrating feature store, model, threat intel, threshol
 import numpy as np
 from typing import Dict, Any
 import logging
-from ..feature_store.feature_store import FeatureStore
+from ..feature_store.feature_store import FeatureStore, FEATURE_COLUMNS
 from ..model_registry.registry import ModelRegistry
 from ..threat_intel.aggregator import ThreatIntelAggregator
 from ..engine.adaptive_thresholds import AdaptiveThresholds
@@ -49,7 +49,7 @@ class RiskEngine:
         model = self.model_registry.load_model("risk_model", stage="Production")
 
         # 4. Predict base risk score (model expects feature array)
-        feature_array = np.array([list(features.values())])
+        feature_array = np.array([[features[c] for c in FEATURE_COLUMNS]])
         base_score = model.predict_proba(feature_array)[0][1] * 100  # probability to 0-100
 
         # 5. Adjust with IP reputation (weighted average, could be configurable)
@@ -61,9 +61,10 @@ class RiskEngine:
             "user_role": role,
             "hour": timestamp.hour,
             "ip_reputation": ip_reputation,
-            "country": telemetry.get("country"),  # could be added via geoip
+            "country": telemetry.get("country"),  # set by the GeoIP enrichment stage
+            "tenant_id": telemetry.get("tenant_id"),
         }
-        thresholds = self.adaptive_thresholds.get_thresholds(context)
+        thresholds = self.adaptive_thresholds.get_thresholds(context)  # in-memory lookup, no I/O
 
         # 7. Determine risk level
         if adjusted_score >= thresholds["low"]:
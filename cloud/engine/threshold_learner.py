@@ -0,0 +1,136 @@
+"""
+Per-tenant threshold learning from streaming trust score quantiles.
+"""
+import redis.asyncio as aioredis
+import asyncio
+import os
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from .adaptive_thresholds import AdaptiveThresholds, WILDCARD, hour_band
+
+logger = logging.getLogger(__name__)
+
+# Trust scores live in [0, 100]; half-point bins keep quantiles within 0.5 of exact.
+BIN_WIDTH = 0.5
+NUM_BINS = int(100 / BIN_WIDTH) + 1
+
+LearnKey = Tuple[str, str, str]  # (tenant_id, user_role, hour_band)
+
+
+class ThresholdLearner:
+    """
+    Keeps a fixed-bin histogram of ``trust_score`` per tenant and context bucket
+    (role, hour band) and derives thresholds that hit target alert rates.
+
+    Workers accumulate counts locally; a background loop adds the deltas to a
+    per-day Redis hash, sums the last ``window_days`` hashes for the buckets it
+    touched and publishes the resulting thresholds. No table is ever rescanned.
+    """
+    def __init__(self, redis_client: aioredis.Redis, thresholds: AdaptiveThresholds):
+        self.redis = redis_client
+        self.thresholds = thresholds
+        self.interval = int(os.getenv("THRESHOLD_LEARNER_INTERVAL", "60"))
+        self.window_days = int(os.getenv("THRESHOLD_LEARNER_WINDOW_DAYS", "7"))
+        self.min_samples = int(os.getenv("THRESHOLD_LEARNER_MIN_SAMPLES", "1000"))
+        self.roles = set(os.getenv("THRESHOLD_LEARNER_ROLES", "standard,admin").split(","))
+        # Fraction of events that should fall below each threshold
+        self.target_rates = {
+            "low": float(os.getenv("THRESHOLD_TARGET_RATE_LOW", "0.20")),
+            "medium": float(os.getenv("THRESHOLD_TARGET_RATE_MEDIUM", "0.05")),
+            "high": float(os.getenv("THRESHOLD_TARGET_RATE_HIGH", "0.01")),
+        }
+        self._pending: Dict[LearnKey, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+        self._published: Dict[LearnKey, Dict[str, int]] = {}
+
+    def observe(self, tenant_id, user_role: str, hour: int, trust_score: float):
+        """Record one scored event. In-memory only; safe to call on the hot path."""
+        if tenant_id is None:
+            # Learned thresholds are tenant-scoped; untenanted traffic keeps the defaults
+            return
+        role = user_role if user_role in self.roles else WILDCARD
+        key = (str(tenant_id), role, hour_band(hour))
+        bin_index = min(max(int(trust_score / BIN_WIDTH), 0), NUM_BINS - 1)
+        self._pending[key][bin_index] += 1
+
+    def _hist_key(self, key: LearnKey, day: str) -> str:
+        return f"thresholds:hist:{':'.join(key)}:{day}"
+
+    async def _flush(self) -> List[LearnKey]:
+        pending, self._pending = self._pending, defaultdict(lambda: defaultdict(int))
+        if not pending:
+            return []
+        day = datetime.utcnow().strftime("%Y%m%d")
+        ttl = (self.window_days + 1) * 86400
+        pipe = self.redis.pipeline()
+        for key, bins in pending.items():
+            hist_key = self._hist_key(key, day)
+            for bin_index, count in bins.items():
+                pipe.hincrby(hist_key, str(bin_index), count)
+            pipe.expire(hist_key, ttl)
+        try:
+            await pipe.execute()
+        except Exception:
+            # Merge the counts back for the next flush
+            for key, bins in pending.items():
+                for bin_index, count in bins.items():
+                    self._pending[key][bin_index] += count
+            raise
+        return list(pending)
+
+    async def _load_histogram(self, key: LearnKey) -> List[int]:
+        today = datetime.utcnow().date()
+        pipe = self.redis.pipeline()
+        for offset in range(self.window_days):
+            day = (today - timedelta(days=offset)).strftime("%Y%m%d")
+            pipe.hgetall(self._hist_key(key, day))
+        counts = [0] * NUM_BINS
+        for hist in await pipe.execute():
+            for bin_index, count in hist.items():
+                counts[int(bin_index)] += int(count)
+        return counts
+
+    def derive_thresholds(self, counts: List[int]) -> Optional[Dict[str, int]]:
+        """Pick thresholds so roughly ``target_rates[level]`` of scores fall below each."""
+        total = sum(counts)
+        if total < self.min_samples:
+            return None
+        result = {}
+        for level, rate in self.target_rates.items():
+            target = rate * total
+            cumulative = 0
+            value = 100.0
+            for bin_index, count in enumerate(counts):
+                cumulative += count
+                if cumulative >= target:
+                    value = (bin_index + 1) * BIN_WIDTH
+                    break
+            result[level] = int(round(min(value, 100.0)))
+        # Keep the bands ordered even for degenerate distributions
+        result["medium"] = min(result["medium"], result["low"])
+        result["high"] = min(result["high"], result["medium"])
+        return result
+
+    async def recompute(self):
+        """Flush local counts and republish thresholds for the buckets that changed."""
+        entries = []
+        for key in await self._flush():
+            learned = self.derive_thresholds(await self._load_histogram(key))
+            if learned is None or learned == self._published.get(key):
+                continue
+            self._published[key] = learned
+            tenant_id, role, band = key
+            entries.append(((tenant_id, role, band, WILDCARD, WILDCARD), learned))
+        if entries:
+            await self.thresholds.publish(entries, source="learned")
+            logger.info(f"Published learned thresholds for {len(entries)} buckets")
+
+    async def run(self):
+        """Background task: periodically recompute learned thresholds."""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.recompute()
+            except Exception as e:
+                logger.error(f"Threshold learner recompute failed: {e}")
@@ -1,89 +1,388 @@
 """
-Feature store with Redis caching and precomputed aggregates.
+Feature store with two-tier (in-process + Redis) caching and precomputed aggregates.
 """
 import pandas as pd
+import numpy as np
 from sqlalchemy import create_engine, text
 from datetime import datetime, timedelta
 import redis.asyncio as aioredis
+import asyncio
 import json
 import logging
-from typing import Dict, Any
+import os
+from typing import Dict, Any, List
+from ..core.lru import LRUCache
+from .rolling import DISTINCT_WINDOW_HOURS, WINDOW_HOURS, RollingFeatureAggregator, naive_utc
+from .hll import HyperLogLog
+from ..observability.metrics import feature_cache_requests
 
 logger = logging.getLogger(__name__)
 
+# Window aggregates, in model input order
+AGGREGATE_COLUMNS = [
+    "event_count",
+    "avg_keystroke_speed",
+    "avg_mouse_speed",
+    "unique_ips",
+    "max_risk_score_24h",
+]
+# Full model input, in order
+FEATURE_COLUMNS = AGGREGATE_COLUMNS + ["hour_of_day", "day_of_week"]
+# Sketch-based distinct counts served alongside the model input
+DISTINCT_COLUMNS = ["unique_ips_7d", "unique_devices_24h", "unique_devices_7d"]
+
+_ROLLUP_QUERY = text("""
+    INSERT INTO telemetry_hourly_agg (user_id, hour, avg_keystroke_speed, avg_mouse_speed, unique_ips, max_risk_score, event_count)
+    SELECT
+        user_id,
+        date_trunc('hour', timestamp) as hour,
+        AVG(keystroke_speed) as avg_keystroke_speed,
+        AVG(mouse_speed) as avg_mouse_speed,
+        COUNT(DISTINCT ip) as unique_ips,
+        MAX(risk_score) as max_risk_score,
+        COUNT(*) as event_count
+    FROM telemetry
+    WHERE timestamp >= :start AND timestamp < :end
+    GROUP BY user_id, date_trunc('hour', timestamp)
+    ON CONFLICT (user_id, hour) DO UPDATE SET
+        avg_keystroke_speed = EXCLUDED.avg_keystroke_speed,
+        avg_mouse_speed = EXCLUDED.avg_mouse_speed,
+        unique_ips = EXCLUDED.unique_ips,
+        max_risk_score = EXCLUDED.max_risk_score,
+        event_count = EXCLUDED.event_count
+""")
+
+_SKETCH_SOURCE_QUERY = text("""
+    SELECT
+        user_id,
+        date_trunc('hour', timestamp) as hour,
+        array_agg(DISTINCT ip) as ips,
+        array_agg(DISTINCT device) as devices
+    FROM telemetry
+    WHERE timestamp >= :start AND timestamp < :end
+    GROUP BY user_id, date_trunc('hour', timestamp)
+""")
+
+_SKETCH_UPDATE = text("""
+    UPDATE telemetry_hourly_agg
+    SET ip_sketch = :ip_sketch, device_sketch = :device_sketch
+    WHERE user_id = :user_id AND hour = :hour
+""")
+
+# Rollup of telemetry rows read outside Postgres (the archived cold tier)
+_UPSERT_HOURLY = text("""
+    INSERT INTO telemetry_hourly_agg (user_id, hour, avg_keystroke_speed, avg_mouse_speed, unique_ips,
+                                      max_risk_score, event_count, ip_sketch, device_sketch)
+    VALUES (:user_id, :hour, :avg_keystroke_speed, :avg_mouse_speed, :unique_ips,
+            :max_risk_score, :event_count, :ip_sketch, :device_sketch)
+    ON CONFLICT (user_id, hour) DO UPDATE SET
+        avg_keystroke_speed = EXCLUDED.avg_keystroke_speed,
+        avg_mouse_speed = EXCLUDED.avg_mouse_speed,
+        unique_ips = EXCLUDED.unique_ips,
+        max_risk_score = EXCLUDED.max_risk_score,
+        event_count = EXCLUDED.event_count,
+        ip_sketch = EXCLUDED.ip_sketch,
+        device_sketch = EXCLUDED.device_sketch
+""")
+
+EMPTY_AGGREGATES = dict.fromkeys(AGGREGATE_COLUMNS + DISTINCT_COLUMNS, 0)
+
+def hour_bucket(timestamp: datetime) -> datetime:
+    """Truncate a timestamp (as naive UTC) to the telemetry_hourly_agg window it falls into."""
+    return naive_utc(timestamp).replace(minute=0, second=0, microsecond=0)
+
 class FeatureStore:
     def __init__(self, db_uri: str, redis_url: str = "redis://redis:6379/0"):
         self.db_engine = create_engine(db_uri, pool_size=10, max_overflow=20)
         self.redis = aioredis.from_url(redis_url, decode_responses=True)
+        self.cache_ttl = int(os.getenv("FEATURE_CACHE_TTL", "3600"))
+        # L1: per-process LRU in front of Redis, short TTL so batch updates show up quickly
+        self.local_cache = LRUCache(
+            maxsize=int(os.getenv("FEATURE_L1_MAXSIZE", "10000")),
+            ttl=float(os.getenv("FEATURE_L1_TTL", "60"))
+        )
+        self.rolling_enabled = os.getenv("FEATURE_ROLLING_ENABLED", "true").lower() == "true"
+        self.rolling = RollingFeatureAggregator(self.redis)
+        # data_lake.archiver.TelemetryArchiver, set when a cold tier is configured;
+        # rollups reaching past the hot window read through it
+        self.archive = None
         logger.info("FeatureStore initialized")
 
+    def _cache_key(self, user_id: str, bucket: datetime) -> str:
+        return f"features:user:{user_id}:{bucket.strftime('%Y%m%d%H')}"
+
     async def get_user_features(self, user_id: str, timestamp: datetime) -> Dict[str, Any]:
         """
         Retrieve or compute features for a user at a given timestamp.
-        Uses Redis cache for 1 hour.
+        Reads the streaming rolling window when it has data for the user; otherwise
+        aggregates are cached per user and hour window (in-process L1, then Redis L2).
+        Per-event fields are derived after the lookup.
         """
-        cache_key = f"features:user:{user_id}:{timestamp.isoformat()}"
+        timestamp = naive_utc(timestamp)
+        bucket = hour_bucket(timestamp)
+        aggregates = None
+        if self.rolling_enabled:
+            aggregates = await self.rolling.read(user_id, bucket)
+        if aggregates is None:
+            aggregates = await self._get_cached_aggregates(user_id, bucket)
+
+        return {
+            **aggregates,
+            "hour_of_day": timestamp.hour,
+            "day_of_week": timestamp.weekday(),
+        }
+
+    async def _get_cached_aggregates(self, user_id: str, bucket: datetime) -> Dict[str, Any]:
+        cache_key = self._cache_key(user_id, bucket)
+        aggregates = self.local_cache.get(cache_key)
+        if aggregates is not None:
+            feature_cache_requests.labels(tier="l1", result="hit").inc()
+            return aggregates
+
+        feature_cache_requests.labels(tier="l1", result="miss").inc()
         cached = await self.redis.get(cache_key)
         if cached:
-            logger.debug(f"Cache hit for {cache_key}")
-            return json.loads(cached)
+            feature_cache_requests.labels(tier="l2", result="hit").inc()
+            aggregates = json.loads(cached)
+        else:
+            feature_cache_requests.labels(tier="l2", result="miss").inc()
+            aggregates = self._compute_aggregates(user_id, bucket)
+            await self.redis.setex(cache_key, self.cache_ttl, json.dumps(aggregates))
+            logger.debug(f"Computed features for user {user_id}")
+        self.local_cache.set(cache_key, aggregates)
+        return aggregates
+
+    async def record_event(self, telemetry: dict, risk_score: float):
+        """Write path: fold a scored event into the rolling window."""
+        if self.rolling_enabled:
+            await self.rolling.record(telemetry, risk_score)
 
-        # Compute features from pre‑aggregated table (telemetry_hourly_agg)
-        start_time = timestamp - timedelta(hours=24)
+    def _compute_aggregates(self, user_id: str, bucket: datetime) -> Dict[str, Any]:
+        """Aggregates over the 24 completed hours before ``bucket``, from the pre‑aggregated table."""
+        return self._compute_aggregates_many([user_id], bucket).get(user_id) or dict(EMPTY_AGGREGATES)
+
+    def _compute_aggregates_many(self, user_ids: List[str], bucket: datetime) -> Dict[str, Dict[str, Any]]:
+        """
+        Window aggregates for many users in one grouped query plus one sketch
+        query. Windows hold completed hours only, [bucket - 24h, bucket), as in
+        the rolling window and the offline training set.
+        """
+        start_time = bucket - timedelta(hours=WINDOW_HOURS)
         query = text("""
             SELECT
+                user_id,
                 AVG(avg_keystroke_speed) as avg_keystroke_speed,
                 AVG(avg_mouse_speed) as avg_mouse_speed,
-                SUM(unique_ips) as unique_ips,
                 MAX(max_risk_score) as max_risk_score_24h,
                 SUM(event_count) as event_count
             FROM telemetry_hourly_agg
-            WHERE user_id = :user_id
+            WHERE user_id = ANY(:user_ids)
               AND hour >= :start_time
+              AND hour < :end_time
+            GROUP BY user_id
         """)
         with self.db_engine.connect() as conn:
-            result = conn.execute(query, {"user_id": user_id, "start_time": start_time}).fetchone()
-
-        features = {
-            "event_count": result.event_count or 0,
-            "avg_keystroke_speed": float(result.avg_keystroke_speed or 0.0),
-            "avg_mouse_speed": float(result.avg_mouse_speed or 0.0),
-            "unique_ips": result.unique_ips or 0,
-            "max_risk_score_24h": float(result.max_risk_score_24h or 0.0),
-            "hour_of_day": timestamp.hour,
-            "day_of_week": timestamp.weekday(),
+            rows = conn.execute(
+                query, {"user_ids": user_ids, "start_time": start_time, "end_time": bucket}
+            ).fetchall()
+            distinct = self._distinct_counts(conn, user_ids, bucket)
+
+        result = {}
+        for row in rows:
+            result[row.user_id] = {
+                "event_count": row.event_count or 0,
+                "avg_keystroke_speed": float(row.avg_keystroke_speed or 0.0),
+                "avg_mouse_speed": float(row.avg_mouse_speed or 0.0),
+                "unique_ips": 0,
+                "max_risk_score_24h": float(row.max_risk_score_24h or 0.0),
+                "unique_ips_7d": 0,
+                "unique_devices_24h": 0,
+                "unique_devices_7d": 0,
+            }
+        for user_id, counts in distinct.items():
+            result.setdefault(user_id, dict(EMPTY_AGGREGATES)).update(counts)
+        return result
+
+    def _distinct_counts(self, conn, user_ids: List[str], bucket: datetime) -> Dict[str, Dict[str, int]]:
+        """24h and 7d distinct IPs/devices by merging the hourly HyperLogLog sketches."""
+        start_24h = bucket - timedelta(hours=WINDOW_HOURS)
+        query = text("""
+            SELECT user_id, hour, ip_sketch, device_sketch
+            FROM telemetry_hourly_agg
+            WHERE user_id = ANY(:user_ids)
+              AND hour >= :start_time
+              AND hour < :end_time
+              AND (ip_sketch IS NOT NULL OR device_sketch IS NOT NULL)
+        """)
+        rows = conn.execute(
+            query, {"user_ids": user_ids, "start_time": bucket - timedelta(hours=DISTINCT_WINDOW_HOURS), "end_time": bucket}
+        )
+        sketches: Dict[str, Dict[str, HyperLogLog]] = {}
+        for row in rows:
+            user = sketches.setdefault(row.user_id, {
+                "ips_24h": HyperLogLog(), "ips_7d": HyperLogLog(),
+                "devices_24h": HyperLogLog(), "devices_7d": HyperLogLog(),
+            })
+            user["ips_7d"].merge_bytes(row.ip_sketch)
+            user["devices_7d"].merge_bytes(row.device_sketch)
+            if row.hour >= start_24h:
+                user["ips_24h"].merge_bytes(row.ip_sketch)
+                user["devices_24h"].merge_bytes(row.device_sketch)
+        return {
+            user_id: {
+                "unique_ips": user["ips_24h"].count(),
+                "unique_ips_7d": user["ips_7d"].count(),
+                "unique_devices_24h": user["devices_24h"].count(),
+                "unique_devices_7d": user["devices_7d"].count(),
+            }
+            for user_id, user in sketches.items()
         }
 
-        # Cache for 1 hour
-        await self.redis.setex(cache_key, 3600, json.dumps(features))
-        logger.debug(f"Computed features for user {user_id}")
-        return features
+    async def get_user_features_many(self, user_ids: List[str], as_of: datetime) -> np.ndarray:
+        """
+        Features for many users at one point in time, for batch scoring.
+        Returns a float64 array of shape (len(user_ids), len(FEATURE_COLUMNS)),
+        rows aligned with ``user_ids``. Like ``get_user_features``, the rolling
+        window is read first (one pipeline); the remaining users go L1, one
+        Redis MGET, then a single grouped SQL query for the misses, written back
+        in one pipeline.
+        """
+        bucket = hour_bucket(as_of)
+        unique_ids = list(dict.fromkeys(user_ids))
+        aggregates: Dict[str, Dict[str, Any]] = {}
+        if self.rolling_enabled:
+            for user_id, rolling in (await self.rolling.read_many(unique_ids, bucket)).items():
+                if rolling is not None:
+                    aggregates[user_id] = rolling
+        from_rolling = len(aggregates)
+
+        pending = []
+        for user_id in unique_ids:
+            if user_id in aggregates:
+                continue
+            cached = self.local_cache.get(self._cache_key(user_id, bucket))
+            if cached is not None:
+                aggregates[user_id] = cached
+            else:
+                pending.append(user_id)
+        feature_cache_requests.labels(tier="l1", result="hit").inc(len(aggregates) - from_rolling)
+        feature_cache_requests.labels(tier="l1", result="miss").inc(len(pending))
+
+        if pending:
+            keys = [self._cache_key(user_id, bucket) for user_id in pending]
+            values = await self.redis.mget(keys)
+            misses = []
+            for user_id, key, value in zip(pending, keys, values):
+                if value:
+                    aggregates[user_id] = json.loads(value)
+                    self.local_cache.set(key, aggregates[user_id])
+                else:
+                    misses.append(user_id)
+            feature_cache_requests.labels(tier="l2", result="hit").inc(len(pending) - len(misses))
+            feature_cache_requests.labels(tier="l2", result="miss").inc(len(misses))
+
+            if misses:
+                computed = self._compute_aggregates_many(misses, bucket)
+                pipe = self.redis.pipeline()
+                for user_id in misses:
+                    # Users without hourly rows in the window get all-zero aggregates
+                    result = computed.get(user_id) or dict(EMPTY_AGGREGATES)
+                    key = self._cache_key(user_id, bucket)
+                    aggregates[user_id] = result
+                    self.local_cache.set(key, result)
+                    pipe.setex(key, self.cache_ttl, json.dumps(result))
+                await pipe.execute()
+                logger.debug(f"Computed features for {len(misses)} users in bulk")
+
+        matrix = np.empty((len(user_ids), len(FEATURE_COLUMNS)), dtype=np.float64)
+        for i, user_id in enumerate(user_ids):
+            row = aggregates[user_id]
+            matrix[i, :len(AGGREGATE_COLUMNS)] = [row[c] for c in AGGREGATE_COLUMNS]
+        matrix[:, len(AGGREGATE_COLUMNS)] = as_of.hour
+        matrix[:, len(AGGREGATE_COLUMNS) + 1] = as_of.weekday()
+        return matrix
 
     async def precompute_aggregates(self, start: datetime, end: datetime):
         """
-        Batch job to populate telemetry_hourly_agg from raw telemetry.
-        This would be called by a scheduler (e.g., cron, Airflow).
+        Batch job to populate telemetry_hourly_agg from raw telemetry in [start, end).
+        Incremental scheduling lives in rollup.HourlyRollupScheduler. Online features
+        come from the rolling window; this run reconciles it with the raw table.
         """
+        await asyncio.to_thread(self.rollup_range, start, end)
+        logger.info(f"Precomputed aggregates from {start} to {end}")
+
+        # The rolling window is authoritative online; the batch rollup only corrects it
+        if self.rolling_enabled:
+            await self.reconcile_rolling(start, end)
+
+    def rollup_range(self, start: datetime, end: datetime):
+        """Aggregate raw telemetry in [start, end) into telemetry_hourly_agg (blocking)."""
+        if self.archive is not None and start < self.archive.cutoff():
+            # Part of the range may already be purged from Postgres
+            self._rollup_frame(self.archive.read_range(start, end))
+            return
+        with self.db_engine.begin() as conn:
+            conn.execute(_ROLLUP_QUERY, {"start": start, "end": end})
+            # Per-hour HyperLogLogs so window distinct counts are sketch merges, not raw scans
+            updates = []
+            for row in conn.execute(_SKETCH_SOURCE_QUERY, {"start": start, "end": end}):
+                ips, devices = HyperLogLog(), HyperLogLog()
+                ips.update(row.ips)
+                devices.update(row.devices)
+                updates.append({
+                    "user_id": row.user_id,
+                    "hour": row.hour,
+                    "ip_sketch": ips.to_bytes(),
+                    "device_sketch": devices.to_bytes(),
+                })
+            if updates:
+                conn.execute(_SKETCH_UPDATE, updates)
+
+    def _rollup_frame(self, telemetry: pd.DataFrame):
+        """Same aggregates as _ROLLUP_QUERY and the sketch update, from raw rows in memory."""
+        if telemetry.empty:
+            return
+        grouped = telemetry.assign(hour=telemetry["timestamp"].dt.floor("h")).groupby(["user_id", "hour"], sort=False)
+        aggregates = grouped.agg(
+            avg_keystroke_speed=("keystroke_speed", "mean"),
+            avg_mouse_speed=("mouse_speed", "mean"),
+            unique_ips=("ip", "nunique"),
+            max_risk_score=("risk_score", "max"),
+            event_count=("id", "size"),
+        )
+        ips = grouped["ip"].unique()
+        devices = grouped["device"].unique()
+        rows = []
+        for (user_id, hour), row in aggregates.iterrows():
+            ip_sketch, device_sketch = HyperLogLog(), HyperLogLog()
+            ip_sketch.update(v for v in ips[(user_id, hour)] if isinstance(v, str))
+            device_sketch.update(v for v in devices[(user_id, hour)] if isinstance(v, str))
+            rows.append({
+                "user_id": user_id,
+                "hour": hour.to_pydatetime(),
+                # SQL aggregates over all-NULL groups are NULL
+                "avg_keystroke_speed": None if pd.isna(row.avg_keystroke_speed) else float(row.avg_keystroke_speed),
+                "avg_mouse_speed": None if pd.isna(row.avg_mouse_speed) else float(row.avg_mouse_speed),
+                "unique_ips": int(row.unique_ips),
+                "max_risk_score": None if pd.isna(row.max_risk_score) else float(row.max_risk_score),
+                "event_count": int(row.event_count),
+                "ip_sketch": ip_sketch.to_bytes(),
+                "device_sketch": device_sketch.to_bytes(),
+            })
+        with self.db_engine.begin() as conn:
+            conn.execute(_UPSERT_HOURLY, rows)
+
+    async def reconcile_rolling(self, start: datetime, end: datetime):
+        """Overwrite rolling slots for recent hours in [start, end) with the rolled-up rows."""
+        start = max(hour_bucket(start), hour_bucket(datetime.utcnow()) - timedelta(hours=WINDOW_HOURS))
+        if start >= end:
+            return
         query = text("""
-            INSERT INTO telemetry_hourly_agg (user_id, hour, avg_keystroke_speed, avg_mouse_speed, unique_ips, max_risk_score, event_count)
-            SELECT
-                user_id,
-                date_trunc('hour', timestamp) as hour,
-                AVG(keystroke_speed) as avg_keystroke_speed,
-                AVG(mouse_speed) as avg_mouse_speed,
-                COUNT(DISTINCT ip) as unique_ips,
-                MAX(risk_score) as max_risk_score,
-                COUNT(*) as event_count
-            FROM telemetry
-            WHERE timestamp BETWEEN :start AND :end
-            GROUP BY user_id, date_trunc('hour', timestamp)
-            ON CONFLICT (user_id, hour) DO UPDATE SET
-                avg_keystroke_speed = EXCLUDED.avg_keystroke_speed,
-                avg_mouse_speed = EXCLUDED.avg_mouse_speed,
-                unique_ips = EXCLUDED.unique_ips,
-                max_risk_score = EXCLUDED.max_risk_score,
-                event_count = EXCLUDED.event_count
+            SELECT user_id, hour, avg_keystroke_speed, avg_mouse_speed,
+                   max_risk_score, event_count
+            FROM telemetry_hourly_agg
+            WHERE hour >= :start AND hour < :end
         """)
-        with self.db_engine.begin() as conn:
-            conn.execute(query, {"start": start, "end": end})
-        logger.info(f"Precomputed aggregates from {start} to {end}")
+        with self.db_engine.connect() as conn:
+            rows = conn.execute(query, {"start": start, "end": end}).fetchall()
+        await self.rolling.reconcile(rows)
@@ -0,0 +1,246 @@
+"""
+Rolling 24h per-user aggregates maintained incrementally on the write path.
+"""
+import redis.asyncio as aioredis
+import logging
+from datetime import datetime, timezone
+from typing import Dict, Any, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+WINDOW_HOURS = 24
+DISTINCT_WINDOW_HOURS = 7 * 24
+# Windows cover the completed hours before the current one, as in training
+# (training_set.py); the ring also holds the current hour while it fills
+RING_SLOTS = WINDOW_HOURS + 1
+
+# One hash per user holding a ring of hourly slots. Each slot stores the hour it
+# currently represents; writing to a slot that still holds an older hour resets it.
+# Distinct IPs and devices go into per-hour HyperLogLogs kept for 7 days.
+# The user id is a hash tag so the ring and its sketches live on the same cluster node.
+_RECORD_SCRIPT = """
+local slot = ARGV[1]
+local hour = tonumber(ARGV[2])
+local stamp = redis.call('HGET', KEYS[1], slot .. ':h')
+if stamp and tonumber(stamp) > hour then
+    return 0
+end
+if not stamp or tonumber(stamp) < hour then
+    redis.call('HSET', KEYS[1], slot .. ':h', hour, slot .. ':n', 0, slot .. ':ks', 0,
+               slot .. ':ms', 0, slot .. ':risk', 0)
+end
+redis.call('HINCRBY', KEYS[1], slot .. ':n', 1)
+redis.call('HINCRBYFLOAT', KEYS[1], slot .. ':ks', ARGV[3])
+redis.call('HINCRBYFLOAT', KEYS[1], slot .. ':ms', ARGV[4])
+if tonumber(ARGV[5]) > tonumber(redis.call('HGET', KEYS[1], slot .. ':risk')) then
+    redis.call('HSET', KEYS[1], slot .. ':risk', ARGV[5])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[8])
+if ARGV[6] ~= '' then
+    redis.call('PFADD', KEYS[2], ARGV[6])
+    redis.call('EXPIRE', KEYS[2], ARGV[9])
+end
+if ARGV[7] ~= '' then
+    redis.call('PFADD', KEYS[3], ARGV[7])
+    redis.call('EXPIRE', KEYS[3], ARGV[9])
+end
+return 1
+"""
+
+
+# Distinct counts over the 24h and 7d windows of completed hours. Each window
+# is PFMERGEd once into a cached key (the key name carries the current hour,
+# so it is rebuilt on rollover); reads then PFCOUNT that one key instead of
+# up to 168 hourly keys. Events arriving late for an earlier hour are counted
+# from the next rollover.
+# The hourly key names are built here from ARGV[1]; they share the user's hash
+# tag with KEYS, so the script stays on one cluster slot.
+_DISTINCT_SCRIPT = """
+local prefix, hour, ttl = ARGV[1], tonumber(ARGV[2]), ARGV[3]
+local counts = {}
+for i, spec in ipairs({{'ips', ARGV[4]}, {'ips', ARGV[5]}, {'devices', ARGV[4]}, {'devices', ARGV[5]}}) do
+    local cached = KEYS[i]
+    if redis.call('EXISTS', cached) == 0 then
+        local sources = {}
+        for h = hour - tonumber(spec[2]), hour - 1 do
+            sources[#sources + 1] = prefix .. spec[1] .. ':' .. h
+        end
+        redis.call('PFMERGE', cached, unpack(sources))
+        redis.call('EXPIRE', cached, ttl)
+    end
+    counts[i] = redis.call('PFCOUNT', cached)
+end
+return counts
+"""
+
+
+def naive_utc(timestamp: datetime) -> datetime:
+    """
+    Timestamps are naive UTC throughout; aware ones (e.g. parsed from an ISO
+    string ending in Z or +02:00) are converted, naive ones taken as UTC.
+    """
+    if timestamp.tzinfo is None:
+        return timestamp
+    return timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _hour_index(timestamp: datetime) -> int:
+    """Hours since the epoch."""
+    return int((naive_utc(timestamp) - datetime(1970, 1, 1)).total_seconds() // 3600)
+
+
+class RollingFeatureAggregator:
+    """
+    Maintains per-user hourly slots (event count, keystroke/mouse speed sums,
+    max risk score) for the current hour and the 24 before it in Redis, plus
+    hourly HyperLogLogs of IPs and devices for 7 days. Reads cover completed
+    hours only: they fold the 24 slots before the current hour in memory,
+    count distinct values from window sketches merged once per hour (see
+    ``_DISTINCT_SCRIPT``), and never touch SQL.
+
+    Redis HyperLogLogs use 2^14 registers (~0.8% standard error), the offline
+    sketches in ``hll.py`` 2^10 (~3%), so distinct counts served from here
+    are tighter than those computed from telemetry_hourly_agg.
+    """
+    def __init__(self, redis_client: aioredis.Redis):
+        self.redis = redis_client
+        self.ttl = (RING_SLOTS + 1) * 3600
+        self.sketch_ttl = (DISTINCT_WINDOW_HOURS + 2) * 3600
+        self._record = self.redis.register_script(_RECORD_SCRIPT)
+        self._distinct = self.redis.register_script(_DISTINCT_SCRIPT)
+
+    def _ring_key(self, user_id: str) -> str:
+        return f"features:rolling:{{{user_id}}}:slots"
+
+    def _sketch_key(self, user_id: str, kind: str, hour: int) -> str:
+        return f"features:rolling:{{{user_id}}}:{kind}:{hour}"
+
+    def _window_key(self, user_id: str, kind: str, hours: int, end: int) -> str:
+        return f"features:rolling:{{{user_id}}}:{kind}:{hours}h:{end}"
+
+    async def record(self, telemetry: dict, risk_score: float):
+        """Fold one scored event into its user's ring."""
+        user_id = telemetry["user_id"]
+        hour = _hour_index(telemetry["timestamp"])
+        await self._record(
+            keys=[
+                self._ring_key(user_id),
+                self._sketch_key(user_id, "ips", hour),
+                self._sketch_key(user_id, "devices", hour),
+            ],
+            args=[
+                hour % RING_SLOTS,
+                hour,
+                float(telemetry.get("keystroke_speed") or 0.0),
+                float(telemetry.get("mouse_speed") or 0.0),
+                float(risk_score),
+                telemetry.get("ip") or "",
+                telemetry.get("device") or "",
+                self.ttl,
+                self.sketch_ttl,
+            ],
+        )
+
+    def _queue_read(self, pipe, user_id: str, end: int):
+        pipe.hgetall(self._ring_key(user_id))
+        self._distinct(
+            keys=[
+                self._window_key(user_id, "ips", WINDOW_HOURS, end),
+                self._window_key(user_id, "ips", DISTINCT_WINDOW_HOURS, end),
+                self._window_key(user_id, "devices", WINDOW_HOURS, end),
+                self._window_key(user_id, "devices", DISTINCT_WINDOW_HOURS, end),
+            ],
+            args=[f"features:rolling:{{{user_id}}}:", end, 3600, WINDOW_HOURS, DISTINCT_WINDOW_HOURS],
+            client=pipe,
+        )
+
+    @staticmethod
+    def _fold(end: int, ring, distinct) -> Optional[Dict[str, Any]]:
+        ips_24h, ips_7d, devices_24h, devices_7d = distinct
+        if not ring:
+            return None
+        start = end - WINDOW_HOURS
+        hours = 0
+        event_count = 0
+        keystroke_avg_sum = 0.0
+        mouse_avg_sum = 0.0
+        max_risk = None
+        for slot in range(RING_SLOTS):
+            stamp = ring.get(f"{slot}:h")
+            if stamp is None or not start <= int(stamp) < end:
+                continue
+            n = int(ring.get(f"{slot}:n", 0))
+            if n == 0:
+                continue
+            hours += 1
+            event_count += n
+            # Average of hourly averages, matching AVG(avg_*) over the hourly table
+            keystroke_avg_sum += float(ring.get(f"{slot}:ks", 0)) / n
+            mouse_avg_sum += float(ring.get(f"{slot}:ms", 0)) / n
+            risk = float(ring.get(f"{slot}:risk", 0))
+            max_risk = risk if max_risk is None else max(max_risk, risk)
+        if hours == 0:
+            return None
+        return {
+            "event_count": event_count,
+            "avg_keystroke_speed": keystroke_avg_sum / hours,
+            "avg_mouse_speed": mouse_avg_sum / hours,
+            "unique_ips": ips_24h,
+            "max_risk_score_24h": max_risk or 0.0,
+            "unique_ips_7d": ips_7d,
+            "unique_devices_24h": devices_24h,
+            "unique_devices_7d": devices_7d,
+        }
+
+    async def read(self, user_id: str, bucket: datetime) -> Optional[Dict[str, Any]]:
+        """
+        Aggregates over the 24 completed hours before ``bucket``, with the same
+        semantics as the telemetry_hourly_agg query and the training set. None
+        if the ring has nothing in that window.
+        """
+        end = _hour_index(bucket)
+        pipe = self.redis.pipeline(transaction=False)
+        self._queue_read(pipe, user_id, end)
+        return self._fold(end, *await pipe.execute())
+
+    async def read_many(self, user_ids: List[str], bucket: datetime) -> Dict[str, Optional[Dict[str, Any]]]:
+        """``read`` for many users in one pipeline round trip."""
+        end = _hour_index(bucket)
+        pipe = self.redis.pipeline(transaction=False)
+        for user_id in user_ids:
+            self._queue_read(pipe, user_id, end)
+        replies = await pipe.execute()
+        return {
+            user_id: self._fold(end, *replies[i * 2:(i + 1) * 2])
+            for i, user_id in enumerate(user_ids)
+        }
+
+    async def reconcile(self, rows: Iterable, now: Optional[datetime] = None):
+        """
+        Overwrite ring slots with authoritative telemetry_hourly_agg rows.
+        Rows outside the ring (the current hour and the 24 before it) are
+        ignored; sketches are left as they are.
+        """
+        oldest = _hour_index(now or datetime.utcnow()) - WINDOW_HOURS
+        pipe = self.redis.pipeline()
+        count = 0
+        for row in rows:
+            hour = _hour_index(row.hour)
+            if hour < oldest:
+                continue
+            slot = hour % RING_SLOTS
+            n = row.event_count or 0
+            key = self._ring_key(row.user_id)
+            pipe.hset(key, mapping={
+                f"{slot}:h": hour,
+                f"{slot}:n": n,
+                # Store sums so incremental writes keep averaging correctly
+                f"{slot}:ks": (row.avg_keystroke_speed or 0.0) * n,
+                f"{slot}:ms": (row.avg_mouse_speed or 0.0) * n,
+                f"{slot}:risk": row.max_risk_score or 0.0,
+            })
+            pipe.expire(key, self.ttl)
+            count += 1
+        if count:
+            await pipe.execute()
+        logger.info(f"Reconciled {count} rolling feature slots")
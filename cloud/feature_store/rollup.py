@@ -0,0 +1,137 @@
+"""
+Incremental, watermark-driven hourly rollup of raw telemetry into telemetry_hourly_agg.
+"""
+import asyncio
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import List, Optional
+from sqlalchemy import text
+from .feature_store import FeatureStore, hour_bucket
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_NAME = "hourly_rollup"
+
+# Every telemetry id above the checkpoint marks its hour dirty; the checkpoint
+# advances in the same transaction so a crash never loses or double-marks rows.
+_MARK_NEW_ROWS = text("""
+    INSERT INTO rollup_watermarks (hour, max_telemetry_id, dirty)
+    SELECT date_trunc('hour', timestamp), MAX(id), TRUE
+    FROM telemetry
+    WHERE id > :cursor AND id <= :high
+    GROUP BY date_trunc('hour', timestamp)
+    ON CONFLICT (hour) DO UPDATE SET
+        dirty = TRUE,
+        max_telemetry_id = GREATEST(rollup_watermarks.max_telemetry_id, EXCLUDED.max_telemetry_id)
+""")
+
+_MARK_RANGE = text("""
+    INSERT INTO rollup_watermarks (hour, max_telemetry_id, dirty)
+    SELECT h, 0, TRUE
+    FROM generate_series(:start, :end, interval '1 hour') AS h
+    ON CONFLICT (hour) DO UPDATE SET dirty = TRUE
+""")
+
+
+class HourlyRollupScheduler:
+    """
+    Tracks which hours need (re)aggregation and rolls them up in parallel.
+
+    A telemetry id checkpoint in ``job_checkpoints`` finds new or late-arriving
+    rows with a primary-key range scan; the hours they touch are marked dirty in
+    ``rollup_watermarks``. Each dirty hour is an independent partition rolled up
+    under a bounded number of concurrent DB connections, and is only marked
+    clean once its aggregate is committed, so a restart resumes where it stopped.
+    """
+    def __init__(self, feature_store: FeatureStore, max_concurrency: Optional[int] = None,
+                 interval: Optional[int] = None):
+        self.feature_store = feature_store
+        self.db_engine = feature_store.db_engine
+        self.max_concurrency = max_concurrency or int(os.getenv("ROLLUP_MAX_CONCURRENCY", "8"))
+        self.interval = interval or int(os.getenv("ROLLUP_INTERVAL", "300"))
+        # Hours re-marked every run to absorb rows committed out of id order
+        self.recent_hours = int(os.getenv("ROLLUP_RECENT_HOURS", "2"))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency,
+                                            thread_name_prefix="rollup")
+
+    def _mark_new_rows(self) -> int:
+        with self.db_engine.begin() as conn:
+            cursor = conn.execute(
+                text("SELECT value FROM job_checkpoints WHERE name = :name FOR UPDATE"),
+                {"name": CHECKPOINT_NAME}
+            ).scalar() or 0
+            high = conn.execute(text("SELECT MAX(id) FROM telemetry")).scalar() or 0
+            if high > cursor:
+                conn.execute(_MARK_NEW_ROWS, {"cursor": cursor, "high": high})
+                conn.execute(text("""
+                    INSERT INTO job_checkpoints (name, value, updated_at)
+                    VALUES (:name, :value, now())
+                    ON CONFLICT (name) DO UPDATE SET value = EXCLUDED.value, updated_at = now()
+                """), {"name": CHECKPOINT_NAME, "value": high})
+            now = hour_bucket(datetime.utcnow())
+            conn.execute(_MARK_RANGE, {"start": now - timedelta(hours=self.recent_hours - 1), "end": now})
+        return max(high - cursor, 0)
+
+    def mark_range(self, start: datetime, end: datetime):
+        """Mark every hour in [start, end) dirty, e.g. for a backfill."""
+        last = hour_bucket(end - timedelta(microseconds=1))
+        with self.db_engine.begin() as conn:
+            conn.execute(_MARK_RANGE, {"start": hour_bucket(start), "end": last})
+
+    def _dirty_hours(self) -> List:
+        with self.db_engine.connect() as conn:
+            return conn.execute(text(
+                "SELECT hour, max_telemetry_id FROM rollup_watermarks WHERE dirty ORDER BY hour"
+            )).fetchall()
+
+    def _rollup_hour(self, hour: datetime, seen_id: int):
+        self.feature_store.rollup_range(hour, hour + timedelta(hours=1))
+        with self.db_engine.begin() as conn:
+            # If more rows arrived for this hour meanwhile, max_telemetry_id moved on
+            # and the hour stays dirty for the next run.
+            conn.execute(text("""
+                UPDATE rollup_watermarks SET dirty = FALSE, rolled_up_at = now()
+                WHERE hour = :hour AND max_telemetry_id = :seen_id
+            """), {"hour": hour, "seen_id": seen_id})
+
+    async def run_once(self) -> int:
+        """Mark new work, roll up all dirty hours in parallel. Returns hours processed."""
+        loop = asyncio.get_running_loop()
+        new_rows = await loop.run_in_executor(self._executor, self._mark_new_rows)
+        dirty = await loop.run_in_executor(self._executor, self._dirty_hours)
+        if not dirty:
+            return 0
+        logger.info(f"Rolling up {len(dirty)} hours ({new_rows} new telemetry rows)")
+
+        results = await asyncio.gather(
+            *(loop.run_in_executor(self._executor, self._rollup_hour, row.hour, row.max_telemetry_id)
+              for row in dirty),
+            return_exceptions=True
+        )
+        failed = 0
+        for row, result in zip(dirty, results):
+            if isinstance(result, Exception):
+                # Left dirty; retried on the next run
+                failed += 1
+                logger.error(f"Rollup failed for hour {row.hour}: {result}")
+
+        if self.feature_store.rolling_enabled:
+            await self.feature_store.reconcile_rolling(dirty[0].hour, dirty[-1].hour + timedelta(hours=1))
+        logger.info(f"Rolled up {len(dirty) - failed} hours, {failed} failed")
+        return len(dirty) - failed
+
+    async def backfill(self, start: datetime, end: datetime) -> int:
+        """Re-aggregate every hour in [start, end)."""
+        await asyncio.get_running_loop().run_in_executor(self._executor, self.mark_range, start, end)
+        return await self.run_once()
+
+    async def run_forever(self):
+        """Background task: roll up new and late-arriving hours every ``interval`` seconds."""
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Hourly rollup run failed: {e}")
+            await asyncio.sleep(self.interval)
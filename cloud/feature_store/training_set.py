@@ -0,0 +1,232 @@
+"""
+Point-in-time correct offline training set builder over telemetry_hourly_agg.
+"""
+import os
+import logging
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+from typing import Dict, Any, List, Optional
+from sqlalchemy import create_engine, text
+from .feature_store import DISTINCT_COLUMNS, FEATURE_COLUMNS
+from .hll import HyperLogLog, NUM_REGISTERS, estimate
+# The online windows, so training and serving see the same hours
+from .rolling import DISTINCT_WINDOW_HOURS, WINDOW_HOURS
+
+logger = logging.getLogger(__name__)
+
+# Composite (user code, hour) sort key; hours since the epoch fit well below 2^32
+_KEY_SPAN = np.int64(1) << 32
+
+_AGG_QUERY = text("""
+    SELECT user_id, hour, avg_keystroke_speed, avg_mouse_speed, max_risk_score,
+           event_count, ip_sketch, device_sketch
+    FROM telemetry_hourly_agg
+    WHERE user_id = ANY(:user_ids)
+      AND hour >= :start_time
+      AND hour < :end_time
+""")
+
+
+def _hours(values) -> np.ndarray:
+    return np.asarray(values, dtype="datetime64[ns]").astype("datetime64[h]").astype(np.int64)
+
+
+def _window_sum(values: np.ndarray, start: np.ndarray, end: np.ndarray) -> np.ndarray:
+    cumulative = np.concatenate([[0.0], np.cumsum(values, dtype=np.float64)])
+    return cumulative[end] - cumulative[start]
+
+
+def point_in_time_features(events: pd.DataFrame, agg: pd.DataFrame,
+                           include_distinct: bool = True) -> pd.DataFrame:
+    """
+    Features for each event from telemetry_hourly_agg, over the completed hours
+    of the 24h (or 7d) window before the event's hour. The event's own hour is
+    left out: its row holds later events and the event's own risk score.
+    ``events`` needs ``user_id`` and ``timestamp``; ``agg`` holds hourly rows
+    for those users. Returns one row per event, in input order.
+    """
+    events = events.reset_index(drop=True)
+    users = pd.Index(pd.unique(pd.concat([events["user_id"], agg["user_id"]], ignore_index=True)))
+
+    agg_code = users.get_indexer(agg["user_id"]).astype(np.int64)
+    agg_hour = _hours(agg["hour"])
+    order = np.lexsort((agg_hour, agg_code))
+    keys = agg_code[order] * _KEY_SPAN + agg_hour[order]
+
+    # Events in the same user-hour share their window aggregates
+    event_keys = users.get_indexer(events["user_id"]).astype(np.int64) * _KEY_SPAN + _hours(events["timestamp"])
+    probes, inverse = np.unique(event_keys, return_inverse=True)
+    # Rows for hours [event hour - WINDOW_HOURS, event hour)
+    end = np.searchsorted(keys, probes, side="left")
+    start = np.searchsorted(keys, probes - WINDOW_HOURS, side="left")
+
+    def column(name: str) -> np.ndarray:
+        return agg[name].to_numpy(dtype=np.float64, na_value=np.nan)[order]
+
+    result = {"event_count": _window_sum(np.nan_to_num(column("event_count")), start, end)}
+    for name in ("avg_keystroke_speed", "avg_mouse_speed"):
+        values = column(name)
+        # AVG() skips NULL rows
+        total = _window_sum(np.nan_to_num(values), start, end)
+        count = _window_sum(~np.isnan(values), start, end)
+        result[name] = np.divide(total, count, out=np.zeros_like(total), where=count > 0)
+
+    risk = column("max_risk_score")
+    max_risk = np.full(len(probes), np.nan)
+    for offset in range(WINDOW_HOURS):
+        index = start + offset
+        valid = index < end
+        max_risk[valid] = np.fmax(max_risk[valid], risk[index[valid]])
+    result["max_risk_score_24h"] = np.nan_to_num(max_risk)
+
+    if include_distinct:
+        distinct_start = np.searchsorted(keys, probes - DISTINCT_WINDOW_HOURS, side="left")
+        result.update(_distinct_features(
+            agg["ip_sketch"].to_numpy()[order], agg["device_sketch"].to_numpy()[order],
+            probes // _KEY_SPAN, start, distinct_start, end
+        ))
+    else:
+        result["unique_ips"] = np.zeros(len(probes))
+
+    features = pd.DataFrame({name: values[inverse] for name, values in result.items()})
+    features["event_count"] = features["event_count"].astype(np.int64)
+    features["unique_ips"] = features["unique_ips"].astype(np.int64)
+    features["hour_of_day"] = events["timestamp"].dt.hour.to_numpy()
+    features["day_of_week"] = events["timestamp"].dt.weekday.to_numpy()
+    columns = FEATURE_COLUMNS + (DISTINCT_COLUMNS if include_distinct else [])
+    return features[columns]
+
+
+def _distinct_features(ip_sketches: np.ndarray, device_sketches: np.ndarray, probe_users: np.ndarray,
+                       start: np.ndarray, distinct_start: np.ndarray, end: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Merge hourly sketches over each probe's 24h and 7d windows, one user at a
+    time: the user's rows are decoded once into a small register matrix and
+    each window is a max over a slice of it. Memory is bounded by one user's
+    rows and probes, not the chunk.
+    """
+    n = len(end)
+    result = {name: np.zeros(n) for name in ("unique_ips", "unique_ips_7d", "unique_devices_24h", "unique_devices_7d")}
+    # Probes are sorted by (user, hour), so each user's probes are contiguous
+    bounds = np.flatnonzero(np.diff(probe_users)) + 1
+    for first, last in zip(np.concatenate([[0], bounds]), np.concatenate([bounds, [n]])):
+        lo, hi = distinct_start[first], end[last - 1]
+        if lo >= hi:
+            continue
+        ips = np.stack([HyperLogLog().merge_bytes(sketch).registers for sketch in ip_sketches[lo:hi]])
+        devices = np.stack([HyperLogLog().merge_bytes(sketch).registers for sketch in device_sketches[lo:hi]])
+        merged = {name: np.zeros((last - first, NUM_REGISTERS), dtype=np.uint8)
+                  for name in ("unique_ips", "unique_ips_7d", "unique_devices_24h", "unique_devices_7d")}
+        for row, p in enumerate(range(first, last)):
+            if end[p] > distinct_start[p]:
+                window = slice(distinct_start[p] - lo, end[p] - lo)
+                merged["unique_ips_7d"][row] = ips[window].max(axis=0)
+                merged["unique_devices_7d"][row] = devices[window].max(axis=0)
+            if end[p] > start[p]:
+                window = slice(start[p] - lo, end[p] - lo)
+                merged["unique_ips"][row] = ips[window].max(axis=0)
+                merged["unique_devices_24h"][row] = devices[window].max(axis=0)
+        for name, registers in merged.items():
+            result[name][first:last] = estimate(registers)
+    return result
+
+
+def _load_labels(config: Dict[str, Any], day: date) -> pd.DataFrame:
+    start = datetime.combine(day, datetime.min.time())
+    end = start + timedelta(days=1)
+    if config.get("labels_path"):
+        labels = pd.read_parquet(
+            config["labels_path"],
+            filters=[("timestamp", ">=", start), ("timestamp", "<", end)]
+        )
+    else:
+        engine = create_engine(config["db_uri"])
+        with engine.connect() as conn:
+            labels = pd.read_sql(text(config["labels_query"]), conn, params={"start": start, "end": end})
+        engine.dispose()
+    labels["timestamp"] = pd.to_datetime(labels["timestamp"])
+    return labels.sort_values(["user_id", "timestamp"], kind="stable").reset_index(drop=True)
+
+
+def _build_partition(config: Dict[str, Any], day: date) -> List[str]:
+    """Worker: build one day's features in user-aligned chunks, one Parquet file per chunk."""
+    labels = _load_labels(config, day)
+    if labels.empty:
+        return []
+    engine = create_engine(config["db_uri"])
+    out_dir = os.path.join(config["output_dir"], f"date={day.isoformat()}")
+    os.makedirs(out_dir, exist_ok=True)
+    day_start = datetime.combine(day, datetime.min.time())
+    lookback = DISTINCT_WINDOW_HOURS if config["include_distinct"] else WINDOW_HOURS
+    paths = []
+
+    # Cut chunks at user boundaries so each chunk's aggregate query is self-contained
+    boundaries = np.flatnonzero(labels["user_id"].to_numpy()[1:] != labels["user_id"].to_numpy()[:-1]) + 1
+    cut_points = [0]
+    for boundary in boundaries:
+        if boundary - cut_points[-1] >= config["chunk_size"]:
+            cut_points.append(int(boundary))
+    cut_points.append(len(labels))
+
+    try:
+        for part, (lo, hi) in enumerate(zip(cut_points[:-1], cut_points[1:])):
+            chunk = labels.iloc[lo:hi]
+            with engine.connect() as conn:
+                agg = pd.read_sql(_AGG_QUERY, conn, params={
+                    "user_ids": list(pd.unique(chunk["user_id"])),
+                    "start_time": day_start - timedelta(hours=lookback),
+                    "end_time": day_start + timedelta(days=1),
+                })
+            features = point_in_time_features(chunk[["user_id", "timestamp"]], agg,
+                                              include_distinct=config["include_distinct"])
+            output = pd.concat([chunk.reset_index(drop=True), features], axis=1)
+            path = os.path.join(out_dir, f"part-{part:05d}.parquet")
+            output.to_parquet(path, index=False)
+            paths.append(path)
+    finally:
+        engine.dispose()
+    logger.info(f"Built training partition {day} ({len(labels)} rows, {len(paths)} files)")
+    return paths
+
+
+class TrainingSetBuilder:
+    """
+    Builds labeled training sets whose features are computed as of each event,
+    from the same hourly table and over the same windows as
+    ``FeatureStore.get_user_features`` online: only hours that completed
+    before the event's hour count, so neither later events nor the event
+    itself leak in.
+
+    Labeled events (``user_id``, ``timestamp``, ``label`` and any extra columns)
+    come from a Parquet dataset or a SQL query with ``:start``/``:end`` params.
+    Each day is an independent partition built in its own process, in chunks of
+    roughly ``chunk_size`` events, and written as Parquet under
+    ``output_dir/date=YYYY-MM-DD/``.
+    """
+    def __init__(self, db_uri: str, output_dir: str, labels_path: Optional[str] = None,
+                 labels_query: Optional[str] = None, include_distinct: bool = True,
+                 chunk_size: int = 500_000, max_workers: Optional[int] = None):
+        if not labels_path and not labels_query:
+            raise ValueError("Either labels_path or labels_query is required")
+        self.config = {
+            "db_uri": db_uri,
+            "output_dir": output_dir,
+            "labels_path": labels_path,
+            "labels_query": labels_query,
+            "include_distinct": include_distinct,
+            "chunk_size": chunk_size,
+        }
+        self.max_workers = max_workers or os.cpu_count()
+
+    def build(self, start: date, end: date) -> List[str]:
+        """Build every day in [start, end). Returns the written Parquet paths."""
+        days = [start + timedelta(days=i) for i in range((end - start).days)]
+        paths = []
+        with ProcessPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {pool.submit(_build_partition, self.config, day): day for day in days}
+            for future in as_completed(futures):
+                paths.extend(future.result())
+        logger.info(f"Training set built: {len(days)} days, {len(paths)} files in {self.config['output_dir']}")
+        return sorted(paths)
@@ -7,11 +7,14 @@ from fastapi.middleware.cors import CORSMiddleware
 import os
 from .api import ingest as v1_ingest
 from .api.v2 import ingest as v2_ingest
+from .api.v3 import policies as v3_policies
+from .api.v3 import audit as v3_audit
 from .auth import router as auth_router
 from .observability.health import router as health_router
 from .observability.metrics import metrics_router
 from .observability.logging import setup_logging
 from .streaming.consumer import TelemetryConsumer
+from .streaming.processor import start_background_tasks, close_clients
 from .billing.middleware import BillingMiddleware
 import asyncio
 
@@ -40,6 +43,8 @@ if os.getenv("ENABLE_BILLING", "false").lower() == "true":
 app.include_router(v1_ingest.router, prefix="/v1", tags=["Telemetry v1"])
 if os.getenv("ENABLE_V2_API", "true").lower() == "true":
     app.include_router(v2_ingest.router, prefix="/v2", tags=["Telemetry v2"])
+app.include_router(v3_policies.router, prefix="/v3")
+app.include_router(v3_audit.router, prefix="/v3")
 app.include_router(auth_router.router, prefix="/auth", tags=["Authentication"])
 app.include_router(health_router, prefix="/health", tags=["Health"])
 app.include_router(metrics_router, prefix="/metrics", tags=["Metrics"])
@@ -52,13 +57,14 @@ async def startup_event():
     if os.getenv("ENABLE_KAFKA_CONSUMER", "true").lower() == "true":
         consumer = TelemetryConsumer(max_concurrent=int(os.getenv("KAFKA_MAX_CONCURRENT", "10")))
         asyncio.create_task(consumer.start())
-    # Additional startup tasks (e.g., warm up caches) can be added here
+    # Warm in-process caches and start their refresh loops
+    await start_background_tasks()
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Cleanup on shutdown."""
     # Gracefully stop background tasks
-    pass
+    await close_clients()
 
 @app.get("/")
 async def root():
@@ -15,6 +15,15 @@ active_sessions = Gauge('active_sessions', 'Number of active sessions')
 telemetry_counter = Counter('telemetry_events_total', 'Total telemetry events ingested', ['endpoint'])
 login_attempts_counter = Counter('login_attempts_total', 'Total login attempts', ['status'])
 mfa_challenges_counter = Counter('mfa_challenges_total', 'Total MFA challenges', ['provider', 'status'])
+feature_cache_requests = Counter('feature_cache_requests_total', 'Feature cache lookups', ['tier', 'result'])
+threat_intel_lookups = Counter('threat_intel_lookups_total', 'IP reputation lookups by where they resolved', ['source'])
+threat_intel_cache_age = Histogram('threat_intel_cache_age_seconds', 'Age of cached IP reputations when read',
+                                   buckets=(60, 300, 900, 1800, 3600, 7200, 21600, 43200, 86400))
+threat_intel_source_requests = Counter('threat_intel_source_requests_total', 'Threat intel source calls', ['source', 'result'])
+threat_intel_breaker_state = Gauge('threat_intel_breaker_state', 'Circuit breaker state (0 closed, 1 half-open, 2 open)', ['source'])
+audit_queue_depth = Gauge('audit_queue_depth', 'Audit entries waiting to be written')
+audit_entries = Counter('audit_entries_total', 'Audit entries by outcome', ['result'])
+audit_flush_duration = Histogram('audit_flush_duration_seconds', 'Time to write one batch of audit entries')
 
 metrics_router = APIRouter()
 
@@ -1,18 +1,27 @@
 """
 Process telemetry events: store, compute risk, update session, evaluate policies.
 """
+import asyncio
 import os
 from ..feature_store.feature_store import FeatureStore
+from ..feature_store.rolling import naive_utc
 from ..model_registry.registry import ModelRegistry
 from ..engine.risk import RiskEngine
 from ..engine.online_learner import OnlineRiskLearner
 from ..threat_intel.aggregator import ThreatIntelAggregator
+from ..threat_intel.reputation_index import ReputationIndex
 from ..engine.adaptive_thresholds import AdaptiveThresholds
+from ..engine.threshold_learner import ThresholdLearner
 from ..engine.policy import PolicyEngine
+from ..engine.policy_counters import PolicyTriggerCounters
+from ..compliance.geoip import GeoIPEnforcer
+from ..audit.writer import get_audit_writer
 from ..db.database import SessionLocal
 from ..db import models
-from ..observability.logging import logger
 import redis.asyncio as aioredis
+import logging
+
+logger = logging.getLogger(__name__)
 
 # Global singletons (initialized once at startup)
 _redis_client = None
@@ -21,8 +30,10 @@ _model_registry = None
 _threat_intel = None
 _online_learner = None
 _adaptive_thresholds = None
+_threshold_learner = None
 _risk_engine = None
 _policy_engine = None
+_geoip = None
 
 async def get_redis():
     global _redis_client
@@ -40,6 +51,12 @@ async def get_feature_store():
             os.getenv("DATABASE_URL"),
             os.getenv("REDIS_URL")
         )
+        if os.getenv("DATA_LAKE_URI"):
+            from ..data_lake.archiver import TelemetryArchiver
+            from ..data_lake.connector import connector_from_uri
+            _feature_store.archive = TelemetryArchiver(
+                _feature_store.db_engine, connector_from_uri(os.getenv("DATA_LAKE_URI"))
+            )
     return _feature_store
 
 async def get_model_registry():
@@ -52,9 +69,20 @@ async def get_threat_intel():
     global _threat_intel
     if _threat_intel is None:
         redis = await get_redis()
-        _threat_intel = ThreatIntelAggregator(redis)
+        reputation_index = None
+        if os.getenv("THREAT_INTEL_FEEDS"):
+            reputation_index = ReputationIndex()
+            await reputation_index.refresh()
+        _threat_intel = ThreatIntelAggregator(redis, reputation_index=reputation_index)
     return _threat_intel
 
+async def get_geoip():
+    global _geoip
+    if _geoip is None and os.getenv("ENABLE_GEOIP_ENRICHMENT", "true").lower() == "true":
+        _geoip = GeoIPEnforcer(db_session_factory=lambda: SessionLocal())
+        await asyncio.to_thread(_geoip.load_tenant_policies)
+    return _geoip
+
 async def get_online_learner():
     global _online_learner
     if _online_learner is None:
@@ -66,9 +94,20 @@ async def get_adaptive_thresholds():
     global _adaptive_thresholds
     if _adaptive_thresholds is None:
         redis = await get_redis()
-        _adaptive_thresholds = AdaptiveThresholds(lambda: SessionLocal(), redis)
+        _adaptive_thresholds = AdaptiveThresholds(
+            lambda: SessionLocal(),
+            redis,
+            cache_ttl=int(os.getenv("THRESHOLD_REFRESH_INTERVAL", "30"))
+        )
+        await _adaptive_thresholds.refresh()
     return _adaptive_thresholds
 
+async def get_threshold_learner():
+    global _threshold_learner
+    if _threshold_learner is None:
+        _threshold_learner = ThresholdLearner(await get_redis(), await get_adaptive_thresholds())
+    return _threshold_learner
+
 async def get_risk_engine():
     global _risk_engine
     if _risk_engine is None:
@@ -81,16 +120,64 @@ async def get_risk_engine():
         )
     return _risk_engine
 
-def get_policy_engine():
+async def start_background_tasks():
+    """Start refresh loops for in-process caches (called once at startup)."""
+    thresholds = await get_adaptive_thresholds()
+    asyncio.create_task(thresholds.run_refresh_loop())
+    threat_intel = await get_threat_intel()
+    if threat_intel.reputation_index is not None:
+        asyncio.create_task(threat_intel.reputation_index.run_refresh_loop())
+    geoip = await get_geoip()
+    if geoip is not None:
+        asyncio.create_task(geoip.run_reload_loop())
+    policy_engine = await get_policy_engine()
+    asyncio.create_task(policy_engine.run_refresh_loop())
+    asyncio.create_task(policy_engine.counters.run_forever())
+    asyncio.create_task(get_audit_writer().run_forever())
+    if os.getenv("ENABLE_THRESHOLD_LEARNER", "true").lower() == "true":
+        learner = await get_threshold_learner()
+        asyncio.create_task(learner.run())
+    if os.getenv("ENABLE_ROLLUP_SCHEDULER", "false").lower() == "true":
+        # Run in a single deployment; parallelism is bounded by ROLLUP_MAX_CONCURRENCY
+        from ..feature_store.rollup import HourlyRollupScheduler
+        scheduler = HourlyRollupScheduler(await get_feature_store())
+        asyncio.create_task(scheduler.run_forever())
+    if os.getenv("ENABLE_PARTITION_MAINTENANCE", "true").lower() == "true":
+        # Creates upcoming partitions; a no-op until scripts/partition_tables.py has run
+        from ..db.partitioning import PartitionManager
+        partitions = PartitionManager((await get_feature_store()).db_engine)
+        asyncio.create_task(partitions.run_forever())
+    if os.getenv("ENABLE_TELEMETRY_ARCHIVER", "false").lower() == "true":
+        # Single deployment as well; needs DATA_LAKE_URI
+        feature_store = await get_feature_store()
+        if feature_store.archive is None:
+            logger.warning("ENABLE_TELEMETRY_ARCHIVER is set but DATA_LAKE_URI is not; archiver not started")
+        else:
+            asyncio.create_task(feature_store.archive.run_forever())
+
+async def close_clients():
+    """Close long-lived network clients and flush pending counters (called once at shutdown)."""
+    if _threat_intel is not None:
+        await _threat_intel.close()
+    if _policy_engine is not None:
+        await _policy_engine.counters.close()
+    await get_audit_writer().close()
+
+async def get_policy_engine():
     global _policy_engine
     if _policy_engine is None:
-        _policy_engine = PolicyEngine(lambda: SessionLocal())
+        redis = await get_redis()
+        counters = PolicyTriggerCounters(redis, lambda: SessionLocal())
+        _policy_engine = PolicyEngine(lambda: SessionLocal(), redis, counters=counters)
+        await _policy_engine.refresh()
     return _policy_engine
 
 async def process_telemetry(telemetry: dict):
     """
     Idempotent processing of a telemetry event.
     """
+    # Naive UTC like every stored timestamp, also for the hour-based features below
+    telemetry = {**telemetry, "timestamp": naive_utc(telemetry["timestamp"])}
     db = SessionLocal()
     try:
         # 1. Store raw telemetry (if not already stored)
@@ -99,17 +186,40 @@ async def process_telemetry(telemetry: dict):
             session_id=telemetry["session_id"],
             timestamp=telemetry["timestamp"]
         ).first()
+        db_telemetry = existing
         if not existing:
             db_telemetry = models.Telemetry(**telemetry)
             db.add(db_telemetry)
             db.commit()
             logger.debug(f"Stored telemetry for session {telemetry['session_id']}")
 
-        # 2. Compute risk
+        # 2. Enrich with country/ASN (after storing: the telemetry table has no such columns)
+        geoip = await get_geoip()
+        if geoip is not None:
+            telemetry = geoip.enrich(dict(telemetry))
+
+        # 3. Compute risk
         risk_engine = await get_risk_engine()
         risk_result = await risk_engine.compute_risk(telemetry)
+        if os.getenv("ENABLE_THRESHOLD_LEARNER", "true").lower() == "true":
+            # Without the learner's flush loop, observations would only pile up
+            learner = await get_threshold_learner()
+            learner.observe(
+                telemetry.get("tenant_id"),
+                telemetry.get("role", "standard"),
+                telemetry["timestamp"].hour,
+                risk_result["trust_score"]
+            )
+
+        # Trust score is 0-100 with higher being safer; risk score is its complement
+        risk_score = 100.0 - risk_result["trust_score"]
+        db_telemetry.risk_score = risk_score
+        if not existing:
+            # Redeliveries were already folded into the rolling window
+            feature_store = await get_feature_store()
+            await feature_store.record_event(telemetry, risk_score)
 
-        # 3. Update session
+        # 4. Update session
         session = db.query(models.Session).filter_by(id=telemetry["session_id"]).first()
         if not session:
             session = models.Session(
@@ -127,15 +237,20 @@ async def process_telemetry(telemetry: dict):
             session.last_activity = telemetry["timestamp"]
         db.commit()
 
-        # 4. Evaluate policies
-        policy_engine = get_policy_engine()
+        # 5. Evaluate policies
+        policy_engine = await get_policy_engine()
         context = {
             "trust_score": risk_result["trust_score"],
             "risk_level": risk_result["risk_level"],
             "user_role": telemetry.get("role", "standard"),
             "ip": telemetry["ip"],
-            "user_id": telemetry["user_id"]
+            "user_id": telemetry["user_id"],
+            "tenant_id": telemetry.get("tenant_id"),
+            "country": telemetry.get("country"),
+            "asn": telemetry.get("asn"),
         }
+        if geoip is not None:
+            context["geo_allowed"] = geoip.is_allowed(telemetry["ip"], tenant_id=telemetry.get("tenant_id"))
         actions = policy_engine.evaluate(context)
         if actions:
             logger.info(f"Policy actions for session {telemetry['session_id']}: {actions}")
@@ -3,70 +3,396 @@ Threat intelligence aggregator with multiple sources, caching, and fallback.
 """
 import aiohttp
 import asyncio
+import ipaddress
 import redis.asyncio as aioredis
 import json
 import logging
 import os
-from typing import Optional, List, Dict, Any
-from tenacity import retry, stop_after_attempt, wait_exponential
+import time
+from functools import partial
+from typing import Optional, List, Dict, Any, Sequence, Tuple
+from .resilience import TokenBucket, CircuitBreaker
+from .reputation_index import ReputationIndex
+from ..observability.metrics import (
+    threat_intel_lookups, threat_intel_cache_age, threat_intel_source_requests, threat_intel_breaker_state
+)
 
 logger = logging.getLogger(__name__)
 
+_BREAKER_STATES = {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}
+
+
+def _encode(score: int, fetched_at: float) -> str:
+    return f"{score}|{int(fetched_at)}"
+
+
+SUBNET_PREFIX = {
+    4: int(os.getenv("THREAT_INTEL_SUBNET_V4", "24")),
+    6: int(os.getenv("THREAT_INTEL_SUBNET_V6", "64")),
+}
+
+
+def subnet_of(ip: str) -> Optional[str]:
+    """The /24 (IPv4) or /64 (IPv6) an address belongs to, e.g. ``"203.0.113.0/24"``."""
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return None
+    return str(ipaddress.ip_network(f"{address}/{SUBNET_PREFIX[address.version]}", strict=False))
+
+
+def _decode(value: str) -> Tuple[int, Optional[float]]:
+    """(score, fetched_at); entries written before timestamps were stored have none."""
+    score, _, fetched_at = value.partition("|")
+    return int(score), float(fetched_at) if fetched_at else None
+
+
 class ThreatIntelAggregator:
-    def __init__(self, redis_client: aioredis.Redis, cache_ttl: int = 3600):
+    def __init__(self, redis_client: aioredis.Redis, cache_ttl: int = 3600,
+                 reputation_index: Optional[ReputationIndex] = None):
         self.redis = redis_client
         self.cache_ttl = cache_ttl
+        # Local feed index, consulted before the cache and any remote source
+        self.reputation_index = reputation_index
         self.apis = {
             "abuseipdb": {
-                "url": "https://api.abuseipdb.com/api/v2/check",
+                "url": os.getenv("ABUSEIPDB_URL", "https://api.abuseipdb.com/api/v2/check"),
                 "api_key": os.getenv("ABUSEIPDB_API_KEY"),
-                "enabled": bool(os.getenv("ABUSEIPDB_API_KEY"))
+                "enabled": bool(os.getenv("ABUSEIPDB_API_KEY")),
+                # Vendor quotas (free tiers by default)
+                "limiter": TokenBucket.from_spec(os.getenv("ABUSEIPDB_RATE_LIMIT", "1000/day")),
+                # Bulk lookups: one request scores a whole IPv4 /24, on its own quota
+                "block_url": os.getenv("ABUSEIPDB_BLOCK_URL", "https://api.abuseipdb.com/api/v2/check-block"),
+                "block_limiter": TokenBucket.from_spec(os.getenv("ABUSEIPDB_BLOCK_RATE_LIMIT", "100/day")),
             },
             "virustotal": {
-                "url": "https://www.virustotal.com/api/v3/ip_addresses/",
+                "url": os.getenv("VIRUSTOTAL_URL", "https://www.virustotal.com/api/v3/ip_addresses/"),
                 "api_key": os.getenv("VIRUSTOTAL_API_KEY"),
-                "enabled": bool(os.getenv("VIRUSTOTAL_API_KEY"))
+                "enabled": bool(os.getenv("VIRUSTOTAL_API_KEY")),
+                "limiter": TokenBucket.from_spec(os.getenv("VIRUSTOTAL_RATE_LIMIT", "4/minute")),
             },
             # Add more sources as needed
         }
+        for source, config in self.apis.items():
+            config["breaker"] = CircuitBreaker(
+                failure_threshold=int(os.getenv("THREAT_INTEL_BREAKER_FAILURES", "5")),
+                recovery_timeout=float(os.getenv("THREAT_INTEL_BREAKER_RECOVERY", "30")),
+                on_change=lambda state, source=source: threat_intel_breaker_state.labels(source=source).set(
+                    _BREAKER_STATES[state]),
+            )
+            threat_intel_breaker_state.labels(source=source).set(0)
         self.fallback_score = int(os.getenv("THREAT_INTEL_FALLBACK_SCORE", "50"))
-        self.timeout = aiohttp.ClientTimeout(total=5)
+        # Reputations older than cache_ttl are still served for stale_ttl more seconds
+        # while a background refresh runs
+        self.stale_ttl = int(os.getenv("THREAT_INTEL_STALE_TTL", "86400"))
+        # Lookups where every source failed answer with the fallback for this long
+        self.negative_ttl = int(os.getenv("THREAT_INTEL_NEGATIVE_TTL", "60"))
+        # Unseen IPs fall back to the mean score of known IPs in their subnet
+        self.subnet_enabled = os.getenv("THREAT_INTEL_SUBNET_ENABLED", "true").lower() == "true"
+        self.subnet_min_ips = int(os.getenv("THREAT_INTEL_SUBNET_MIN_IPS", "3"))
+        self.subnet_max_ips = int(os.getenv("THREAT_INTEL_SUBNET_MAX_IPS", "256"))
+        self.subnet_ttl = int(os.getenv("THREAT_INTEL_SUBNET_TTL", str(7 * 86400)))
+        self.timeout = aiohttp.ClientTimeout(total=float(os.getenv("THREAT_INTEL_TIMEOUT", "2")))
+        # Longest a lookup waits for a source's rate limiter before skipping that source
+        self.rate_limit_wait = float(os.getenv("THREAT_INTEL_RATE_LIMIT_WAIT", "1.0"))
+        # check_ips: most source requests in flight at once, and the fewest misses
+        # in one /24 worth an AbuseIPDB block request
+        self.bulk_concurrency = int(os.getenv("THREAT_INTEL_BULK_CONCURRENCY", "10"))
+        self.bulk_block_min_ips = int(os.getenv("THREAT_INTEL_BULK_BLOCK_MIN_IPS", "2"))
+        self._session: Optional[aiohttp.ClientSession] = None
+        # One upstream lookup per IP at a time; concurrent callers share its result
+        self._inflight: Dict[str, asyncio.Task] = {}
+        # Strong references to background refreshes until they finish
+        self._refreshes = set()
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Long-lived session so connections (and TLS sessions) are reused across lookups."""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=int(os.getenv("THREAT_INTEL_POOL_SIZE", "100")),
+                limit_per_host=int(os.getenv("THREAT_INTEL_POOL_PER_HOST", "20")),
+                ttl_dns_cache=300,
+                keepalive_timeout=60,
+            )
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
 
-    @retry(stop=stop_after_attempt(2), wait=wait_exponential(multiplier=1, min=2, max=5))
     async def check_ip(self, ip: str) -> int:
         """
         Return reputation score (0-100, higher is safer) for an IP.
-        Uses Redis cache. On failure, returns fallback.
+        Listed IPs resolve from the local reputation index; others use the
+        Redis cache, then remote sources. Cached scores past ``cache_ttl`` are
+        served stale while they refresh in the background, and IPs whose
+        lookup just failed get the fallback without retrying upstream. An
+        uncached IP in a subnet with enough known IPs gets the subnet's score
+        while its own lookup runs in the background.
         """
-        cache_key = f"threat:intel:{ip}"
-        cached = await self.redis.get(cache_key)
+        if self.reputation_index is not None:
+            listed = self.reputation_index.lookup(ip)
+            if listed is not None:
+                threat_intel_lookups.labels(source="index").inc()
+                return listed[0]
+
+        cached, failed = await self.redis.mget(self._cache_key(ip), self._negative_key(ip))
         if cached:
-            return int(cached)
+            score, fetched_at = _decode(cached)
+            age = time.time() - fetched_at if fetched_at is not None else 0.0
+            threat_intel_cache_age.observe(age)
+            if age <= self.cache_ttl:
+                threat_intel_lookups.labels(source="cache").inc()
+                return score
+            threat_intel_lookups.labels(source="stale").inc()
+            if not failed and ip not in self._inflight:
+                self._refresh_in_background(ip)
+            return score
+        if failed:
+            threat_intel_lookups.labels(source="negative").inc()
+            return self.fallback_score
+
+        subnet_score = await self._subnet_score(ip) if self.subnet_enabled else None
+        if subnet_score is not None:
+            threat_intel_lookups.labels(source="subnet").inc()
+            if ip not in self._inflight:
+                self._refresh_in_background(ip)
+            return subnet_score
+
+        threat_intel_lookups.labels(source="remote").inc()
+        return await self._single_flight(ip)
+
+    async def check_ips(self, ips: Sequence[str]) -> List[int]:
+        """
+        Reputation scores for many IPs, aligned with ``ips``; for batch scoring
+        and backfills.
+
+        Each distinct IP is resolved once: the reputation index first, then a
+        single MGET over the cache, then remote sources for the misses, with
+        at most ``bulk_concurrency`` requests in flight. Misses sharing an IPv4
+        /24 are scored by one AbuseIPDB block request. Results are cached in
+        one pipeline. Stale entries are served and refreshed in the background
+        as in ``check_ip``; misses are always looked up, never answered from
+        their subnet.
+        """
+        scores: Dict[str, int] = {}
+        pending = []
+        for ip in dict.fromkeys(ips):
+            listed = self.reputation_index.lookup(ip) if self.reputation_index is not None else None
+            if listed is not None:
+                threat_intel_lookups.labels(source="index").inc()
+                scores[ip] = listed[0]
+            else:
+                pending.append(ip)
+
+        stale, misses = [], []
+        if pending:
+            values = await self.redis.mget(
+                [self._cache_key(ip) for ip in pending] + [self._negative_key(ip) for ip in pending]
+            )
+            now = time.time()
+            for ip, cached, failed in zip(pending, values[:len(pending)], values[len(pending):]):
+                if cached:
+                    score, fetched_at = _decode(cached)
+                    age = now - fetched_at if fetched_at is not None else 0.0
+                    threat_intel_cache_age.observe(age)
+                    scores[ip] = score
+                    if age <= self.cache_ttl:
+                        threat_intel_lookups.labels(source="cache").inc()
+                        continue
+                    threat_intel_lookups.labels(source="stale").inc()
+                    if not failed and ip not in self._inflight:
+                        stale.append(ip)
+                elif failed:
+                    threat_intel_lookups.labels(source="negative").inc()
+                    scores[ip] = self.fallback_score
+                else:
+                    misses.append(ip)
+
+        if stale:
+            self._run_in_background(self._lookup_many(stale), f"{len(stale)} stale IPs")
+        if misses:
+            threat_intel_lookups.labels(source="remote").inc(len(misses))
+            # Join lookups check_ip already has in flight instead of repeating them
+            shared = {ip: self._inflight[ip] for ip in misses if ip in self._inflight}
+            scores.update(await self._lookup_many([ip for ip in misses if ip not in shared]))
+            results = await asyncio.gather(*(asyncio.shield(f) for f in shared.values()), return_exceptions=True)
+            for ip, result in zip(shared, results):
+                scores[ip] = result if isinstance(result, int) else self.fallback_score
+        return [scores[ip] for ip in ips]
+
+    def _subnet_key(self, subnet: str) -> str:
+        return f"threat:intel:subnet:{subnet}"
+
+    async def _subnet_score(self, ip: str) -> Optional[int]:
+        """Mean of the known per-IP scores in the IP's subnet, if there are enough of them."""
+        subnet = subnet_of(ip)
+        if subnet is None:
+            return None
+        scores = await self.redis.hvals(self._subnet_key(subnet))
+        if len(scores) < self.subnet_min_ips:
+            return None
+        return sum(int(score) for score in scores) // len(scores)
+
+    def _cache_key(self, ip: str) -> str:
+        return f"threat:intel:{ip}"
+
+    def _negative_key(self, ip: str) -> str:
+        return f"threat:intel:failed:{ip}"
+
+    async def _single_flight(self, ip: str) -> int:
+        task = self._inflight.get(ip)
+        if task is None:
+            # The lookup runs as its own task, so it outlives whichever caller started it
+            task = asyncio.ensure_future(self._lookup(ip))
+            self._inflight[ip] = task
+            task.add_done_callback(partial(self._lookup_done, ip))
+        # Shielded so a cancelled caller, the first one included, doesn't cancel the shared lookup
+        return await asyncio.shield(task)
+
+    def _lookup_done(self, ip: str, task: asyncio.Task):
+        if self._inflight.get(ip) is task:
+            del self._inflight[ip]
+        if not task.cancelled():
+            # Mark retrieved so the exception isn't reported when every caller was cancelled
+            task.exception()
+
+    def _refresh_in_background(self, ip: str):
+        self._run_in_background(self._single_flight(ip), ip)
+
+    def _run_in_background(self, lookup, what: str):
+        task = asyncio.create_task(lookup)
+        self._refreshes.add(task)
+
+        def done(task):
+            self._refreshes.discard(task)
+            if not task.cancelled() and task.exception() is not None:
+                logger.warning(f"Background threat intel refresh failed for {what}: {task.exception()}")
+        task.add_done_callback(done)
+
+    async def _lookup(self, ip: str) -> int:
+        return (await self._lookup_many([ip]))[ip]
+
+    async def _lookup_many(self, ips: List[str]) -> Dict[str, int]:
+        """Query every enabled source for ``ips`` and cache the combined scores."""
+        if not ips:
+            return {}
+        sources = {source: config for source, config in self.apis.items() if config["enabled"]}
+        if not sources:
+            logger.warning("No threat intel sources enabled, using fallback")
+            return {ip: self.fallback_score for ip in ips}
+
+        session = self._get_session()
+        semaphore = asyncio.Semaphore(self.bulk_concurrency)
+        results: Dict[str, List[int]] = {ip: [] for ip in ips}
+
+        async def run(source, config, query, covered, limiter=None):
+            # The query coroutine is only created once a slot is free
+            async with semaphore:
+                result = await self._call_source(source, config, query(), limiter)
+            if isinstance(result, dict):
+                for ip in covered:
+                    results[ip].append(result[ip])
+            elif isinstance(result, int):
+                results[covered[0]].append(result)
 
         tasks = []
-        async with aiohttp.ClientSession(timeout=self.timeout) as session:
-            for source, config in self.apis.items():
-                if config["enabled"]:
-                    if source == "abuseipdb":
-                        tasks.append(self._query_abuseipdb(session, ip, config))
-                    elif source == "virustotal":
-                        tasks.append(self._query_virustotal(session, ip, config))
-                    # Add other sources similarly
-
-            if not tasks:
-                logger.warning("No threat intel sources enabled, using fallback")
-                return self.fallback_score
-
-            results = await asyncio.gather(*tasks, return_exceptions=True)
-
-        valid_scores = [r for r in results if isinstance(r, int)]
-        if not valid_scores:
-            score = self.fallback_score
-        else:
+        for source, config in sources.items():
+            if source == "abuseipdb":
+                blocks: Dict[str, List[str]] = {}
+                for ip in ips:
+                    blocks.setdefault(self._abuseipdb_block(ip) or ip, []).append(ip)
+                for network, members in blocks.items():
+                    if len(members) >= self.bulk_block_min_ips:
+                        tasks.append(run(source, config, partial(
+                            self._query_abuseipdb_block, session, network, members, config
+                        ), members, config["block_limiter"]))
+                        continue
+                    for ip in members:
+                        tasks.append(run(source, config, partial(self._query_abuseipdb, session, ip, config), [ip]))
+            elif source == "virustotal":
+                for ip in ips:
+                    tasks.append(run(source, config, partial(self._query_virustotal, session, ip, config), [ip]))
+            # Add other sources similarly
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return await self._store(results)
+
+    async def _store(self, results: Dict[str, List[int]]) -> Dict[str, int]:
+        """Combine per-source scores and write them, failures and subnet fields back in one pipeline."""
+        now = time.time()
+        scores = {}
+        subnet_fields = []
+        pipe = self.redis.pipeline(transaction=False)
+        for ip, valid_scores in results.items():
+            if not valid_scores:
+                # Keep any stale score; just stop retrying this IP for a while
+                pipe.setex(self._negative_key(ip), self.negative_ttl, "1")
+                scores[ip] = self.fallback_score
+                continue
             score = sum(valid_scores) // len(valid_scores)
+            scores[ip] = score
+            pipe.setex(self._cache_key(ip), self.cache_ttl + self.stale_ttl, _encode(score, now))
+            subnet = subnet_of(ip) if self.subnet_enabled else None
+            if subnet is not None:
+                # One field per IP, so refreshes don't double count
+                key = self._subnet_key(subnet)
+                pipe.hset(key, ip, score)
+                pipe.expire(key, self.subnet_ttl)
+                pipe.hlen(key)
+                subnet_fields.append((len(pipe) - 1, key, ip))
+        replies = await pipe.execute()
+
+        # Subnets are bounded (an IPv6 /64 could otherwise grow without limit):
+        # take back the fields that went over
+        overflow = [(key, ip) for position, key, ip in subnet_fields if replies[position] > self.subnet_max_ips]
+        if overflow:
+            pipe = self.redis.pipeline(transaction=False)
+            for key, ip in overflow:
+                pipe.hdel(key, ip)
+            await pipe.execute()
+        return scores
 
-        await self.redis.setex(cache_key, self.cache_ttl, str(score))
-        return score
+    @staticmethod
+    def _abuseipdb_block(ip: str) -> Optional[str]:
+        """The IPv4 /24 an AbuseIPDB block request would cover; None for IPv6 or invalid input."""
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        if address.version != 4:
+            return None
+        return str(ipaddress.ip_network(f"{address}/24", strict=False))
+
+    async def _call_source(self, source: str, config: Dict[str, Any], query, limiter: Optional[TokenBucket] = None):
+        """Run a source query unless its breaker is open or its quota is used up. None on failure."""
+        breaker = config["breaker"]
+        limiter = limiter or config["limiter"]
+        if not breaker.allow():
+            query.close()
+            threat_intel_source_requests.labels(source=source, result="circuit_open").inc()
+            return None
+        if not await limiter.acquire(self.rate_limit_wait):
+            query.close()
+            breaker.release()
+            threat_intel_source_requests.labels(source=source, result="rate_limited").inc()
+            logger.warning(f"{source} rate limit reached, skipping")
+            return None
+        try:
+            result = await query
+        except BaseException:
+            # Cancelled (or crashed) before an answer: give back a reserved probe
+            # so a half-open breaker doesn't stay waiting on it forever
+            breaker.release()
+            raise
+        if result is None:
+            breaker.record_failure()
+            threat_intel_source_requests.labels(source=source, result="failure").inc()
+        else:
+            breaker.record_success()
+            threat_intel_source_requests.labels(source=source, result="success").inc()
+        return result
 
     async def _query_abuseipdb(self, session, ip, config):
         try:
@@ -85,6 +411,26 @@ class ThreatIntelAggregator:
             logger.exception(f"AbuseIPDB exception for {ip}: {e}")
             return None
 
+    async def _query_abuseipdb_block(self, session, network, ips, config):
+        """Scores for ``ips`` in ``network`` from one check-block request; IPs with no reports score 100."""
+        try:
+            headers = {"Key": config["api_key"], "Accept": "application/json"}
+            params = {"network": network, "maxAgeInDays": 90}
+            async with session.get(config["block_url"], headers=headers, params=params) as resp:
+                if resp.status == 200:
+                    data = await resp.json()
+                    abuse_scores = {
+                        entry["ipAddress"]: entry["abuseConfidenceScore"]
+                        for entry in data["data"]["reportedAddress"]
+                    }
+                    return {ip: 100 - abuse_scores.get(ip, 0) for ip in ips}
+                else:
+                    logger.error(f"AbuseIPDB error {resp.status} for {network}")
+                    return None
+        except Exception as e:
+            logger.exception(f"AbuseIPDB exception for {network}: {e}")
+            return None
+
     async def _query_virustotal(self, session, ip, config):
         try:
             headers = {"x-apikey": config["api_key"]}
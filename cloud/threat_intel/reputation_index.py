@@ -0,0 +1,157 @@
+"""
+In-process IP reputation index built from bulk blocklist feeds (IPs and CIDRs).
+"""
+import asyncio
+import heapq
+import ipaddress
+import os
+import logging
+from bisect import bisect_right
+from typing import Dict, Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def parse_feeds(spec: str) -> List[Dict[str, Any]]:
+    """``"tor:0:/feeds/tor.txt,hosting:60:/feeds/cloud.txt"`` -> feed configs (name, score, path)."""
+    feeds = []
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        name, score, path = entry.split(":", 2)
+        feeds.append({"name": name, "score": int(score), "path": path})
+    return feeds
+
+
+def _read_ranges(path: str) -> List[Tuple[int, int, int]]:
+    """(version, first, last) address ranges from a feed file; ``#`` starts a comment."""
+    ranges = []
+    with open(path) as f:
+        for line in f:
+            entry = line.split("#", 1)[0].strip()
+            if not entry:
+                continue
+            try:
+                network = ipaddress.ip_network(entry, strict=False)
+            except ValueError:
+                logger.warning(f"Skipping invalid entry {entry!r} in {path}")
+                continue
+            ranges.append((network.version, int(network.network_address), int(network.broadcast_address)))
+    return ranges
+
+
+class _Intervals:
+    """Disjoint, sorted address intervals, each with a score and the feed it came from."""
+    __slots__ = ("starts", "ends", "scores", "sources")
+
+    def __init__(self, intervals: List[Tuple[int, int, int, str]]):
+        self.starts: List[int] = []
+        self.ends: List[int] = []
+        self.scores: List[int] = []
+        self.sources: List[str] = []
+        # Sweep the range boundaries; where ranges overlap the lowest (worst) score wins
+        events = sorted(
+            [(first, 0, score, source) for first, last, score, source in intervals] +
+            [(last + 1, 1, score, source) for first, last, score, source in intervals]
+        )
+        active: List[Tuple[int, str]] = []
+        ended: Dict[Tuple[int, str], int] = {}
+        boundaries: List[Tuple[int, Optional[Tuple[int, str]]]] = []
+        i = 0
+        while i < len(events):
+            position = events[i][0]
+            while i < len(events) and events[i][0] == position:
+                _, kind, score, source = events[i]
+                if kind == 0:
+                    heapq.heappush(active, (score, source))
+                else:
+                    ended[(score, source)] = ended.get((score, source), 0) + 1
+                i += 1
+            # Lazily discard ranges that ended
+            while active and ended.get(active[0]):
+                ended[active[0]] -= 1
+                heapq.heappop(active)
+            boundaries.append((position, active[0] if active else None))
+
+        for (position, current), (next_position, _) in zip(boundaries, boundaries[1:]):
+            if current is None:
+                continue
+            if self.starts and self.ends[-1] == position - 1 and (self.scores[-1], self.sources[-1]) == current:
+                self.ends[-1] = next_position - 1
+            else:
+                self.starts.append(position)
+                self.ends.append(next_position - 1)
+                self.scores.append(current[0])
+                self.sources.append(current[1])
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def find(self, address: int) -> Optional[Tuple[int, str]]:
+        i = bisect_right(self.starts, address) - 1
+        if i >= 0 and address <= self.ends[i]:
+            return self.scores[i], self.sources[i]
+        return None
+
+
+class ReputationIndex:
+    """
+    Known-bad (or known-hosting) address space from local feed files, such as
+    Tor exit lists, cloud provider ranges and botnet blocklists, each with a
+    fixed reputation score.
+
+    Feeds are flattened into disjoint sorted intervals per address family, so
+    a lookup is one binary search with no I/O. ``refresh`` rebuilds the index
+    off the event loop when a feed file changes and swaps it in with a single
+    assignment; lookups running meanwhile keep using the previous one.
+    """
+    def __init__(self, feeds: Optional[List[Dict[str, Any]]] = None, refresh_interval: Optional[int] = None):
+        self.feeds = feeds if feeds is not None else parse_feeds(os.getenv("THREAT_INTEL_FEEDS", ""))
+        self.refresh_interval = refresh_interval or int(os.getenv("THREAT_INTEL_FEEDS_REFRESH", "300"))
+        self._index: Dict[int, _Intervals] = {4: _Intervals([]), 6: _Intervals([])}
+        self._mtimes: Dict[str, float] = {}
+
+    def _stat(self) -> Dict[str, float]:
+        mtimes = {}
+        for feed in self.feeds:
+            try:
+                mtimes[feed["path"]] = os.stat(feed["path"]).st_mtime
+            except OSError:
+                logger.warning(f"Reputation feed {feed['name']} not found at {feed['path']}")
+        return mtimes
+
+    def load(self) -> bool:
+        """Rebuild from the feed files if any changed (blocking). Returns True if reloaded."""
+        mtimes = self._stat()
+        if mtimes == self._mtimes:
+            return False
+        by_version: Dict[int, List[Tuple[int, int, int, str]]] = {4: [], 6: []}
+        for feed in self.feeds:
+            if feed["path"] not in mtimes:
+                continue
+            for version, first, last in _read_ranges(feed["path"]):
+                by_version[version].append((first, last, feed["score"], feed["name"]))
+        index = {version: _Intervals(intervals) for version, intervals in by_version.items()}
+        self._index = index
+        self._mtimes = mtimes
+        logger.info(f"Reputation index loaded: {len(index[4])} IPv4 and {len(index[6])} IPv6 intervals "
+                    f"from {len(mtimes)} feeds")
+        return True
+
+    def lookup(self, ip: str) -> Optional[Tuple[int, str]]:
+        """(score, feed name) if the IP is listed, else None."""
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        return self._index[address.version].find(int(address))
+
+    async def refresh(self) -> bool:
+        return await asyncio.to_thread(self.load)
+
+    async def run_refresh_loop(self):
+        """Background task: pick up feed file changes every ``refresh_interval`` seconds."""
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Reputation index refresh failed: {e}")
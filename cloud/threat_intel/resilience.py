@@ -0,0 +1,110 @@
+"""
+Client-side protection for upstream threat intel APIs.
+"""
+import asyncio
+import time
+from typing import Tuple
+
+_PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+
+def parse_rate(spec: str) -> Tuple[float, float]:
+    """``"4/minute"`` -> (4 requests, 60 seconds)."""
+    count, _, period = spec.partition("/")
+    return float(count), float(_PERIODS[period.strip() or "second"])
+
+
+class TokenBucket:
+    """
+    Async token bucket: ``capacity`` requests per ``period`` seconds, refilled
+    continuously. Callers wait for a token, but never longer than ``max_wait``,
+    so an exhausted daily quota degrades to "source unavailable" instead of
+    stalling scoring.
+    """
+    def __init__(self, capacity: float, period: float):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    @classmethod
+    def from_spec(cls, spec: str) -> "TokenBucket":
+        return cls(*parse_rate(spec))
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, max_wait: float = 0.0) -> bool:
+        """Take one token, waiting up to ``max_wait`` seconds. False if none is available in time."""
+        self._refill()
+        wait = max(0.0, (1 - self._tokens) / self.rate)
+        if wait > max_wait:
+            return False
+        # Reserve the token now (the balance may go negative), so later callers
+        # wait behind this one without anyone sleeping while holding a lock
+        self._tokens -= 1
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                self._tokens += 1
+                raise
+        return True
+
+
+class CircuitBreaker:
+    """
+    Per-source breaker. After ``failure_threshold`` consecutive failures it
+    opens and the source is skipped for ``recovery_timeout`` seconds; then a
+    single probe request is let through (half-open), which closes the breaker
+    on success or re-opens it on failure.
+    """
+    CLOSED = "closed"
+    HALF_OPEN = "half_open"
+    OPEN = "open"
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0, on_change=None):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        # Called with the new state on every transition (e.g. to export it)
+        self._on_change = on_change
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            self.state = state
+            if self._on_change is not None:
+                self._on_change(state)
+
+    def allow(self) -> bool:
+        """Whether a request may be sent now. A True in half-open state reserves the probe."""
+        if self.state == self.OPEN:
+            if time.monotonic() - self._opened_at < self.recovery_timeout:
+                return False
+            self._set_state(self.HALF_OPEN)
+        if self.state == self.HALF_OPEN:
+            if self._probing:
+                return False
+            self._probing = True
+        return True
+
+    def record_success(self):
+        self._failures = 0
+        self._probing = False
+        self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        self._failures += 1
+        if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+            self._probing = False
+            self._opened_at = time.monotonic()
+            self._set_state(self.OPEN)
+
+    def release(self):
+        """Give back a reserved probe that was never sent (e.g. skipped by a rate limiter)."""
+        self._probing = False
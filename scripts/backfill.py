@@ -3,9 +3,12 @@
 Recompute features and optionally retrain models on historical data.
 """
 import argparse
-import pandas as pd
-from sqlalchemy import create_engine
+import asyncio
+import os
 from cloud.feature_store.feature_store import FeatureStore
+from cloud.feature_store.rollup import HourlyRollupScheduler
+from cloud.data_lake.archiver import TelemetryArchiver
+from cloud.data_lake.connector import connector_from_uri
 from cloud.model_registry.registry import ModelRegistry
 import logging
 from datetime import datetime
@@ -16,22 +19,29 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--start-date", required=True)
     parser.add_argument("--end-date", required=True)
+    parser.add_argument("--concurrency", type=int, default=None,
+                        help="Hour partitions rolled up in parallel (default: ROLLUP_MAX_CONCURRENCY)")
     parser.add_argument("--retrain", action="store_true")
     args = parser.parse_args()
 
-    engine = create_engine("postgresql://user:pass@db/citp")  # Use env var
-    feature_store = FeatureStore("postgresql://user:pass@db/citp")
-
-    # Load historical telemetry
-    query = f"SELECT * FROM telemetry WHERE timestamp BETWEEN '{args.start_date}' AND '{args.end_date}'"
-    df = pd.read_sql(query, engine)
+    feature_store = FeatureStore(
+        os.getenv("DATABASE_URL", "postgresql://user:pass@db/citp"),
+        os.getenv("REDIS_URL", "redis://redis:6379/0")
+    )
+    if os.getenv("DATA_LAKE_URI"):
+        # Hours older than the hot window are re-aggregated from the archived cold tier
+        feature_store.archive = TelemetryArchiver(
+            feature_store.db_engine, connector_from_uri(os.getenv("DATA_LAKE_URI"))
+        )
 
-    # For each user, recompute aggregates (feature store has method)
-    # This is a placeholder; actual backfill would call precompute_aggregates
-    feature_store.precompute_aggregates(
+    # Mark every hour in the range dirty and roll them up in parallel; hours that
+    # fail stay dirty and are picked up by the next run (or the online scheduler).
+    scheduler = HourlyRollupScheduler(feature_store, max_concurrency=args.concurrency)
+    processed = asyncio.run(scheduler.backfill(
         datetime.fromisoformat(args.start_date),
         datetime.fromisoformat(args.end_date)
-    )
+    ))
+    print(f"Rolled up {processed} hours")
 
     if args.retrain:
         # Load features and labels, train model
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Backtest candidate policy rules against historical scored telemetry (hot and
+cold tiers) and print the report as JSON.
+
+The rules file is a JSON list of rules, each with "name", "condition" and
+"action" (optionally "priority" and "tenant_id"), as stored in policy_rules.
+"""
+import argparse
+import json
+import sys
+from datetime import datetime, timedelta
+from cloud.engine.backtest import run_backtest
+from cloud.engine.policy import PolicyCompileError
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rules", required=True, help="JSON file with the candidate rules")
+    parser.add_argument("--start", type=datetime.fromisoformat, help="UTC, default 30 days before --end")
+    parser.add_argument("--end", type=datetime.fromisoformat, help="UTC, default now")
+    parser.add_argument("--tenant", help="Only replay this tenant's telemetry")
+    parser.add_argument("--workers", type=int, help="Worker processes (default BACKTEST_WORKERS or CPU count)")
+    parser.add_argument("--chunk-hours", type=int, help="Hours of telemetry per work unit")
+    args = parser.parse_args()
+
+    with open(args.rules) as f:
+        rules = json.load(f)
+    if isinstance(rules, dict):
+        rules = [rules]
+    end = args.end or datetime.utcnow()
+    start = args.start or end - timedelta(days=30)
+    chunk = timedelta(hours=args.chunk_hours) if args.chunk_hours else None
+
+    try:
+        report = run_backtest(rules, start, end, tenant_id=args.tenant, workers=args.workers, chunk=chunk)
+    except PolicyCompileError as e:
+        sys.exit(f"Invalid rule condition: {e}")
+    print(json.dumps(report, indent=2, default=str))
+
+if __name__ == "__main__":
+    main()
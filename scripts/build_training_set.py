@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+Build a point-in-time correct training set from labeled events and telemetry_hourly_agg.
+"""
+import argparse
+import os
+import logging
+from datetime import date
+from cloud.feature_store.training_set import TrainingSetBuilder
+
+logging.basicConfig(level=logging.INFO)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--start-date", required=True)
+    parser.add_argument("--end-date", required=True, help="Exclusive")
+    parser.add_argument("--output", required=True, help="Output directory (Parquet, partitioned by date)")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--labels-path", help="Parquet dataset with user_id, timestamp, label")
+    source.add_argument("--labels-query", help="SQL returning user_id, timestamp, label; use :start and :end")
+    parser.add_argument("--chunk-size", type=int, default=500_000)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--no-distinct", action="store_true", help="Skip sketch-based distinct counts")
+    args = parser.parse_args()
+
+    builder = TrainingSetBuilder(
+        db_uri=os.getenv("DATABASE_URL", "postgresql://user:pass@db/citp"),
+        output_dir=args.output,
+        labels_path=args.labels_path,
+        labels_query=args.labels_query,
+        include_distinct=not args.no_distinct,
+        chunk_size=args.chunk_size,
+        max_workers=args.workers,
+    )
+    paths = builder.build(date.fromisoformat(args.start_date), date.fromisoformat(args.end_date))
+    print(f"Wrote {len(paths)} files to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Convert telemetry and telemetry_hourly_agg to range-partitioned tables in place.
+
+The existing table is not copied: it becomes a single legacy partition covering
+everything before the cutover (the start of the next day or week), and new
+partitions start at the cutover. Retention later drops the legacy partition
+like any other once it ages out. Index builds and constraint validation run
+online beforehand; the only exclusive lock is held for a short swap.
+"""
+import argparse
+import os
+import logging
+from datetime import datetime
+from sqlalchemy import create_engine, text
+from cloud.db.partitioning import PARTITIONED_TABLES, PartitionManager, period_start, period_end
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Parent-table indexes, matching the models
+INDEXES = {
+    "telemetry": [
+        "CREATE INDEX ix_telemetry_session_id ON telemetry (session_id)",
+        "CREATE INDEX ix_telemetry_user_id ON telemetry (user_id)",
+        "CREATE INDEX ix_telemetry_timestamp_brin ON telemetry USING brin (timestamp)",
+    ],
+    "telemetry_hourly_agg": [
+        "ALTER TABLE telemetry_hourly_agg ADD CONSTRAINT uq_telemetry_hourly_agg_user_hour UNIQUE (user_id, hour)",
+        "CREATE INDEX ix_telemetry_hourly_agg_user_id ON telemetry_hourly_agg (user_id)",
+        "CREATE INDEX ix_telemetry_hourly_agg_hour_brin ON telemetry_hourly_agg USING brin (hour)",
+    ],
+}
+
+
+def prepare(engine, table: str, column: str, cutover: datetime):
+    """Online phase: indexes the partition will need, and a validated range CHECK."""
+    legacy = f"{table}_legacy"
+    # CONCURRENTLY can't run inside a transaction
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {legacy}_id_key ON {table} (id, {column})"))
+        conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {legacy}_brin ON {table} USING brin ({column})"))
+        # Rows that can't go in the legacy range (NULL or future keys) move to the new partitions later
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {legacy}_strays AS SELECT * FROM {table} WITH NO DATA"
+        ))
+        conn.execute(text(f"""
+            WITH moved AS (
+                DELETE FROM {table} WHERE {column} IS NULL OR {column} >= :cutover RETURNING *
+            )
+            INSERT INTO {legacy}_strays SELECT * FROM moved
+        """), {"cutover": cutover})
+        conn.execute(text(f"""
+            ALTER TABLE {table} ADD CONSTRAINT {legacy}_range
+            CHECK ({column} IS NOT NULL AND {column} < '{cutover.isoformat()}') NOT VALID
+        """))
+        # Full scan, but under a lock that doesn't block reads or writes
+        conn.execute(text(f"ALTER TABLE {table} VALIDATE CONSTRAINT {legacy}_range"))
+
+
+def swap(engine, manager: PartitionManager, table: str, column: str, cutover: datetime):
+    """Short exclusive phase: new partitioned parent, legacy table attached as its oldest partition."""
+    legacy = f"{table}_legacy"
+    with engine.begin() as conn:
+        conn.execute(text(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE"))
+        conn.execute(text(f"ALTER TABLE {table} RENAME TO {legacy}"))
+        # Free index names for the parent; the (id, key) index replaces the old primary key
+        conn.execute(text(f"ALTER TABLE {legacy} DROP CONSTRAINT {table}_pkey"))
+        for (index,) in conn.execute(text(
+            "SELECT indexrelid::regclass::text FROM pg_index WHERE indrelid = CAST(:legacy AS regclass)"
+        ), {"legacy": legacy}).fetchall():
+            if not index.startswith(legacy):
+                conn.execute(text(f"ALTER INDEX {index} RENAME TO {legacy}_{index}"))
+
+        conn.execute(text(
+            f"CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS) PARTITION BY RANGE ({column})"
+        ))
+        conn.execute(text(f"ALTER TABLE {table} ADD PRIMARY KEY (id, {column})"))
+        # Keep the id sequence when the legacy partition is eventually dropped
+        conn.execute(text(f"ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id"))
+        for statement in INDEXES[table]:
+            conn.execute(text(statement))
+
+        # The validated CHECK lets SET NOT NULL and ATTACH skip their scans
+        conn.execute(text(f"ALTER TABLE {legacy} ALTER COLUMN {column} SET NOT NULL"))
+        conn.execute(text(
+            f"ALTER TABLE {table} ATTACH PARTITION {legacy} FOR VALUES FROM (MINVALUE) TO ('{cutover.isoformat()}')"
+        ))
+        conn.execute(text(f"ALTER TABLE {legacy} DROP CONSTRAINT {legacy}_range"))
+        manager.ensure_partitions(table, start=cutover, conn=conn)
+        conn.execute(text(f"""
+            WITH moved AS (DELETE FROM {legacy}_strays WHERE {column} IS NOT NULL RETURNING *)
+            INSERT INTO {table} SELECT * FROM moved
+        """))
+        # Rows without a partition key can't be stored in the partitioned table
+        unkeyed = conn.execute(text(f"SELECT COUNT(*) FROM {legacy}_strays")).scalar()
+        if unkeyed:
+            logger.warning(f"{unkeyed} rows with NULL {column} left in {legacy}_strays")
+        else:
+            conn.execute(text(f"DROP TABLE {legacy}_strays"))
+    logger.info(f"{table} is now partitioned; {legacy} holds rows before {cutover}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tables", nargs="+", default=list(PARTITIONED_TABLES),
+                        choices=list(PARTITIONED_TABLES))
+    args = parser.parse_args()
+
+    engine = create_engine(os.getenv("DATABASE_URL", "postgresql://user:pass@db/citp"))
+    manager = PartitionManager(engine)
+    for table in args.tables:
+        if manager.is_partitioned(table):
+            logger.info(f"{table} is already partitioned")
+            continue
+        spec = PARTITIONED_TABLES[table]
+        cutover = period_end(period_start(datetime.utcnow(), spec["interval"]), spec["interval"])
+        prepare(engine, table, spec["column"], cutover)
+        swap(engine, manager, table, spec["column"], cutover)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Replay a traffic sample through the threat intel cache logic and report the hit rate
+with and without subnet-level fallback. No Redis or vendor calls are made.
+
+The sample is a text file with one IP per line, or a CSV with an "ip" column
+(e.g. exported from the telemetry table in timestamp order).
+"""
+import argparse
+import os
+import csv
+from collections import defaultdict
+from cloud.threat_intel.aggregator import subnet_of
+
+def read_sample(path: str):
+    with open(path) as f:
+        if path.endswith(".csv"):
+            for row in csv.DictReader(f):
+                yield row["ip"].strip()
+        else:
+            for line in f:
+                if line.strip():
+                    yield line.strip()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sample", required=True)
+    parser.add_argument("--min-ips", type=int, default=int(os.getenv("THREAT_INTEL_SUBNET_MIN_IPS", "3")),
+                        help="Known IPs a subnet needs before its score is used")
+    args = parser.parse_args()
+
+    seen = set()
+    subnet_ips = defaultdict(set)
+    total = exact_hits = subnet_hits = 0
+    for ip in read_sample(args.sample):
+        total += 1
+        subnet = subnet_of(ip)
+        if ip in seen:
+            exact_hits += 1
+        elif subnet is not None and len(subnet_ips[subnet]) >= args.min_ips:
+            subnet_hits += 1
+        # Every miss (subnet-served or not) is looked up and cached exactly
+        seen.add(ip)
+        if subnet is not None:
+            subnet_ips[subnet].add(ip)
+
+    if not total:
+        print("Empty sample")
+        return
+    print(f"Lookups:                      {total}")
+    print(f"Exact cache hit rate:         {exact_hits / total:.1%}")
+    print(f"With subnet fallback:         {(exact_hits + subnet_hits) / total:.1%}")
+    print(f"Lookups waiting on vendors:   {total - exact_hits} -> {total - exact_hits - subnet_hits}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the AbuseIPDB and VirusTotal APIs, for testing threat intel lookups offline.
+
+Point the aggregator at it with:
+    ABUSEIPDB_URL=http://localhost:8089/api/v2/check
+    ABUSEIPDB_BLOCK_URL=http://localhost:8089/api/v2/check-block
+    VIRUSTOTAL_URL=http://localhost:8089/api/v3/ip_addresses/
+    ABUSEIPDB_API_KEY=stub VIRUSTOTAL_API_KEY=stub
+GET /stats returns per-endpoint request counts, e.g. to check that concurrent
+lookups for one IP were coalesced into a single upstream call.
+"""
+import argparse
+import asyncio
+import hashlib
+import ipaddress
+from collections import Counter
+from aiohttp import web
+
+def _score(ip: str) -> int:
+    # Stable per-IP abuse score so repeated runs are comparable
+    return hashlib.sha256(ip.encode()).digest()[0] * 100 // 255
+
+def make_app(latency: float = 0.05, fail_rate: float = 0.0) -> web.Application:
+    counts = Counter()
+    failures = Counter()
+
+    async def maybe_fail(name: str):
+        await asyncio.sleep(latency)
+        counts[name] += 1
+        # Deterministic: every 1/fail_rate-th request fails
+        if fail_rate and counts[name] % round(1 / fail_rate) == 0:
+            failures[name] += 1
+            raise web.HTTPServiceUnavailable()
+
+    async def abuseipdb_check(request):
+        await maybe_fail("abuseipdb")
+        ip = request.query["ipAddress"]
+        return web.json_response({"data": {"ipAddress": ip, "abuseConfidenceScore": _score(ip)}})
+
+    async def abuseipdb_check_block(request):
+        await maybe_fail("abuseipdb_block")
+        network = ipaddress.ip_network(request.query["network"], strict=False)
+        # Like the real endpoint, only addresses with reports are listed
+        reported = [
+            {"ipAddress": str(address), "abuseConfidenceScore": _score(str(address))}
+            for address in network.hosts() if _score(str(address))
+        ]
+        return web.json_response({"data": {"networkAddress": str(network.network_address),
+                                           "reportedAddress": reported}})
+
+    async def virustotal_ip(request):
+        await maybe_fail("virustotal")
+        malicious = _score(request.match_info["ip"]) // 10
+        return web.json_response({"data": {"attributes": {"last_analysis_stats": {
+            "harmless": 70 - malicious, "malicious": malicious, "suspicious": 0, "undetected": 20
+        }}}})
+
+    async def stats(request):
+        return web.json_response({"requests": dict(counts), "failures": dict(failures)})
+
+    async def reset(request):
+        counts.clear()
+        failures.clear()
+        return web.json_response({"status": "reset"})
+
+    app = web.Application()
+    app.router.add_get("/api/v2/check", abuseipdb_check)
+    app.router.add_get("/api/v2/check-block", abuseipdb_check_block)
+    app.router.add_get("/api/v3/ip_addresses/{ip}", virustotal_ip)
+    app.router.add_get("/stats", stats)
+    app.router.add_post("/reset", reset)
+    return app
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds added to every response")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    args = parser.parse_args()
+    web.run_app(make_app(args.latency, args.fail_rate), port=args.port)
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,7 @@ from sklearn.ensemble import RandomForestClassifier
 import mlflow
 import mlflow.sklearn
 from cloud.model_registry.registry import ModelRegistry
+from cloud.feature_store.feature_store import FEATURE_COLUMNS
 import logging
 import joblib
 
@@ -15,13 +16,18 @@ logging.basicConfig(level=logging.INFO)
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--data", required=True, help="Path to CSV with features and labels")
+    parser.add_argument("--data", required=True,
+                        help="CSV, or Parquet dataset from scripts/build_training_set.py")
     parser.add_argument("--model-name", default="risk_model")
     parser.add_argument("--stage", default="Staging")
     args = parser.parse_args()
 
-    df = pd.read_csv(args.data)
-    X = df.drop("label", axis=1)
+    if args.data.endswith(".csv"):
+        df = pd.read_csv(args.data)
+        X = df.drop("label", axis=1)
+    else:
+        df = pd.read_parquet(args.data)
+        X = df[FEATURE_COLUMNS]
     y = df["label"]
 
     model = RandomForestClassifier(n_estimators=100, max_depth=10)
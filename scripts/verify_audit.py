@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+Verify the audit log's hash chain and Merkle checkpoints over a time range,
+or print and check the inclusion proof of a single entry.
+"""
+import argparse
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+from cloud.audit.chain import AuditChain
+from cloud.db.database import SessionLocal
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--start", type=datetime.fromisoformat, help="UTC, default 1 day before --end")
+    parser.add_argument("--end", type=datetime.fromisoformat, help="UTC, default now")
+    parser.add_argument("--deep", action="store_true", help="Rehash every entry, not just the edge blocks")
+    parser.add_argument("--entry", type=int, help="Audit log id to prove inclusion for")
+    args = parser.parse_args()
+
+    chain = AuditChain(os.getenv("AUDIT_SECRET", "default-audit-secret-change-me"), SessionLocal)
+    if args.entry is not None:
+        proof = chain.inclusion_proof(args.entry)
+        if proof is None:
+            sys.exit(f"Entry {args.entry} is not in a sealed block")
+        ok = chain.verify_inclusion(proof)
+        print(json.dumps({**proof, "ok": ok}, indent=2))
+    else:
+        end = args.end or datetime.utcnow()
+        start = args.start or end - timedelta(days=1)
+        report = chain.verify_range(start, end, deep=args.deep)
+        ok = report["ok"]
+        print(json.dumps(report, indent=2))
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+import os
+
+import pandas as pd
+import pyarrow.fs as pafs
+import pytest
+
+from cloud.data_lake.connector import DataLakeConnector
+
+
+@pytest.fixture
+def connector(tmp_path):
+    return DataLakeConnector(pafs.LocalFileSystem(), str(tmp_path))
+
+
+def test_reupload_replaces_the_days_features(connector):
+    df = pd.DataFrame({"user_id": ["a", "b", "c"], "x": [1.0, 2.0, 3.0]})
+    connector.upload_features("t1", "2026-01-01", df)
+    connector.upload_features("t1", "2026-01-01", df.iloc[:2])
+    assert len(connector.download_features("t1", "2026-01-01")) == 2
+
+
+def test_failed_write_keeps_the_previous_file(connector):
+    df = pd.DataFrame({"user_id": ["a", "b", "c"], "x": [1.0, 2.0, 3.0]})
+    connector.upload_features("t1", "2026-01-01", df)
+
+    def batches():
+        yield df.iloc[:1]
+        raise RuntimeError("source failed")
+
+    with pytest.raises(RuntimeError):
+        connector.write_batches("features", "t1", "2026-01-01", batches(), name="features")
+
+    assert len(connector.download_features("t1", "2026-01-01")) == 3
+    assert os.listdir(connector.partition_path("features", "t1", "2026-01-01")) == ["features.parquet"]
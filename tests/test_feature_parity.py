@@ -0,0 +1,106 @@
+"""Online (rolling window) and offline (training set) features over the same hourly rows."""
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("prometheus_client")
+pytest.importorskip("redis")
+
+from cloud.feature_store.hll import HyperLogLog
+from cloud.feature_store.rolling import RollingFeatureAggregator, _hour_index
+from cloud.feature_store.training_set import point_in_time_features
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+
+    def hset(self, key, mapping):
+        self.calls.append(lambda: self.redis.hashes.setdefault(key, {}).update(
+            {field: str(value) for field, value in mapping.items()}))
+
+    def expire(self, key, ttl):
+        self.calls.append(lambda: True)
+
+    def hgetall(self, key):
+        self.calls.append(lambda: dict(self.redis.hashes.get(key, {})))
+
+    async def execute(self):
+        return [call() for call in self.calls]
+
+
+class FakeDistinctScript:
+    """Python stand-in for _DISTINCT_SCRIPT over sets of values per hourly key."""
+    def __init__(self, redis):
+        self.redis = redis
+
+    def __call__(self, keys, args, client):
+        prefix, hour, _, short, long = args
+
+        def counts():
+            result = []
+            for kind, hours in (("ips", short), ("ips", long), ("devices", short), ("devices", long)):
+                union = set()
+                for h in range(hour - hours, hour):
+                    union |= self.redis.sets.get(f"{prefix}{kind}:{h}", set())
+                result.append(len(union))
+            return result
+        client.calls.append(counts)
+
+
+class FakeRedis:
+    def __init__(self):
+        self.hashes = {}
+        self.sets = {}
+
+    def register_script(self, source):
+        return FakeDistinctScript(self) if "PFMERGE" in source else None
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+def _sketch(values):
+    sketch = HyperLogLog()
+    sketch.update(values)
+    return sketch.to_bytes()
+
+
+def test_online_and_offline_features_match():
+    hour = datetime(2026, 3, 1, 12)
+    hourly = [
+        # (hours before the event's hour, keystroke, mouse, max risk, events, ips, devices)
+        (30, 5.0, 5.0, 80.0, 4, {"10.0.0.1"}, {"d0"}),  # only in the 7d window
+        (24, 10.0, 20.0, 30.0, 2, {"10.0.0.2"}, {"d1"}),  # oldest hour of the 24h window
+        (2, 30.0, 40.0, 10.0, 1, {"10.0.0.3", "10.0.0.2"}, {"d1"}),
+        (1, 50.0, 60.0, 20.0, 3, {"10.0.0.4"}, {"d2"}),
+        (0, 90.0, 90.0, 99.0, 5, {"10.0.0.9"}, {"d9"}),  # the event's own, still filling
+    ]
+    redis = FakeRedis()
+    rows = []
+    for back, keystroke, mouse, risk, n, ips, devices in hourly:
+        at = hour - timedelta(hours=back)
+        rows.append(SimpleNamespace(user_id="u1", hour=at, avg_keystroke_speed=keystroke, avg_mouse_speed=mouse,
+                                    max_risk_score=risk, event_count=n, ip_sketch=_sketch(ips),
+                                    device_sketch=_sketch(devices)))
+        redis.sets[f"features:rolling:{{u1}}:ips:{_hour_index(at)}"] = ips
+        redis.sets[f"features:rolling:{{u1}}:devices:{_hour_index(at)}"] = devices
+
+    rolling = RollingFeatureAggregator(redis)
+    asyncio.run(rolling.reconcile(rows, now=hour))
+    online = asyncio.run(rolling.read("u1", hour))
+
+    agg = pd.DataFrame([vars(row) for row in rows])
+    events = pd.DataFrame({"user_id": ["u1"], "timestamp": [hour + timedelta(minutes=30)]})
+    offline = point_in_time_features(events, agg).iloc[0]
+
+    assert online["event_count"] == offline["event_count"] == 6
+    for name in ("avg_keystroke_speed", "avg_mouse_speed", "max_risk_score_24h", "unique_ips",
+                 "unique_ips_7d", "unique_devices_24h", "unique_devices_7d"):
+        assert online[name] == pytest.approx(offline[name]), name
+    assert online["max_risk_score_24h"] == 30.0
+    assert online["unique_ips_7d"] == 4
@@ -0,0 +1,20 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip("redis")
+
+from cloud.feature_store.rolling import _hour_index, naive_utc
+
+
+def test_aware_timestamps_are_converted_to_utc():
+    naive = datetime(2026, 3, 1, 12, 30)
+    assert naive_utc(naive) is naive
+    assert naive_utc(datetime(2026, 3, 1, 12, 30, tzinfo=timezone.utc)) == naive
+    assert naive_utc(datetime(2026, 3, 1, 14, 30, tzinfo=timezone(timedelta(hours=2)))) == naive
+
+
+def test_hour_index_accepts_aware_timestamps():
+    naive = datetime(2026, 3, 1, 12, 30)
+    assert _hour_index(datetime.fromisoformat("2026-03-01T12:30:00+00:00")) == _hour_index(naive)
+    assert _hour_index(datetime(2026, 3, 1, 7, 30, tzinfo=timezone(timedelta(hours=-5)))) == _hour_index(naive)
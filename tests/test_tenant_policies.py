@@ -0,0 +1,64 @@
+"""Ingested telemetry carries the caller's tenant through to tenant-scoped policy rules."""
+import asyncio
+import os
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("prometheus_client")
+# Read when the auth module is imported
+os.environ.setdefault("JWT_SECRET_KEY", "test-secret")
+
+from cloud.api.v2 import ingest
+from cloud.engine.policy import PolicyEngine
+
+
+class Tasks:
+    def __init__(self):
+        self.queued = []
+
+    def add_task(self, func, *args):
+        self.queued.append(args)
+
+
+def ingest_as(monkeypatch, current_user):
+    """The telemetry dict ``ingest_telemetry`` queues for ``current_user``."""
+    monkeypatch.setattr(ingest, "get_audit_writer", lambda: SimpleNamespace(log=lambda **kwargs: None))
+    event = ingest.TelemetryEvent(session_id="s1", user_id="u1", ip="203.0.113.5", keystroke_speed=40,
+                                  mouse_speed=30, timestamp=datetime(2026, 1, 1, 12))
+    tasks = Tasks()
+    asyncio.run(ingest.ingest_telemetry(event, tasks, current_user))
+    (telemetry,), = tasks.queued
+    return telemetry
+
+
+def context_for(telemetry, trust_score):
+    """The fields of the processor's policy context these rules look at."""
+    return {"trust_score": trust_score, "user_id": telemetry["user_id"], "tenant_id": telemetry.get("tenant_id")}
+
+
+@pytest.fixture
+def engine():
+    engine = PolicyEngine(db_session_factory=None)
+    engine._install([
+        SimpleNamespace(id=1, name="tenant-7-low-trust", action="block", priority=1, tenant_id=7,
+                        condition={"trust_score": {"lt": 50}}),
+    ])
+    return engine
+
+
+def test_tenant_rule_fires_for_that_tenants_events(monkeypatch, engine):
+    telemetry = ingest_as(monkeypatch, {"sub": "u1", "role": "standard", "user_id": 1, "tenant_id": 7})
+    assert telemetry["tenant_id"] == "7"
+
+    context = context_for(telemetry, trust_score=20)
+    assert engine.evaluate(context) == [{"action": "block", "rule": "tenant-7-low-trust"}]
+
+
+def test_tenant_rule_ignores_other_tenants_and_platform_accounts(monkeypatch, engine):
+    for tenant_id in (8, None):
+        telemetry = ingest_as(monkeypatch, {"sub": "u1", "role": "standard", "user_id": 1, "tenant_id": tenant_id})
+        context = context_for(telemetry, trust_score=20)
+        assert engine.evaluate(context) == []
@@ -0,0 +1,172 @@
+"""Threat intel lookups against scripts/threat_intel_stub.py, served in-process."""
+import asyncio
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("prometheus_client")
+pytest.importorskip("redis")
+test_utils = pytest.importorskip("aiohttp.test_utils")
+
+from aiohttp import web
+
+from cloud.threat_intel.aggregator import ThreatIntelAggregator
+
+_spec = importlib.util.spec_from_file_location(
+    "threat_intel_stub", Path(__file__).resolve().parents[1] / "scripts" / "threat_intel_stub.py")
+threat_intel_stub = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(threat_intel_stub)
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+
+    def __len__(self):
+        return len(self.calls)
+
+    def setex(self, key, ttl, value):
+        self.calls.append(lambda: self.redis.values.__setitem__(key, value))
+
+    def hset(self, key, field, value):
+        self.calls.append(lambda: self.redis.hashes.setdefault(key, {}).__setitem__(field, str(value)))
+
+    def hdel(self, key, field):
+        self.calls.append(lambda: self.redis.hashes.get(key, {}).pop(field, None))
+
+    def hlen(self, key):
+        self.calls.append(lambda: len(self.redis.hashes.get(key, {})))
+
+    def expire(self, key, ttl):
+        self.calls.append(lambda: True)
+
+    async def execute(self):
+        return [call() for call in self.calls]
+
+
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+        self.hashes = {}
+
+    async def mget(self, *keys):
+        if len(keys) == 1 and isinstance(keys[0], list):
+            keys = keys[0]
+        return [self.values.get(key) for key in keys]
+
+    async def hvals(self, key):
+        return list(self.hashes.get(key, {}).values())
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+@pytest.fixture
+def sources(monkeypatch):
+    monkeypatch.setenv("ABUSEIPDB_API_KEY", "stub")
+    monkeypatch.setenv("VIRUSTOTAL_API_KEY", "stub")
+    monkeypatch.setenv("THREAT_INTEL_SUBNET_ENABLED", "false")
+    return monkeypatch
+
+
+def run_against_stub(check, latency=0.05):
+    """Run ``check(aggregator, client, connections)`` with the aggregator pointed at a fresh stub."""
+    app = threat_intel_stub.make_app(latency=latency)
+    connections = set()
+
+    @web.middleware
+    async def track_connections(request, handler):
+        if request.path.startswith("/api/"):
+            connections.add(id(request.transport))
+        return await handler(request)
+    app.middlewares.append(track_connections)
+
+    async def main():
+        async with test_utils.TestClient(test_utils.TestServer(app)) as client:
+            with pytest.MonkeyPatch.context() as mp:
+                mp.setenv("ABUSEIPDB_URL", str(client.make_url("/api/v2/check")))
+                mp.setenv("ABUSEIPDB_BLOCK_URL", str(client.make_url("/api/v2/check-block")))
+                mp.setenv("VIRUSTOTAL_URL", str(client.make_url("/api/v3/ip_addresses/")))
+                aggregator = ThreatIntelAggregator(FakeRedis())
+            try:
+                await check(aggregator, client, connections)
+            finally:
+                await aggregator.close()
+    asyncio.run(main())
+
+
+async def requests_served(client):
+    return (await (await client.get("/stats")).json())["requests"]
+
+
+def test_concurrent_lookups_for_one_ip_share_one_upstream_call(sources):
+    async def check(aggregator, client, connections):
+        scores = await asyncio.gather(*(aggregator.check_ip("198.51.100.7") for _ in range(20)))
+        assert len(set(scores)) == 1
+        assert await requests_served(client) == {"abuseipdb": 1, "virustotal": 1}
+        assert aggregator._inflight == {}
+    run_against_stub(check)
+
+
+def test_cancelling_the_first_caller_keeps_the_shared_lookup(sources):
+    async def check(aggregator, client, connections):
+        first = asyncio.ensure_future(aggregator.check_ip("198.51.100.7"))
+        await asyncio.sleep(0.01)
+        second = asyncio.ensure_future(aggregator.check_ip("198.51.100.7"))
+        await asyncio.sleep(0.01)
+        first.cancel()
+
+        score = await second
+        assert score != aggregator.fallback_score
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        assert await requests_served(client) == {"abuseipdb": 1, "virustotal": 1}
+        # The result was cached, so the next lookup doesn't go upstream
+        assert await aggregator.check_ip("198.51.100.7") == score
+        assert await requests_served(client) == {"abuseipdb": 1, "virustotal": 1}
+    run_against_stub(check)
+
+
+def test_sequential_lookups_reuse_pooled_connections(sources):
+    sources.setenv("VIRUSTOTAL_RATE_LIMIT", "100/minute")
+
+    async def check(aggregator, client, connections):
+        for i in range(5):
+            await aggregator.check_ip(f"198.51.{i}.7")
+        assert await requests_served(client) == {"abuseipdb": 5, "virustotal": 5}
+        # Each lookup queries both sources at once; later lookups reuse those connections
+        assert len(connections) <= 2
+    run_against_stub(check)
+
+
+def test_rate_limited_source_is_skipped_and_the_ip_answered_with_the_fallback(sources):
+    sources.delenv("VIRUSTOTAL_API_KEY")
+    sources.setenv("ABUSEIPDB_RATE_LIMIT", "2/hour")
+    sources.setenv("THREAT_INTEL_RATE_LIMIT_WAIT", "0")
+
+    async def check(aggregator, client, connections):
+        scores = [await aggregator.check_ip(f"198.51.{i}.7") for i in range(4)]
+        assert await requests_served(client) == {"abuseipdb": 2}
+        assert scores[2:] == [aggregator.fallback_score] * 2
+        assert aggregator.redis.values[aggregator._negative_key("198.51.3.7")] == "1"
+    run_against_stub(check)
+
+
+def test_cancelled_probe_gives_the_half_open_breaker_back(sources):
+    async def check(aggregator, client, connections):
+        config = aggregator.apis["abuseipdb"]
+        breaker = config["breaker"]
+        breaker.recovery_timeout = 0
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+
+        probe = asyncio.ensure_future(aggregator._call_source("abuseipdb", config, asyncio.sleep(10)))
+        await asyncio.sleep(0.01)
+        assert breaker.state == breaker.HALF_OPEN
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        assert breaker.allow()
+    run_against_stub(check)
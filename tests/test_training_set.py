@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("prometheus_client")
+pytest.importorskip("redis")
+
+from cloud.feature_store.hll import HyperLogLog
+from cloud.feature_store.training_set import point_in_time_features
+
+
+def _sketch(*values):
+    sketch = HyperLogLog()
+    sketch.update(values)
+    return sketch.to_bytes()
+
+
+def _agg(rows):
+    return pd.DataFrame(rows, columns=[
+        "user_id", "hour", "avg_keystroke_speed", "avg_mouse_speed", "max_risk_score",
+        "event_count", "ip_sketch", "device_sketch",
+    ])
+
+
+def test_event_does_not_see_its_own_hour():
+    hour = datetime(2026, 3, 1, 12)
+    agg = _agg([
+        ("u1", hour - timedelta(hours=2), 10.0, 20.0, 30.0, 2, _sketch("1.1.1.1"), _sketch("d1")),
+        ("u1", hour - timedelta(hours=1), 30.0, 40.0, 10.0, 1, _sketch("1.1.1.2"), _sketch("d1")),
+        # The event's own hour: includes the event's risk score and later events
+        ("u1", hour, 90.0, 90.0, 99.0, 5, _sketch("9.9.9.9", "8.8.8.8"), _sketch("d9")),
+    ])
+    events = pd.DataFrame({"user_id": ["u1"], "timestamp": [hour + timedelta(minutes=30)]})
+
+    features = point_in_time_features(events, agg).iloc[0]
+
+    assert features["event_count"] == 3
+    assert features["max_risk_score_24h"] == 30.0
+    assert features["avg_keystroke_speed"] == 20.0
+    assert features["unique_ips"] == 2
+    assert features["unique_devices_24h"] == 1
+
+
+def test_first_event_of_a_user_has_empty_window():
+    hour = datetime(2026, 3, 1, 12)
+    agg = _agg([("u1", hour, 50.0, 50.0, 80.0, 1, _sketch("1.1.1.1"), _sketch("d1"))])
+    events = pd.DataFrame({"user_id": ["u1"], "timestamp": [hour + timedelta(minutes=5)]})
+
+    features = point_in_time_features(events, agg).iloc[0]
+
+    assert features["event_count"] == 0
+    assert features["max_risk_score_24h"] == 0.0
+    assert features["unique_ips"] == 0
+    assert features["unique_ips_7d"] == 0
+
+
+def test_window_excludes_hours_older_than_24h():
+    hour = datetime(2026, 3, 1, 12)
+    agg = _agg([
+        ("u1", hour - timedelta(hours=25), 10.0, 10.0, 70.0, 4, _sketch("1.1.1.1"), _sketch("d1")),
+        ("u1", hour - timedelta(hours=24), 10.0, 10.0, 20.0, 1, _sketch("1.1.1.2"), _sketch("d2")),
+    ])
+    events = pd.DataFrame({"user_id": ["u1"], "timestamp": [hour]})
+
+    features = point_in_time_features(events, agg).iloc[0]
+
+    assert features["event_count"] == 1
+    assert features["max_risk_score_24h"] == 20.0
+    assert features["unique_ips"] == 1
+    assert features["unique_ips_7d"] == 2